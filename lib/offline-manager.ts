@@ -226,11 +226,18 @@ class OfflineManager {
       })
 
       if (resp.ok) {
-        // Mark items as synced and clear them locally
-        this.syncQueue.forEach((i) => (i.synced = true))
-        this.syncQueue = []
+        // Clear everything the server has settled; keep records it asked us to retry
+        const body = await resp.json().catch(() => null)
+        const results: { operation_id: string; status: string; error?: string }[] = body?.data?.results || []
+        const retry = new Set(results.filter((r) => r.status === "retry").map((r) => r.operation_id))
+        results
+          .filter((r) => r.status === "rejected")
+          .forEach((r) => console.warn(`[sync] Record ${r.operation_id} rejected: ${r.error}`))
+
+        this.syncQueue.forEach((i) => (i.synced = !retry.has(i.id)))
         await this.saveSyncQueue()
-        console.log(`[sync] Uploaded ${records.length} pending records; local queue cleared`)
+        this.syncQueue = this.syncQueue.filter((i) => !i.synced)
+        console.log(`[sync] Uploaded ${records.length} pending records; ${this.syncQueue.length} left to retry`)
       } else {
         const text = await resp.text().catch(() => "")
         console.warn(`[sync] Server returned ${resp.status}: ${text}`)
@@ -251,9 +258,11 @@ class OfflineManager {
   // Provide a stable snapshot suitable for server handoff during "pending sync" API
   getPendingRecordsForServer() {
     return this.syncQueue.map((item) => ({
+      operation_id: item.id,
       table_name: item.type,
       record_id: (item.data && (item.data.id || item.id)) ?? item.id,
       operation_type: item.action,
+      data: item.data,
       timestamp: item.timestamp,
     }))
   }
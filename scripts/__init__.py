@@ -2,6 +2,6 @@
 POLMED Backend Application Package
 """
 
-from database import get_db_connection, close_db_connection
+from database import get_db_connection, close_db_connection, get_request_db
 
-__all__ = ['get_db_connection', 'close_db_connection']
+__all__ = ['get_db_connection', 'close_db_connection', 'get_request_db']
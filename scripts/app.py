@@ -14,7 +14,13 @@ load_dotenv()
 
 # Import configurations and database
 from config import Config
-from database import get_db_connection
+from database import get_db_connection, get_request_db, get_pool_stats, init_app as init_db
+from auth import get_token_cache_stats, init_app as init_auth
+from permissions import get_permission_stats
+from dashboard_metrics import get_dashboard_metrics, get_metrics_refresh_stats
+from response_cache import cached_response, get_response_cache_stats
+from dispensing import get_dispensing_stats
+from appointment_availability import get_availability_stats
 
 # Import all route blueprints
 from auth_routes import auth_bp
@@ -39,6 +45,12 @@ def create_app(config_class=Config):
         }
     })
     
+    # Request-scoped database connections (released in teardown)
+    init_db(app)
+    
+    # JWT signing settings and verified-token cache
+    init_auth(app)
+    
     # Register all blueprints
     app.register_blueprint(auth_bp)
     app.register_blueprint(patients_bp)
@@ -68,6 +80,13 @@ def create_app(config_class=Config):
             'status': 'healthy',
             'timestamp': datetime.now(timezone.utc).isoformat(),
             'database': db_status,
+            'connection_pool': get_pool_stats(),
+            'token_cache': get_token_cache_stats(),
+            'permissions': get_permission_stats(),
+            'response_cache': get_response_cache_stats(),
+            'dispensing': get_dispensing_stats(),
+            'availability': get_availability_stats(),
+            'metrics_refresh': get_metrics_refresh_stats(),
             'version': '2.0.0'
         })
     
@@ -94,58 +113,22 @@ def create_app(config_class=Config):
 
     # Dashboard endpoint
     @app.route('/api/dashboard/stats', methods=['GET'])
+    @cached_response(tags=('clinical', 'patients', 'appointments', 'routes', 'inventory'))
     def dashboard_stats():
         """Get dashboard statistics"""
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            
-            # Get basic stats - using safe queries with COALESCE
-            stats = {}
-            
-            # Today's patient visits (no is_active column, use visit_status)
-            today = datetime.now().date()
-            cursor.execute("""
-                SELECT COALESCE(COUNT(*), 0) as count FROM patient_visits 
-                WHERE visit_date = %s AND visit_status != 'cancelled'
-            """, (today,))
-            result = cursor.fetchone()
-            stats['today_patients'] = result['count']
+            conn = get_request_db()
             
-            # Total active patients (has is_active column)
-            cursor.execute("""
-                SELECT COALESCE(COUNT(*), 0) as count FROM patients 
-                WHERE is_active = 1
-            """)
-            result = cursor.fetchone()
-            stats['total_patients'] = result['count']
+            # Precomputed row from daily_metrics (see dashboard_metrics.py)
+            metrics = get_dashboard_metrics(conn)
             
-            # Active routes (has is_active column)
-            cursor.execute("""
-                SELECT COALESCE(COUNT(*), 0) as count FROM routes 
-                WHERE is_active = 1 AND (end_date IS NULL OR end_date >= CURDATE())
-            """)
-            result = cursor.fetchone()
-            stats['active_routes'] = result['count']
-            
-            # Scheduled/booked appointments (no is_active column, use status)
-            cursor.execute("""
-                SELECT COALESCE(COUNT(*), 0) as count FROM appointments
-                WHERE status IN ('booked', 'available')
-            """)
-            result = cursor.fetchone()
-            stats['total_appointments'] = result['count']
-            
-            # Total users
-            cursor.execute("""
-                SELECT COALESCE(COUNT(*), 0) as count FROM users 
-                WHERE is_active = 1
-            """)
-            result = cursor.fetchone()
-            stats['active_users'] = result['count']
-            
-            cursor.close()
-            conn.close()
+            stats = {
+                'today_patients': metrics['total_visits'] - metrics['cancelled_visits'],
+                'total_patients': metrics['total_patients'],
+                'active_routes': metrics['active_routes'],
+                'total_appointments': metrics['upcoming_appointments'],
+                'active_users': metrics['active_users']
+            }
             
             return jsonify({
                 'success': True,
@@ -0,0 +1,339 @@
+"""
+POLMED Backend - Appointment Availability Index
+In-memory index behind the public /api/appointments/available endpoint
+
+Each worker keeps every upcoming bookable location (active location on an
+active route, visit_date today or later) keyed by
+(province, visit_date, location_type). Lookups never touch MySQL:
+- the index is loaded on first use and reloaded every
+  AVAILABILITY_FULL_RELOAD seconds;
+- in between, at most every AVAILABILITY_REFRESH_INTERVAL seconds, only
+  locations and routes whose updated_at moved since the last check are
+  re-read (booking and cancelling touch the location's slot counter, so they
+  show up here). Like the sync feed, the check looks back
+  SYNC_CHANGES_SAFETY_LAG seconds so late commits are not missed;
+- a book or cancel in this worker marks the index stale so the next lookup
+  re-reads the changes straight away.
+Rendered responses are memoised per query until the index changes (or the
+day does, since "upcoming" moves with it), so
+portal spikes are served from memory; the route adds an ETag and a short
+public Cache-Control so shared caches absorb most of the rest.
+
+For "clinics near me", listings with GPS coordinates are also bucketed in a
+grid of GEO_CELL_DEGREES cells. A near= lookup only measures the listings
+in the cells overlapping the search radius, then returns the k nearest.
+Near lookups are cheap and their coordinates rarely repeat, so they are not
+memoised.
+"""
+
+import math
+import threading
+import time
+from datetime import date
+
+from config import Config
+
+LOCATION_COLUMNS = """
+    l.id AS location_id,
+    l.location_name,
+    l.location_type,
+    l.address,
+    l.visit_date,
+    r.route_name,
+    r.province,
+    l.gps_latitude,
+    l.gps_longitude,
+    (COALESCE(l.max_appointments, 0) - l.booked_appointments) AS available_slots,
+    l.max_appointments
+"""
+
+FULL_LOAD_SQL = f"""
+    SELECT {LOCATION_COLUMNS}
+    FROM locations l
+    JOIN routes r ON l.route_id = r.id
+    WHERE l.is_active = TRUE
+        AND r.is_active = TRUE
+        AND l.visit_date >= CURDATE()
+"""
+
+# Changed locations, and the locations of changed routes; `listed` says
+# whether the row still belongs in the index
+CHANGES_SQL = f"""
+    SELECT {LOCATION_COLUMNS}, (l.is_active AND r.is_active) AS listed
+    FROM locations l
+    JOIN routes r ON l.route_id = r.id
+    WHERE l.updated_at >= %s
+    UNION
+    SELECT {LOCATION_COLUMNS}, (l.is_active AND r.is_active) AS listed
+    FROM routes r
+    JOIN locations l ON l.route_id = r.id
+    WHERE r.updated_at >= %s
+"""
+
+EARTH_RADIUS_KM = 6371.0088
+GEO_CELL_DEGREES = 0.25  # about 28 km north-south
+
+
+def _cell(latitude, longitude):
+    return (math.floor(float(latitude) / GEO_CELL_DEGREES), math.floor(float(longitude) / GEO_CELL_DEGREES))
+
+
+def _distance_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class AvailabilityIndex:
+    """location_id -> listing row, grouped by (province, visit_date, location_type)"""
+
+    def __init__(self, refresh_interval=5, full_reload=3600, max_rendered=256):
+        self.refresh_interval = refresh_interval
+        self.full_reload = full_reload
+        self.max_rendered = max_rendered
+        self._lock = threading.Lock()        # guards the index itself
+        self._refresh_lock = threading.Lock()  # one refreshing thread per worker
+        self._rows = {}       # location_id -> row
+        self._groups = {}     # (province, visit_date, location_type) -> {location_id}
+        self._cells = {}      # geo grid cell -> {location_id}
+        self._rendered = {}   # query key -> rendered response, for the current version
+        self._rendered_day = None  # date the memoised responses were rendered on
+        self.version = 0
+        self._loaded_at = None
+        self._checked_at = None
+        self._since = None    # database time to read changes from
+        self._stale = False
+        self.loads = 0
+        self.refreshes = 0
+
+    def _put(self, row):
+        location_id = row['location_id']
+        previous = self._rows.get(location_id)
+        if previous == row:
+            return False
+        if previous is not None:
+            self._unlink(previous)
+        self._rows[location_id] = row
+        self._groups.setdefault(
+            (row['province'], row['visit_date'], row['location_type']), set()
+        ).add(location_id)
+        if row['gps_latitude'] is not None and row['gps_longitude'] is not None:
+            self._cells.setdefault(_cell(row['gps_latitude'], row['gps_longitude']), set()).add(location_id)
+        return True
+
+    def _unlink(self, row):
+        key = (row['province'], row['visit_date'], row['location_type'])
+        ids = self._groups.get(key)
+        if ids is not None:
+            ids.discard(row['location_id'])
+            if not ids:
+                del self._groups[key]
+        if row['gps_latitude'] is not None and row['gps_longitude'] is not None:
+            cell = _cell(row['gps_latitude'], row['gps_longitude'])
+            ids = self._cells.get(cell)
+            if ids is not None:
+                ids.discard(row['location_id'])
+                if not ids:
+                    del self._cells[cell]
+
+    def _drop(self, location_id):
+        row = self._rows.pop(location_id, None)
+        if row is None:
+            return False
+        self._unlink(row)
+        return True
+
+    def _changed(self):
+        self.version += 1
+        self._rendered.clear()
+
+    def _database_time(self, cursor):
+        cursor.execute("SELECT NOW() - INTERVAL %s SECOND AS since", (Config.SYNC_CHANGES_SAFETY_LAG,))
+        return cursor.fetchone()['since']
+
+    def _load(self, cursor):
+        since = self._database_time(cursor)
+        cursor.execute(FULL_LOAD_SQL)
+        rows = cursor.fetchall()
+        with self._lock:
+            self._rows = {}
+            self._groups = {}
+            self._cells = {}
+            for row in rows:
+                self._put(row)
+            self._changed()
+            self._since = since
+            self.loads += 1
+
+    def _apply_changes(self, cursor):
+        since = self._database_time(cursor)
+        cursor.execute(CHANGES_SQL, (self._since, self._since))
+        rows = cursor.fetchall()
+        with self._lock:
+            changed = False
+            for row in rows:
+                listed = row.pop('listed')
+                if listed:
+                    changed = self._put(row) or changed
+                else:
+                    changed = self._drop(row['location_id']) or changed
+            if changed:
+                self._changed()
+            self._since = since
+            self.refreshes += 1
+
+    def _due(self, now):
+        # _checked_at is None until the first load has finished
+        return self._stale or self._checked_at is None or now - self._checked_at >= self.refresh_interval
+
+    def refresh(self, get_db):
+        """
+        Bring the index up to date if it is due. get_db is only called (and a
+        connection only checked out) when it is.
+        """
+        now = time.monotonic()
+        if self._loaded_at is None:
+            # First use: everyone waits for the initial load
+            self._refresh_lock.acquire()
+            if self._loaded_at is not None and not self._due(now):
+                self._refresh_lock.release()
+                return
+        elif not self._due(now) or not self._refresh_lock.acquire(blocking=False):
+            # Not due, or another thread is refreshing; serve what we have
+            return
+
+        try:
+            self._stale = False
+            cursor = get_db().cursor(dictionary=True)
+            try:
+                if self._loaded_at is None or now - self._loaded_at >= self.full_reload:
+                    self._load(cursor)
+                    self._checked_at = now
+                    self._loaded_at = now
+                else:
+                    self._apply_changes(cursor)
+                    self._checked_at = now
+            finally:
+                cursor.close()
+        except Exception:
+            self._stale = True
+            raise
+        finally:
+            self._refresh_lock.release()
+
+    def mark_stale(self):
+        """Re-read changes on the next lookup (after a book/cancel in this worker)"""
+        self._stale = True
+
+    def _cell_ids(self, latitude, longitude, radius_km):
+        """Listings in the grid cells overlapping the radius's bounding box"""
+        lat_span = math.degrees(radius_km / EARTH_RADIUS_KM)
+        lng_span = lat_span / max(math.cos(math.radians(latitude)), 0.01)
+        low = _cell(max(latitude - lat_span, -90), longitude - lng_span)
+        high = _cell(min(latitude + lat_span, 90), longitude + lng_span)
+        for lat_cell in range(low[0], high[0] + 1):
+            for lng_cell in range(low[1], high[1] + 1):
+                yield from self._cells.get((lat_cell, lng_cell), ())
+
+    def lookup(self, province=None, date_from=None, date_to=None, location_type=None,
+               near=None, radius_km=None, limit=None):
+        """
+        Listings with free slots, ordered by visit date. With near=(lat, lng),
+        only those within radius_km, nearest first (at most `limit`), each
+        with distance_km.
+        """
+        today = date.today()
+        date_from = max(date_from or today, today)
+
+        def wanted(row):
+            return (
+                (row['available_slots'] or 0) > 0
+                and (not province or row['province'] == province)
+                and row['visit_date'] >= date_from
+                and (date_to is None or row['visit_date'] <= date_to)
+                and (not location_type or row['location_type'] == location_type)
+            )
+
+        with self._lock:
+            if near is None:
+                ids = [
+                    location_id
+                    for (group_province, visit_date, group_type), group in self._groups.items()
+                    if (not province or group_province == province)
+                    and visit_date >= date_from
+                    and (date_to is None or visit_date <= date_to)
+                    and (not location_type or group_type == location_type)
+                    for location_id in group
+                ]
+                rows = [self._rows[location_id] for location_id in ids if (self._rows[location_id]['available_slots'] or 0) > 0]
+            else:
+                rows = [
+                    self._rows[location_id]
+                    for location_id in self._cell_ids(near[0], near[1], radius_km)
+                    if wanted(self._rows[location_id])
+                ]
+
+        if near is None:
+            rows.sort(key=lambda row: (row['visit_date'], row['location_id']))
+            return [dict(row) for row in rows]
+
+        nearby = []
+        for row in rows:
+            distance = _distance_km(near[0], near[1], float(row['gps_latitude']), float(row['gps_longitude']))
+            if distance <= radius_km:
+                nearby.append((distance, row))
+        nearby.sort(key=lambda item: (item[0], item[1]['visit_date'], item[1]['location_id']))
+        return [dict(row, distance_km=round(distance, 2)) for distance, row in nearby[:limit]]
+
+    def rendered(self, key, render):
+        """Memoise render() per query key until the index or the day next changes"""
+        today = date.today()
+        with self._lock:
+            if self._rendered_day != today:
+                self._rendered.clear()
+                self._rendered_day = today
+            version = self.version
+            cached = self._rendered.get(key)
+        if cached is not None:
+            return cached
+
+        result = render()
+        with self._lock:
+            if self.version == version and self._rendered_day == today:
+                if len(self._rendered) >= self.max_rendered:
+                    self._rendered.pop(next(iter(self._rendered)))
+                self._rendered[key] = result
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'locations': len(self._rows),
+                'groups': len(self._groups),
+                'geo_cells': len(self._cells),
+                'rendered': len(self._rendered),
+                'version': self.version,
+                'loads': self.loads,
+                'refreshes': self.refreshes,
+            }
+
+
+_index = AvailabilityIndex(
+    refresh_interval=Config.AVAILABILITY_REFRESH_INTERVAL,
+    full_reload=Config.AVAILABILITY_FULL_RELOAD
+)
+
+
+def get_availability_index(get_db):
+    """The worker's index, refreshed if due (get_db e.g. get_request_db)"""
+    _index.refresh(get_db)
+    return _index
+
+
+def mark_availability_stale():
+    _index.mark_stale()
+
+
+def get_availability_stats():
+    """Get availability index metrics for the current worker"""
+    return _index.stats()
@@ -0,0 +1,138 @@
+"""
+POLMED Backend - Appointment Slot Counters
+Race-free booking capacity for clinic locations
+
+Each location keeps booked_appointments, the number of its appointments that
+hold a slot (confirmed or pending). Booking takes a slot with one conditional
+UPDATE (booked_appointments < max_appointments), so concurrent bookings for a
+location serialise on its row lock for the length of one short transaction
+and can never oversell; nothing recounts appointments. Status changes that
+move an appointment into or out of a slot-holding status give the slot back
+(or take it) in the same transaction. `python appointment_slots.py` rebuilds
+the counters from appointments.
+"""
+
+import sys
+from datetime import date, datetime, timezone
+
+SLOT_HOLDING_STATUSES = ('confirmed', 'pending')
+
+RESERVE_SQL = """
+    UPDATE locations
+    SET booked_appointments = booked_appointments + 1
+    WHERE id = %s AND is_active = TRUE AND booked_appointments < max_appointments
+"""
+
+
+class SlotUnavailableError(Exception):
+    """A booking that cannot take a slot; `status` is the HTTP status to report (404 or 409)"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def reserve_slot(cursor, location_id):
+    """
+    Take one slot at a location and return the location's visit_date and
+    location_name. Does not commit; the location row stays locked until the
+    caller commits, so keep the rest of the transaction short.
+    Raises SlotUnavailableError if the location is missing or full.
+    """
+    cursor.execute(RESERVE_SQL, (location_id,))
+    matched = cursor.rowcount == 1
+
+    cursor.execute(
+        "SELECT visit_date, location_name FROM locations WHERE id = %s AND is_active = TRUE",
+        (location_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        raise SlotUnavailableError('Location not found', 404)
+    if not matched:
+        raise SlotUnavailableError('No available slots at this location', 409)
+    return row if isinstance(row, dict) else dict(zip(cursor.column_names, row))
+
+
+def set_appointment_status(cursor, appointment_id, status, cancellation_reason=''):
+    """
+    Change an appointment's status and move its slot with it. Does not
+    commit. Returns the dashboard metric deltas for the change (see
+    appointment_metric_deltas), or None if the appointment does not exist.
+    """
+    cursor.execute(
+        "SELECT location_id, appointment_status, appointment_date FROM appointments WHERE id = %s FOR UPDATE",
+        (appointment_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    location_id, previous, appointment_date = (
+        (row['location_id'], row['appointment_status'], row['appointment_date']) if isinstance(row, dict) else row
+    )
+
+    cursor.execute(
+        """
+        UPDATE appointments
+        SET appointment_status = %s, cancellation_reason = %s, updated_at = %s
+        WHERE id = %s
+        """,
+        (status, cancellation_reason, datetime.now(timezone.utc), appointment_id)
+    )
+
+    delta = (status in SLOT_HOLDING_STATUSES) - (previous in SLOT_HOLDING_STATUSES)
+    if delta and location_id is not None:
+        cursor.execute(
+            "UPDATE locations SET booked_appointments = GREATEST(booked_appointments + %s, 0) WHERE id = %s",
+            (delta, location_id)
+        )
+    return appointment_metric_deltas(previous, status, appointment_date)
+
+
+def appointment_metric_deltas(previous, status, appointment_date):
+    """
+    record_metrics() deltas for an appointment moving from `previous` to
+    `status`: the upcoming/pending gauges only count appointments from today on.
+    """
+    if appointment_date is None or appointment_date < date.today():
+        return {}
+    return {
+        'upcoming_appointments': (status in SLOT_HOLDING_STATUSES) - (previous in SLOT_HOLDING_STATUSES),
+        'pending_appointments': (status == 'pending') - (previous == 'pending'),
+    }
+
+
+def rebuild_slot_counters(db_conn):
+    """Recompute booked_appointments for every location. Does not commit."""
+    cursor = db_conn.cursor()
+    cursor.execute(
+        f"""
+        UPDATE locations l
+        LEFT JOIN (
+            SELECT location_id, COUNT(*) AS booked
+            FROM appointments
+            WHERE appointment_status IN ({', '.join(['%s'] * len(SLOT_HOLDING_STATUSES))})
+            GROUP BY location_id
+        ) a ON a.location_id = l.id
+        SET l.booked_appointments = COALESCE(a.booked, 0)
+        """,
+        SLOT_HOLDING_STATUSES
+    )
+    count = cursor.rowcount
+    cursor.close()
+    return count
+
+
+if __name__ == '__main__':
+    from database import get_db_connection, close_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    try:
+        changed = rebuild_slot_counters(conn)
+        conn.commit()
+        print(f"Rebuilt booked_appointments ({changed} locations changed)")
+    finally:
+        close_db_connection(conn)
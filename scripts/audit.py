@@ -0,0 +1,262 @@
+"""
+POLMED Backend - Audit Log Writer
+Single entry point for audit_log writes
+
+Handlers call log_action() instead of inserting into audit_log themselves.
+Entries are buffered against the caller's transaction and written when it
+commits:
+
+- transactional actions (AUDIT_TRANSACTIONAL_ACTIONS) are inserted in one
+  multi-row statement just before COMMIT, so they succeed or fail with the
+  change they describe;
+- all other actions are handed to a per-worker background writer after the
+  commit succeeds and flushed in batches every AUDIT_FLUSH_INTERVAL seconds.
+  A worker crash can lose at most one interval of these entries. A batch
+  that fails AUDIT_MAX_RETRIES flushes in a row is written row by row and
+  rows the database still rejects are logged and dropped, so one bad row
+  cannot hold up the queue.
+
+Entries for a transaction that rolls back are discarded.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import mysql.connector
+from flask import has_request_context, request
+
+from config import Config
+from database import Database
+
+AUDIT_INSERT_SQL = """
+    INSERT INTO audit_log (
+        user_id, table_name, record_id, action, old_values, new_values,
+        ip_address, user_agent, created_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Connection-level errors: the rows are fine, try them again later
+TRANSIENT_ERRORS = (mysql.connector.InterfaceError, mysql.connector.OperationalError)
+
+logger = logging.getLogger(__name__)
+
+
+def _json(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = {'info': value}
+    return json.dumps(value, default=str)
+
+
+def is_transactional(action):
+    return action.upper() in Config.AUDIT_TRANSACTIONAL_ACTIONS
+
+
+class AuditWriter:
+    """Per-worker queue of deferred audit rows, flushed by a daemon thread"""
+
+    def __init__(self, batch_size=200, flush_interval=2.0, max_queue=10000, max_retries=3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self._batch_failures = 0  # consecutive failures of the batch at the head of the queue
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self.dead_lettered = 0
+
+    def enqueue(self, rows):
+        with self._cond:
+            self._queue.extend(rows)
+            overflow = len(self._queue) - self.max_queue
+            for _ in range(max(overflow, 0)):
+                self._queue.popleft()
+                self.dropped += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive gunicorn's fork; start one per worker
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything queued so far. A failed batch is put back for the
+        next flush; after max_retries failures it is written row by row.
+        """
+        while True:
+            with self._cond:
+                if not self._queue:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+            conn = Database.get_connection()
+            if conn is None:
+                logger.warning("Audit flush skipped: no database connection available")
+                self._requeue(batch)
+                return
+
+            try:
+                if self._batch_failures >= self.max_retries:
+                    remaining = self._write_rows(conn, batch)
+                    self._batch_failures = 0
+                    if remaining:
+                        self._requeue(remaining)
+                        return
+                    continue
+
+                cursor = conn.cursor()
+                cursor.executemany(AUDIT_INSERT_SQL, batch)
+                conn.commit()
+                cursor.close()
+                self.written += len(batch)
+                self._batch_failures = 0
+            except Exception as e:
+                logger.error(f"Audit flush error: {e}")
+                self.failures += 1
+                if not isinstance(e, TRANSIENT_ERRORS):
+                    self._batch_failures += 1
+                self._requeue(batch)
+                return
+            finally:
+                conn.close()
+
+    def _requeue(self, rows):
+        with self._cond:
+            self._queue.extendleft(reversed(rows))
+
+    def _write_rows(self, conn, batch):
+        """
+        Insert a batch one row per transaction, logging and dropping the rows
+        the database rejects. Returns the rows left unwritten by a
+        connection error (to be retried), else [].
+        """
+        cursor = conn.cursor()
+        try:
+            for i, row in enumerate(batch):
+                try:
+                    cursor.execute(AUDIT_INSERT_SQL, row)
+                    conn.commit()
+                    self.written += 1
+                except TRANSIENT_ERRORS as e:
+                    logger.error(f"Audit flush error: {e}")
+                    return batch[i:]
+                except Exception as e:
+                    conn.rollback()
+                    self.dead_lettered += 1
+                    user_id, table_name, record_id, action = row[:4]
+                    logger.error(
+                        f"Audit entry dropped ({action} {table_name} {record_id}, user {user_id}): {e}; "
+                        f"row: {row!r}"
+                    )
+            return []
+        finally:
+            cursor.close()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            'queued': queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'dead_lettered': self.dead_lettered
+        }
+
+
+_writer = AuditWriter(
+    batch_size=Config.AUDIT_BATCH_SIZE,
+    flush_interval=Config.AUDIT_FLUSH_INTERVAL,
+    max_queue=Config.AUDIT_MAX_QUEUE,
+    max_retries=Config.AUDIT_MAX_RETRIES
+)
+atexit.register(_writer.flush)
+
+
+class AuditBatch:
+    """Commit hook holding the audit rows of one transaction"""
+
+    def __init__(self):
+        self.transactional = []
+        self.deferred = []
+
+    def before_commit(self, conn):
+        if self.transactional:
+            cursor = conn.cursor()
+            cursor.executemany(AUDIT_INSERT_SQL, self.transactional)
+            cursor.close()
+
+    def after_commit(self):
+        if self.deferred:
+            _writer.enqueue(self.deferred)
+
+
+def log_action(db_conn, action, table_name, record_id=None, new_values=None,
+               old_values=None, user_id=None):
+    """
+    Record an audit entry for the change made on db_conn.
+    new_values/old_values may be dicts or a plain description string.
+    user_id, IP address and user agent default to the current request.
+    """
+    action = action.upper()
+    ip_address = user_agent = None
+    if has_request_context():
+        if user_id is None:
+            user_id = getattr(request, 'user_id', None)
+        ip_address = request.environ.get('REMOTE_ADDR', '')
+        user_agent = request.headers.get('User-Agent', '')[:500]
+
+    row = (
+        user_id, table_name, record_id, action, _json(old_values), _json(new_values),
+        ip_address, user_agent, datetime.now(timezone.utc)
+    )
+
+    if not hasattr(db_conn, 'commit_hook'):
+        # Unpooled connection (scripts): write with the caller's transaction
+        cursor = db_conn.cursor()
+        cursor.execute(AUDIT_INSERT_SQL, row)
+        cursor.close()
+        return
+
+    batch = db_conn.commit_hook(AuditBatch)
+    if is_transactional(action):
+        batch.transactional.append(row)
+    else:
+        batch.deferred.append(row)
+
+
+def flush_audit_log():
+    """Write queued deferred entries now (used at shutdown and by tests)"""
+    _writer.flush()
+
+
+def get_audit_stats():
+    """Get audit writer metrics for the current worker"""
+    return _writer.stats()
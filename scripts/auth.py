@@ -4,13 +4,117 @@ JWT-based authentication with role-based access control
 """
 
 from functools import wraps
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
+import hashlib
 import os
+import threading
+import time
 import jwt
 from flask import request, jsonify, current_app
 import mysql.connector
 from werkzeug.security import check_password_hash
 
+from permissions import get_permission_matrix
+
+# Signing settings, resolved once by init_app (or lazily from the environment
+# for scripts that use this module without an app)
+_jwt_settings = {}
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified token payloads, keyed by token hash.
+    Entries expire after `ttl` seconds or at the token's own `exp`,
+    whichever comes first.
+    """
+    
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+    
+    def get(self, token):
+        key = self._key(token)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            payload, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+    
+    def set(self, token, payload):
+        if self.max_size <= 0:
+            return
+        
+        expires_at = time.time() + self.ttl
+        if isinstance(payload.get('exp'), (int, float)):
+            expires_at = min(expires_at, payload['exp'])
+        
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+_token_cache = TokenCache()
+
+
+def init_app(app):
+    """Resolve JWT signing settings and size the verified-token cache from app config"""
+    _jwt_settings['secret'] = app.config.get('JWT_SECRET') or os.environ.get('JWT_SECRET', 'your-secret-key')
+    _jwt_settings['algorithm'] = app.config.get('JWT_ALGORITHM') or os.environ.get('JWT_ALGORITHM', 'HS256')
+    
+    _token_cache.max_size = app.config.get('JWT_CACHE_SIZE', _token_cache.max_size)
+    _token_cache.ttl = app.config.get('JWT_CACHE_TTL', _token_cache.ttl)
+    _token_cache.clear()
+
+
+def _signing_settings():
+    if not _jwt_settings:
+        _jwt_settings['secret'] = os.environ.get('JWT_SECRET', 'your-secret-key')
+        _jwt_settings['algorithm'] = os.environ.get('JWT_ALGORITHM', 'HS256')
+    return _jwt_settings['secret'], _jwt_settings['algorithm']
+
+
+def get_token_cache_stats():
+    """Get verified-token cache metrics for the current worker"""
+    return _token_cache.stats()
+
 def create_token(user_id: int, email: str, role: str, expires_in_hours: int = 24):
     """
     Create JWT token for authenticated user
@@ -23,8 +127,7 @@ def create_token(user_id: int, email: str, role: str, expires_in_hours: int = 24
         'exp': datetime.now(timezone.utc) + timedelta(hours=expires_in_hours)
     }
     
-    secret = os.environ.get('JWT_SECRET', 'your-secret-key')
-    algorithm = os.environ.get('JWT_ALGORITHM', 'HS256')
+    secret, algorithm = _signing_settings()
     
     return jwt.encode(payload, secret, algorithm=algorithm)
 
@@ -33,12 +136,14 @@ def verify_token(token: str):
     Verify JWT token and return payload
     Returns None if token is invalid or expired
     """
+    payload = _token_cache.get(token)
+    if payload is not None:
+        return payload
+    
     try:
-        secret = os.environ.get('JWT_SECRET', 'your-secret-key')
-        algorithm = os.environ.get('JWT_ALGORITHM', 'HS256')
+        secret, algorithm = _signing_settings()
         
         payload = jwt.decode(token, secret, algorithms=[algorithm])
-        return payload
     
     except jwt.ExpiredSignatureError:
         return None
@@ -46,6 +151,9 @@ def verify_token(token: str):
         return None
     except Exception:
         return None
+    
+    _token_cache.set(token, payload)
+    return payload
 
 def get_token_from_request():
     """
@@ -59,9 +167,10 @@ def get_token_from_request():
     
     return auth_header[7:]  # Remove 'Bearer ' prefix
 
-def require_auth(f):
+def _authenticated(f, allowed_roles=None):
     """
-    Decorator to require valid JWT authentication
+    Shared decorator core: verify the bearer token, optionally check the
+    role, and store user info on the request
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -81,55 +190,36 @@ def require_auth(f):
                 'error': 'Invalid or expired token'
             }), 401
         
+        user_role = payload.get('role')
+        
+        if allowed_roles is not None and user_role not in allowed_roles:
+            return jsonify({
+                'success': False,
+                'error': f'User role does not have permission to access this resource'
+            }), 403
+        
         # Store user info in request context
         request.user_id = payload.get('user_id')
         request.user_email = payload.get('email')
-        request.user_role = payload.get('role')
+        request.user_role = user_role
         
         return f(*args, **kwargs)
     
     return decorated_function
 
+def require_auth(f):
+    """
+    Decorator to require valid JWT authentication
+    """
+    return _authenticated(f)
+
 def require_role(*allowed_roles):
     """
     Decorator to require specific user roles
     Usage: @require_role('doctor', 'nurse')
     """
     def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            token = get_token_from_request()
-            
-            if not token:
-                return jsonify({
-                    'success': False,
-                    'error': 'Missing authentication token'
-                }), 401
-            
-            payload = verify_token(token)
-            
-            if not payload:
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid or expired token'
-                }), 401
-            
-            user_role = payload.get('role')
-            
-            if user_role not in allowed_roles:
-                return jsonify({
-                    'success': False,
-                    'error': f'User role does not have permission to access this resource'
-                }), 403
-            
-            # Store user info in request context
-            request.user_id = payload.get('user_id')
-            request.user_email = payload.get('email')
-            request.user_role = user_role
-            
-            return f(*args, **kwargs)
-        
-        return decorated_function
+        return _authenticated(f, allowed_roles)
     return decorator
 
 def get_current_user(db_connection):
@@ -150,16 +240,21 @@ def get_current_user(db_connection):
                 u.last_name,
                 u.phone_number,
                 u.is_active,
-                r.role_name,
+                u.role_id,
                 u.clinic_id
             FROM users u
-            LEFT JOIN user_roles r ON u.role_id = r.id
             WHERE u.id = %s
         """, (request.user_id,))
         
         user = cursor.fetchone()
         cursor.close()
         
+        if user:
+            # Role name comes from the in-process matrix instead of a join
+            matrix = get_permission_matrix(db_connection)
+            matrix.remember_user_role(user['id'], user['role_id'])
+            user['role_name'] = matrix.role_name(user['role_id'])
+        
         return user
     
     except Exception as e:
@@ -209,22 +304,10 @@ def check_permission(db_connection, user_id: int, resource: str, action: str):
     Check if user has permission for specific resource action
     """
     try:
-        cursor = db_connection.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT COUNT(*) as count
-            FROM role_permissions rp
-            JOIN users u ON u.role_id = rp.role_id
-            JOIN resources r ON r.id = rp.resource_id
-            WHERE u.id = %s
-                AND r.resource_name = %s
-                AND rp.action = %s
-        """, (user_id, resource, action))
-        
-        result = cursor.fetchone()
-        cursor.close()
+        matrix = get_permission_matrix(db_connection)
+        role_id = matrix.user_role_id(db_connection, user_id)
         
-        return result and result['count'] > 0
+        return matrix.role_allows(role_id, resource, action)
     
     except Exception as e:
         print(f"Error checking permission: {e}")
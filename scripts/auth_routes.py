@@ -1,13 +1,15 @@
 """
 POLMED Backend - Authentication Routes
-Login, logout, and user profile endpoints
+Login, logout, user profile and role assignment endpoints
 """
 
 from flask import Blueprint, request, jsonify, current_app
 from auth import (
-    create_token, verify_user_credentials, require_auth, get_current_user
+    create_token, verify_user_credentials, require_auth, require_role, get_current_user
 )
-from database import get_db_connection
+from database import get_request_db
+from audit import log_action
+from permissions import bump_permissions_version
 from datetime import datetime, timezone
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
@@ -34,13 +36,12 @@ def login():
             }), 400
         
         # Get database connection
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         
         # Verify credentials
         user = verify_user_credentials(db_conn, email, password)
         
         if not user:
-            db_conn.close()
             return jsonify({
                 'success': False,
                 'error': 'Invalid email or password'
@@ -48,7 +49,6 @@ def login():
         
         # Check if user is active
         if not user.get('is_active'):
-            db_conn.close()
             return jsonify({
                 'success': False,
                 'error': 'User account is inactive'
@@ -62,15 +62,9 @@ def login():
         )
         
         # Log login activity
-        cursor = db_conn.cursor()
-        cursor.execute("""
-            INSERT INTO audit_log (user_id, action, table_name, record_id, ip_address, user_agent)
-            VALUES (%s, 'LOGIN', 'users', %s, %s, %s)
-        """, (user['id'], user['id'], request.environ.get('REMOTE_ADDR', ''), request.headers.get('User-Agent', '')))
+        log_action(db_conn, 'LOGIN', 'users', user['id'], user_id=user['id'])
         
         db_conn.commit()
-        cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -100,10 +94,9 @@ def get_current_user_endpoint():
     Requires valid JWT token
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         
         user = get_current_user(db_conn)
-        db_conn.close()
         
         if not user:
             return jsonify({
@@ -138,18 +131,12 @@ def logout():
     Logs the logout activity
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         
         # Log logout activity
-        cursor = db_conn.cursor()
-        cursor.execute("""
-            INSERT INTO audit_log (user_id, action, table_name, record_id, ip_address, user_agent)
-            VALUES (%s, 'LOGOUT', 'users', %s, %s, %s)
-        """, (request.user_id, request.user_id, request.environ.get('REMOTE_ADDR', ''), request.headers.get('User-Agent', '')))
+        log_action(db_conn, 'LOGOUT', 'users', request.user_id)
         
         db_conn.commit()
-        cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -176,3 +163,64 @@ def verify_token_endpoint():
             'role': request.user_role
         }
     }), 200
+
+@auth_bp.route('/users/<int:user_id>/role', methods=['PUT'])
+@require_role('administrator')
+def update_user_role(user_id):
+    """
+    Assign a user's role
+    Body: role_id or role_name
+    Workers pick up the change with the next permissions version check; the
+    role in already-issued tokens changes at the user's next login.
+    """
+    try:
+        data = request.get_json() or {}
+        role_id = data.get('role_id')
+        role_name = (data.get('role_name') or '').strip()
+        
+        if not role_id and not role_name:
+            return jsonify({'success': False, 'error': 'role_id or role_name is required'}), 400
+        
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
+        
+        if role_id:
+            cursor.execute("SELECT id, role_name FROM user_roles WHERE id = %s AND is_active = TRUE", (role_id,))
+        else:
+            cursor.execute("SELECT id, role_name FROM user_roles WHERE role_name = %s AND is_active = TRUE", (role_name,))
+        role = cursor.fetchone()
+        if not role:
+            cursor.close()
+            return jsonify({'success': False, 'error': 'Role not found'}), 404
+        
+        cursor.execute("SELECT role_id FROM users WHERE id = %s FOR UPDATE", (user_id,))
+        user = cursor.fetchone()
+        if not user:
+            cursor.close()
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+        
+        if user['role_id'] != role['id']:
+            cursor.execute(
+                "UPDATE users SET role_id = %s, updated_at = %s WHERE id = %s",
+                (role['id'], datetime.now(timezone.utc), user_id)
+            )
+            log_action(
+                db_conn, 'UPDATE', 'users', user_id,
+                {'role_id': role['id']}, old_values={'role_id': user['role_id']}
+            )
+            bump_permissions_version(db_conn)
+        
+        db_conn.commit()
+        cursor.close()
+        
+        return jsonify({
+            'success': True,
+            'message': f"User role updated to {role['role_name']}",
+            'data': {'user_id': user_id, 'role_id': role['id'], 'role_name': role['role_name']}
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
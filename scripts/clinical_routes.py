@@ -6,11 +6,23 @@ Patient visits, vital signs, clinical notes, prescriptions, and referrals
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timezone
 from auth import require_auth, require_role
-from database import get_db_connection
+from database import get_request_db
+from audit import log_action
+from dashboard_metrics import record_metrics
+from response_cache import invalidate_on_write
+from pagination import Keyset, PageRequest, fetch_page
+from visit_details import load_visit_details, parse_include, parse_visit_ids
 import mysql.connector
 import json
 
 clinical_bp = Blueprint('clinical', __name__, url_prefix='/api')
+invalidate_on_write(clinical_bp, 'clinical')
+
+VISIT_KEYSET = Keyset('visits', ('visit_date', 'id'), descending=True)
+
+# Workflow stage -> visit_status (other stages are in_progress)
+VISIT_STAGE_STATUS = {'registration': 'check_in', 'closure': 'completed'}
+PENDING_VISIT_STATUSES = ('check_in', 'in_progress')
 
 # ============================================================================
 # VISIT MANAGEMENT
@@ -21,54 +33,40 @@ clinical_bp = Blueprint('clinical', __name__, url_prefix='/api')
 def get_patient_visits(patient_id):
     """
     Get all visits for a patient
+    Query params: page, per_page, after, include_total
     """
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
-        offset = (page - 1) * per_page
+        try:
+            page_req = PageRequest.from_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Verify patient exists
         cursor.execute("SELECT id FROM patients WHERE id = %s AND is_active = TRUE", (patient_id,))
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Patient not found'}), 404
         
         # Get visits
-        cursor.execute(
-            """
-            SELECT * FROM patient_visits
-            WHERE patient_id = %s AND is_active = TRUE
-            ORDER BY visit_date DESC
-            LIMIT %s OFFSET %s
-            """,
-            (patient_id, per_page, offset)
-        )
-        
-        visits = cursor.fetchall()
-        
-        # Get total count
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM patient_visits WHERE patient_id = %s AND is_active = TRUE",
-            (patient_id,)
-        )
+        try:
+            visits, pagination = fetch_page(
+                cursor,
+                "SELECT * FROM patient_visits WHERE patient_id = %s AND is_active = TRUE",
+                "SELECT COUNT(*) as total FROM patient_visits WHERE patient_id = %s AND is_active = TRUE",
+                [patient_id], page_req, VISIT_KEYSET
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        total = cursor.fetchone()['total']
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
             'data': visits,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
-            }
+            'pagination': pagination
         }), 200
     
     except Exception as e:
@@ -92,14 +90,13 @@ def create_visit(patient_id):
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Verify patient exists
         cursor.execute("SELECT id FROM patients WHERE id = %s AND is_active = TRUE", (patient_id,))
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Patient not found'}), 404
         
         # Create visit
@@ -128,17 +125,16 @@ def create_visit(patient_id):
         visit_id = cursor.lastrowid
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, table_name, record_id, created_at, new_values)
-            VALUES (%s, 'CREATE', 'visit', %s, %s, %s)
-            """,
-            (request.user_id, visit_id, datetime.now(timezone.utc), json.dumps({'info': f'Created visit for patient {patient_id}'}) )
+        log_action(db_conn, 'CREATE', 'visit', visit_id, f'Created visit for patient {patient_id}')
+        record_metrics(
+            db_conn, day=data.get('visit_date'), total_visits=1,
+            scheduled_visits=int(data.get('visit_type') == 'scheduled'),
+            walk_in_visits=int(data.get('visit_type') == 'walk_in')
         )
+        record_metrics(db_conn, pending_visits=1)
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -154,53 +150,56 @@ def create_visit(patient_id):
 def get_visit_details(visit_id):
     """
     Get complete visit details including vital signs and notes
+    Query params: include (comma-separated: vitals, notes, prescriptions; default all)
     """
     try:
-        db_conn = get_db_connection()
+        try:
+            include = parse_include(request.args.get('include', ''))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
-        # Get visit
-        cursor.execute(
-            "SELECT * FROM patient_visits WHERE id = %s AND is_active = TRUE",
-            (visit_id,)
-        )
+        # Visit and children in one round trip
+        visits = load_visit_details(cursor, [visit_id], include)
+        cursor.close()
         
-        visit = cursor.fetchone()
+        visit = visits.get(visit_id)
         
         if not visit:
-            cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Visit not found'}), 404
         
-        # Get vital signs
-        cursor.execute(
-            "SELECT * FROM vital_signs WHERE visit_id = %s ORDER BY recorded_at DESC",
-            (visit_id,)
-        )
-        vital_signs = cursor.fetchall()
-        
-        # Get clinical notes
-        cursor.execute(
-            "SELECT * FROM clinical_notes WHERE visit_id = %s ORDER BY created_at DESC",
-            (visit_id,)
-        )
-        clinical_notes = cursor.fetchall()
+        return jsonify({'success': True, 'data': visit}), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@clinical_bp.route('/visits/details', methods=['GET'])
+@require_auth
+def get_visits_details():
+    """
+    Get full details for several visits at once (consultation queue)
+    Query params: ids (comma-separated, max MAX_PAGE_SIZE), include (vitals, notes, prescriptions)
+    """
+    try:
+        try:
+            visit_ids = parse_visit_ids(request.args.get('ids', ''))
+            include = parse_include(request.args.get('include', ''))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        # Get prescriptions
-        cursor.execute(
-            "SELECT * FROM prescriptions WHERE visit_id = %s AND is_active = TRUE ORDER BY created_at DESC",
-            (visit_id,)
-        )
-        prescriptions = cursor.fetchall()
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
         
+        visits = load_visit_details(cursor, visit_ids, include)
         cursor.close()
-        db_conn.close()
         
-        visit['vital_signs'] = vital_signs
-        visit['clinical_notes'] = clinical_notes
-        visit['prescriptions'] = prescriptions
-        
-        return jsonify({'success': True, 'data': visit}), 200
+        return jsonify({
+            'success': True,
+            'data': [visits[visit_id] for visit_id in visit_ids if visit_id in visits],
+            'not_found': [visit_id for visit_id in visit_ids if visit_id not in visits]
+        }), 200
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -211,6 +210,8 @@ def update_visit_stage(visit_id):
     """
     Update visit stage in the clinical workflow
     Valid stages: registration, assessment, consultation, counseling, closure
+    visit_status follows the stage (registration: check_in, closure: completed,
+    otherwise in_progress) unless the visit was cancelled or a no-show.
     """
     try:
         data = request.get_json()
@@ -224,36 +225,48 @@ def update_visit_stage(visit_id):
         if new_stage not in valid_stages:
             return jsonify({'success': False, 'error': f'Invalid stage. Must be one of: {", ".join(valid_stages)}'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
-        # Update stage
         cursor.execute(
-            """
-            UPDATE patient_visits
-            SET current_stage = %s, updated_at = %s
-            WHERE id = %s AND is_active = TRUE
-            """,
-            (new_stage, datetime.now(timezone.utc), visit_id)
+            "SELECT visit_status, visit_date FROM patient_visits WHERE id = %s AND is_active = TRUE FOR UPDATE",
+            (visit_id,)
         )
-        
-        if cursor.rowcount == 0:
+        visit = cursor.fetchone()
+        if not visit:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Visit not found'}), 404
         
-        # Log audit
+        previous_status, visit_date = visit
+        if previous_status in ('cancelled', 'no_show'):
+            new_status = previous_status
+        else:
+            new_status = VISIT_STAGE_STATUS.get(new_stage, 'in_progress')
+        
+        # Update stage
         cursor.execute(
             """
-            INSERT INTO audit_log (user_id, action, table_name, record_id, created_at, new_values)
-            VALUES (%s, 'UPDATE', 'visit', %s, %s, %s)
+            UPDATE patient_visits
+            SET current_stage = %s, visit_status = %s, updated_at = %s
+            WHERE id = %s
             """,
-            (request.user_id, visit_id, datetime.now(timezone.utc), json.dumps({'info': f'Visit stage updated to: {new_stage}'}) )
+            (new_stage, new_status, datetime.now(timezone.utc), visit_id)
         )
         
+        # Log audit
+        log_action(db_conn, 'UPDATE', 'visit', visit_id, f'Visit stage updated to: {new_stage}')
+        if new_status != previous_status:
+            record_metrics(
+                db_conn, day=visit_date,
+                completed_visits=(new_status == 'completed') - (previous_status == 'completed')
+            )
+            record_metrics(
+                db_conn,
+                pending_visits=(new_status in PENDING_VISIT_STATUSES) - (previous_status in PENDING_VISIT_STATUSES)
+            )
+        
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -279,7 +292,7 @@ def record_vital_signs(visit_id):
         if not data:
             return jsonify({'success': False, 'error': 'Request body required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Verify visit exists
@@ -290,7 +303,6 @@ def record_vital_signs(visit_id):
         
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Visit not found'}), 404
         
         # Record vital signs
@@ -319,17 +331,10 @@ def record_vital_signs(visit_id):
         )
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'CREATE', 'vital_signs', %s, %s, %s)
-            """,
-            (request.user_id, cursor.lastrowid, datetime.now(timezone.utc), f'Recorded vital signs for visit {visit_id}')
-        )
+        log_action(db_conn, 'CREATE', 'vital_signs', cursor.lastrowid, f'Recorded vital signs for visit {visit_id}')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -355,7 +360,7 @@ def create_clinical_note(visit_id):
         if not data or 'note_content' not in data:
             return jsonify({'success': False, 'error': 'note_content is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Verify visit exists
@@ -366,7 +371,6 @@ def create_clinical_note(visit_id):
         
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Visit not found'}), 404
         
         # Create note
@@ -389,17 +393,10 @@ def create_clinical_note(visit_id):
         note_id = cursor.lastrowid
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'CREATE', 'clinical_note', %s, %s, %s)
-            """,
-            (request.user_id, note_id, datetime.now(timezone.utc), f'Created clinical note for visit {visit_id}')
-        )
+        log_action(db_conn, 'CREATE', 'clinical_note', note_id, f'Created clinical note for visit {visit_id}')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -429,7 +426,7 @@ def create_prescription(visit_id):
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Verify visit exists
@@ -440,7 +437,6 @@ def create_prescription(visit_id):
         
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Visit not found'}), 404
         
         # Create prescription
@@ -466,17 +462,11 @@ def create_prescription(visit_id):
         prescription_id = cursor.lastrowid
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'CREATE', 'prescription', %s, %s, %s)
-            """,
-            (request.user_id, prescription_id, datetime.now(timezone.utc), f'Created prescription for visit {visit_id}')
-        )
+        log_action(db_conn, 'CREATE', 'prescription', prescription_id, f'Created prescription for visit {visit_id}')
+        record_metrics(db_conn, prescriptions_issued=1)
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -498,14 +488,13 @@ def get_patient_referrals(patient_id):
     Get all referrals for a patient
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Verify patient exists
         cursor.execute("SELECT id FROM patients WHERE id = %s AND is_active = TRUE", (patient_id,))
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Patient not found'}), 404
         
         # Get referrals
@@ -520,7 +509,6 @@ def get_patient_referrals(patient_id):
         
         referrals = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({'success': True, 'data': referrals}), 200
     
@@ -539,14 +527,13 @@ def create_referral(patient_id):
         if not data or 'referral_type' not in data:
             return jsonify({'success': False, 'error': 'referral_type is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Verify patient exists
         cursor.execute("SELECT id FROM patients WHERE id = %s AND is_active = TRUE", (patient_id,))
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Patient not found'}), 404
         
         # Create referral
@@ -576,17 +563,11 @@ def create_referral(patient_id):
         referral_id = cursor.lastrowid
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'CREATE', 'referral', %s, %s, %s)
-            """,
-            (request.user_id, referral_id, datetime.now(timezone.utc), f'Created referral for patient {patient_id}')
-        )
+        log_action(db_conn, 'CREATE', 'referral', referral_id, f'Created referral for patient {patient_id}')
+        record_metrics(db_conn, referrals_created=1, pending_referrals=1)
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -616,7 +597,7 @@ def update_referral_status(referral_id):
         if new_status not in valid_statuses:
             return jsonify({'success': False, 'error': f'Invalid status. Must be one of: {", ".join(valid_statuses)}'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         cursor.execute(
@@ -630,21 +611,13 @@ def update_referral_status(referral_id):
         
         if cursor.rowcount == 0:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Referral not found'}), 404
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'UPDATE', 'referral', %s, %s, %s)
-            """,
-            (request.user_id, referral_id, datetime.now(timezone.utc), f'Referral status updated to: {new_status}')
-        )
+        log_action(db_conn, 'UPDATE', 'referral', referral_id, f'Referral status updated to: {new_status}')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 class Config:
@@ -14,11 +15,27 @@ class Config:
     DB_USER = os.environ.get('DB_USER', 'dbadmin')
     DB_PASSWORD = os.environ.get('DB_PASSWORD', 'Polm3d!DB@2025')
     DB_PORT = int(os.environ.get('DB_PORT', 3306))
-    
+
+    # Connection pool settings (per gunicorn worker)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+    DB_POOL_MAX_IDLE_TIME = int(os.environ.get('DB_POOL_MAX_IDLE_TIME', 300))  # recycle idle connections after 5 minutes
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'True').lower() == 'true'
+
     # JWT settings
     JWT_SECRET_KEY = SECRET_KEY
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+    JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
+    JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+    JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', 1024))  # verified tokens kept per worker
+    JWT_CACHE_TTL = int(os.environ.get('JWT_CACHE_TTL', 300))  # seconds; never beyond the token's exp
+    
+    # Permission matrix settings
+    PERMISSION_CHECK_INTERVAL = int(os.environ.get('PERMISSION_CHECK_INTERVAL', 30))  # seconds between version checks
+    PERMISSION_VERSION_FILE = os.environ.get('PERMISSION_VERSION_FILE')  # shared file instead of cache_versions
+    PERMISSION_USER_MEMO_SIZE = 10000  # user -> role lookups kept per worker
     
     # CORS settings
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
@@ -30,13 +47,65 @@ class Config:
     # Pagination settings
     DEFAULT_PAGE_SIZE = 20
     MAX_PAGE_SIZE = 100
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 60))  # seconds to reuse listing totals
+    
+    # Patient search settings
+    PATIENT_SEARCH_MAX_HITS = 500  # ranked hits considered per search (and rows read per branch)
+    PATIENT_SEARCH_MIN_PREFIX = 2  # shorter terms are matched exactly only
+    PATIENT_SEARCH_MIN_PHONETIC = 3  # shorter names are not matched by SOUNDEX or full-text
+    
+    # Audit log settings
+    AUDIT_TRANSACTIONAL_ACTIONS = set(
+        a.strip().upper() for a in os.environ.get('AUDIT_TRANSACTIONAL_ACTIONS', 'DEACTIVATE,DELETE,SYNC_DELETE').split(',') if a.strip()
+    )  # written in the same commit; everything else is flushed in the background
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2))  # seconds
+    AUDIT_BATCH_SIZE = 200
+    AUDIT_MAX_QUEUE = 10000  # per worker; oldest entries are dropped beyond this
+    AUDIT_MAX_RETRIES = 3  # failed flushes of a batch before it is written row by row
+    
+    # Dashboard metrics settings
+    METRICS_REFRESH_INTERVAL = int(os.environ.get('METRICS_REFRESH_INTERVAL', 300))  # seconds between background daily_metrics recomputes
+    
+    # Response cache settings
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'sqlite').lower()  # sqlite | memory | none
+    RESPONSE_CACHE_PATH = os.environ.get(
+        'RESPONSE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'polmed_response_cache.db')
+    )  # shared by all workers on the host
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 30))  # seconds
+    RESPONSE_CACHE_MAX_ENTRIES = 512
     
     # Security settings
     BCRYPT_LOG_ROUNDS = 12
     
     # Offline sync settings
     SYNC_BATCH_SIZE = 100
+    SYNC_MAX_RECORDS = 5000  # per /api/sync/pending request
+    SYNC_CHANGES_SAFETY_LAG = 5  # seconds; newer rows wait for the next pull
+    SYNC_EXPORT_BATCH_SIZE = 1000  # rows per fetchmany() in streaming visit exports
     SYNC_TIMEOUT = 300  # 5 minutes
+    IMPORT_BATCH_SIZE = 500  # rows per transaction in bulk patient imports
+    DISPENSE_INDEX_TTL = 60  # seconds a worker trusts its cached FEFO batch list
+    INVENTORY_ALERT_HORIZON_DAYS = 365  # furthest expiry/warranty date kept as an alert
+    REORDER_HISTORY_DAYS = 90  # trailing usage window for consumption rates
+    REORDER_HORIZON_DAYS = 30  # days of demand a purchase suggestion covers
+    REORDER_MAX_DAYS = 365  # cap on either window per forecast request
+
+    # Public appointment availability
+    AVAILABILITY_REFRESH_INTERVAL = 5  # seconds between checks for changed locations, per worker
+    AVAILABILITY_FULL_RELOAD = 3600  # seconds between full reloads of the index
+    AVAILABILITY_MAX_AGE = int(os.environ.get('AVAILABILITY_MAX_AGE', 15))  # Cache-Control max-age/s-maxage
+    NEAR_DEFAULT_RADIUS_KM = 50  # /api/appointments/available?near= search radius
+    NEAR_MAX_RADIUS_KM = 500
+    NEAR_DEFAULT_LIMIT = 10  # nearest listings returned
+    NEAR_MAX_LIMIT = 50
+    APPOINTMENT_SLOT_MINUTES = 30  # default slot length when generating a route's slots
+    SLOT_INSERT_BATCH_SIZE = 1000  # rows per multi-row INSERT when generating slots
+    
+    # Route planning
+    ROUTE_VISIT_MINUTES = 120  # time on site per location visit
+    ROUTE_APPOINTMENTS_PER_VISIT = 20  # max_appointments for planned route_locations
+    ROUTE_AVERAGE_SPEED_KMH = 60
+    ROUTE_ROAD_FACTOR = 1.3  # road distance / great-circle distance
 
 class DevelopmentConfig(Config):
     """Development configuration"""
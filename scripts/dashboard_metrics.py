@@ -0,0 +1,380 @@
+"""
+POLMED Backend - Dashboard Metrics
+Precomputed daily_metrics rows backing the dashboard endpoints
+
+Handlers report events (visits, patients, referrals, prescriptions, stock
+adjustments, bookings) with record_metrics(). The deltas are applied to the
+day's daily_metrics row in one upsert when the caller's transaction commits.
+Dashboards only ever read that single row. The full recompute runs in the
+background: every METRICS_REFRESH_INTERVAL seconds one worker claims it
+through cache_versions (and straight away once the day changes) and
+refreshes today's row. It corrects the figures that are not event-driven,
+such as users, routes and stock alerts, and any drift. A metric whose query
+fails keeps its stored value; the others are still refreshed.
+
+Usage: python dashboard_metrics.py [days]   # recompute today and the previous N days
+"""
+
+import logging
+import os
+import sys
+import threading
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+
+from appointment_slots import SLOT_HOLDING_STATUSES
+from config import Config
+from database import Database
+from inventory_alerts import ensure_daily_sweep
+
+# Per-day event counters (historic rows keep these)
+DAILY_COUNTERS = (
+    'total_visits', 'scheduled_visits', 'walk_in_visits', 'completed_visits', 'cancelled_visits',
+    'new_patients', 'returning_patients', 'referrals_created', 'prescriptions_issued',
+    'stock_adjustments'
+)
+
+# Point-in-time figures as of the row's day
+GAUGES = (
+    'total_patients', 'active_users', 'active_routes', 'pending_visits',
+    'upcoming_appointments', 'pending_appointments', 'pending_referrals',
+    'stock_alerts', 'expiry_alerts'
+)
+
+METRIC_COLUMNS = DAILY_COUNTERS + GAUGES
+
+logger = logging.getLogger(__name__)
+
+REFRESH_VERSION_NAME = 'daily_metrics_refresh'
+
+# column -> scalar subquery; %(day)s and %(next_day)s bound per refresh
+# (patient_visits has no is_active column; appointment gauges follow the
+# slot-holding statuses that booking and cancelling maintain)
+METRIC_QUERIES = {
+    'total_visits': """
+        SELECT COUNT(*) FROM patient_visits
+        WHERE visit_date = %(day)s""",
+    'scheduled_visits': """
+        SELECT COUNT(*) FROM patient_visits
+        WHERE visit_date = %(day)s AND visit_type = 'scheduled'""",
+    'walk_in_visits': """
+        SELECT COUNT(*) FROM patient_visits
+        WHERE visit_date = %(day)s AND visit_type = 'walk_in'""",
+    'completed_visits': """
+        SELECT COUNT(*) FROM patient_visits
+        WHERE visit_date = %(day)s AND visit_status = 'completed'""",
+    'cancelled_visits': """
+        SELECT COUNT(*) FROM patient_visits
+        WHERE visit_date = %(day)s AND visit_status = 'cancelled'""",
+    'new_patients': """
+        SELECT COUNT(*) FROM patients
+        WHERE created_at >= %(day)s AND created_at < %(next_day)s""",
+    'returning_patients': """
+        SELECT COUNT(DISTINCT v.patient_id) FROM patient_visits v
+        JOIN patients p ON p.id = v.patient_id
+        WHERE v.visit_date = %(day)s AND v.visit_status <> 'cancelled' AND p.created_at < %(day)s""",
+    'referrals_created': """
+        SELECT COUNT(*) FROM referrals
+        WHERE created_at >= %(day)s AND created_at < %(next_day)s""",
+    'prescriptions_issued': """
+        SELECT COUNT(*) FROM prescriptions
+        WHERE created_at >= %(day)s AND created_at < %(next_day)s""",
+    'stock_adjustments': """
+        SELECT COUNT(*) FROM stock_adjustment_log
+        WHERE adjustment_date >= %(day)s AND adjustment_date < %(next_day)s""",
+    'total_patients': """
+        SELECT COUNT(*) FROM patients WHERE is_active = TRUE""",
+    'active_users': """
+        SELECT COUNT(*) FROM users WHERE is_active = TRUE""",
+    'active_routes': """
+        SELECT COUNT(*) FROM routes
+        WHERE is_active = TRUE AND (end_date IS NULL OR end_date >= %(day)s)""",
+    'pending_visits': """
+        SELECT COUNT(*) FROM patient_visits
+        WHERE visit_status IN ('check_in', 'in_progress')""",
+    'upcoming_appointments': f"""
+        SELECT COUNT(*) FROM appointments
+        WHERE appointment_status IN ({', '.join(f"'{s}'" for s in SLOT_HOLDING_STATUSES)})
+            AND appointment_date >= %(day)s""",
+    'pending_appointments': """
+        SELECT COUNT(*) FROM appointments
+        WHERE appointment_status = 'pending' AND appointment_date >= %(day)s""",
+    'pending_referrals': """
+        SELECT COUNT(*) FROM referrals
+        WHERE referral_status = 'pending' AND is_active = TRUE""",
+    'stock_alerts': """
+        SELECT COUNT(*) FROM inventory_alerts
+        WHERE alert_type = 'low_stock' AND is_active = TRUE""",
+    'expiry_alerts': """
+        SELECT COUNT(*) FROM inventory_alerts
+        WHERE alert_type = 'expiry' AND is_active = TRUE
+            AND due_date > %(day)s
+            AND due_date <= DATE_ADD(%(day)s, INTERVAL 30 DAY)""",
+}
+
+
+def _as_date(day):
+    if day is None:
+        return datetime.now().date()
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    return datetime.strptime(str(day)[:10], '%Y-%m-%d').date()
+
+
+def _upsert_deltas(cursor, day, deltas):
+    columns = [c for c in deltas if c in METRIC_COLUMNS and deltas[c]]
+    if not columns:
+        return
+    cursor.execute(
+        f"""
+        INSERT INTO daily_metrics (metric_date, {', '.join(columns)})
+        VALUES (%s, {', '.join(['%s'] * len(columns))})
+        ON DUPLICATE KEY UPDATE {', '.join(f'{c} = {c} + VALUES({c})' for c in columns)}
+        """,
+        [day] + [deltas[c] for c in columns]
+    )
+
+
+class MetricsDelta:
+    """Commit hook accumulating metric deltas for one transaction"""
+
+    def __init__(self):
+        self.deltas = {}  # day -> {column: delta}
+
+    def add(self, day, deltas):
+        row = self.deltas.setdefault(day, {})
+        for column, delta in deltas.items():
+            row[column] = row.get(column, 0) + delta
+
+    def before_commit(self, conn):
+        cursor = conn.cursor()
+        for day, deltas in self.deltas.items():
+            _upsert_deltas(cursor, day, deltas)
+        cursor.close()
+
+    def after_commit(self):
+        pass
+
+
+def record_metrics(db_conn, day=None, **deltas):
+    """
+    Add event deltas to a day's metrics (default today), e.g.
+    record_metrics(db_conn, new_patients=1, total_patients=1).
+    Applied with the caller's commit and discarded on rollback.
+    """
+    day = _as_date(day)
+    if not hasattr(db_conn, 'commit_hook'):
+        cursor = db_conn.cursor()
+        _upsert_deltas(cursor, day, deltas)
+        cursor.close()
+        return
+
+    db_conn.commit_hook(MetricsDelta).add(day, deltas)
+
+
+def _compute_metrics(cursor, params):
+    """
+    Run the metric queries: all in one round trip, or one by one if that
+    fails so a single broken query only costs its own metric.
+    Returns {column: value} for the metrics that could be computed.
+    """
+    try:
+        cursor.execute(
+            "SELECT " + ",\n".join(f"({METRIC_QUERIES[c]}) AS {c}" for c in METRIC_COLUMNS),
+            params
+        )
+        values = cursor.fetchone()
+        return {c: int(values[c] or 0) for c in METRIC_COLUMNS}
+    except mysql.connector.Error as e:
+        logger.warning(f"Metrics refresh falling back to per-metric queries: {e}")
+
+    values = {}
+    for column in METRIC_COLUMNS:
+        try:
+            cursor.execute(f"SELECT ({METRIC_QUERIES[column]}) AS value", params)
+            values[column] = int(cursor.fetchone()['value'] or 0)
+        except mysql.connector.Error as e:
+            logger.error(f"Metric {column} could not be refreshed: {e}")
+    return values
+
+
+def refresh_daily_metrics(db_conn, day=None):
+    """
+    Recompute every metric for a day and store it. Does not commit.
+    Metrics whose query fails keep their stored value.
+    """
+    day = _as_date(day)
+    params = {'day': day, 'next_day': day + timedelta(days=1)}
+
+    cursor = db_conn.cursor(dictionary=True)
+    values = _compute_metrics(cursor, params)
+    columns = [c for c in METRIC_COLUMNS if c in values]
+
+    cursor.execute(
+        f"""
+        INSERT INTO daily_metrics (metric_date, {', '.join(columns + ['refreshed_at'])})
+        VALUES (%s, {', '.join(['%s'] * len(columns) + ['NOW()'])})
+        ON DUPLICATE KEY UPDATE {', '.join([f'{c} = VALUES({c})' for c in columns] + ['refreshed_at = VALUES(refreshed_at)'])}
+        """,
+        [day] + [values[c] for c in columns]
+    )
+
+    missing = [c for c in METRIC_COLUMNS if c not in values]
+    if missing:
+        cursor.execute(
+            f"SELECT {', '.join(missing)} FROM daily_metrics WHERE metric_date = %s",
+            (day,)
+        )
+        stored = cursor.fetchone() or {}
+        values.update({c: int(stored.get(c) or 0) for c in missing})
+    cursor.close()
+
+    metrics = {c: values[c] for c in METRIC_COLUMNS}
+    metrics['metric_date'] = day
+    metrics['refreshed_at'] = datetime.now()
+    return metrics
+
+
+def claim_refresh(db_conn, interval):
+    """
+    Claim the next metrics refresh for this worker: succeeds if nobody has
+    refreshed in the last `interval` seconds or since midnight (database
+    time). Commits the claim.
+    """
+    cursor = db_conn.cursor()
+    cursor.execute(
+        "INSERT IGNORE INTO cache_versions (name, version) VALUES (%s, 0)",
+        (REFRESH_VERSION_NAME,)
+    )
+    cursor.execute(
+        """
+        UPDATE cache_versions SET version = UNIX_TIMESTAMP()
+        WHERE name = %s
+            AND (version <= UNIX_TIMESTAMP() - %s OR version < UNIX_TIMESTAMP(CURDATE()))
+        """,
+        (REFRESH_VERSION_NAME, interval)
+    )
+    claimed = cursor.rowcount == 1
+    cursor.close()
+    db_conn.commit()
+    return claimed
+
+
+class MetricsRefresher:
+    """Per-worker daemon thread recomputing today's row when it claims the refresh"""
+
+    def __init__(self, interval=300):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def ensure_running(self):
+        # Threads do not survive gunicorn's fork; start one per worker
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='metrics-refresher', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Try to claim a refresh now (today's row is missing or was never refreshed)"""
+        self.ensure_running()
+        with self._cond:
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            self.refresh_once()
+            with self._cond:
+                self._cond.wait(self.interval)
+
+    def refresh_once(self):
+        conn = Database.get_connection()
+        if conn is None:
+            return False
+        try:
+            if not claim_refresh(conn, self.interval):
+                return False
+            # Alert gauges read inventory_alerts, so bring date-based alerts up to date first
+            ensure_daily_sweep(conn)
+            refresh_daily_metrics(conn)
+            conn.commit()
+            self.refreshes += 1
+            return True
+        except Exception as e:
+            logger.error(f"Metrics refresh failed: {e}")
+            self.failures += 1
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'refreshes': self.refreshes, 'failures': self.failures}
+
+
+_refresher = MetricsRefresher(interval=Config.METRICS_REFRESH_INTERVAL)
+
+
+def get_dashboard_metrics(db_conn, day=None):
+    """
+    Read a day's metrics row (default today). Never recomputes in the
+    request: a missing or never-refreshed row for today wakes the background
+    refresher and is returned as it stands (zeros if missing).
+    """
+    day = _as_date(day)
+    cursor = db_conn.cursor(dictionary=True)
+    cursor.execute(
+        f"""
+        SELECT metric_date, {', '.join(METRIC_COLUMNS)}, refreshed_at
+        FROM daily_metrics
+        WHERE metric_date = %s
+        """,
+        (day,)
+    )
+    row = cursor.fetchone()
+    cursor.close()
+
+    if day == date.today():
+        if row is None or row['refreshed_at'] is None:
+            _refresher.wake()
+        else:
+            _refresher.ensure_running()
+
+    if row is None:
+        row = {c: 0 for c in METRIC_COLUMNS}
+        row.update(metric_date=day, refreshed_at=None)
+    return row
+
+
+def get_metrics_refresh_stats():
+    """Get metrics refresher counters for the current worker"""
+    return _refresher.stats()
+
+
+if __name__ == '__main__':
+    from database import get_db_connection, close_db_connection
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    today = datetime.now().date()
+    try:
+        for offset in range(days, -1, -1):
+            day = today - timedelta(days=offset)
+            refresh_daily_metrics(conn, day)
+            conn.commit()
+            print(f"Refreshed daily_metrics for {day}")
+    finally:
+        close_db_connection(conn)
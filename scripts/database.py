@@ -1,41 +1,294 @@
 """
 POLMED Backend - Database Connection Module
-Singleton pattern for MySQL database connections
+Per-process MySQL connection pool with pre-ping validation and metrics,
+plus a request-scoped connection bound to Flask's `g`
 """
 
 import mysql.connector
 from mysql.connector import Error
 import os
+import threading
+import time
 from contextlib import contextmanager
+from flask import g
+
+from config import Config
+
+
+class PoolExhaustedError(Error):
+    """Raised when no pooled connection becomes available within the timeout"""
+
+
+class PooledConnection:
+    """
+    Thin proxy around a MySQL connection checked out from the pool.
+    close() returns the connection to the pool instead of tearing it down.
+    Commit hooks let helpers (e.g. the audit writer) piggyback on the
+    caller's commit; they are dropped on rollback and on release.
+    """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self._cursors = []
+        self._commit_hooks = []
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise Error("Connection has already been returned to the pool")
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        """Create a cursor that is closed automatically when the connection is released"""
+        if self._connection is None:
+            raise Error("Connection has already been returned to the pool")
+        cursor = self._connection.cursor(*args, **kwargs)
+        self._cursors.append(cursor)
+        return cursor
+
+    def commit_hook(self, factory):
+        """
+        Return the pending commit hook of this type, registering a new one
+        from `factory` if needed. Hooks provide before_commit(conn) and
+        after_commit().
+        """
+        for hook in self._commit_hooks:
+            if type(hook) is factory:
+                return hook
+        hook = factory()
+        self._commit_hooks.append(hook)
+        return hook
+
+    def commit(self):
+        hooks, self._commit_hooks = self._commit_hooks, []
+        for hook in hooks:
+            hook.before_commit(self)
+        self._connection.commit()
+        for hook in hooks:
+            hook.after_commit()
+
+    def rollback(self):
+        self._commit_hooks = []
+        self._connection.rollback()
+
+    def close(self):
+        """Return the connection to the pool (safe to call more than once)"""
+        self._commit_hooks = []
+        if self._connection is not None:
+            for cursor in self._cursors:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+            self._cursors = []
+            connection, self._connection = self._connection, None
+            self._pool.release(connection)
+
+    def discard(self):
+        """Close the connection instead of returning it (e.g. after an abandoned unbuffered read)"""
+        self._commit_hooks = []
+        self._cursors = []
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool._discard(connection)
+
+    def is_connected(self):
+        return self._connection is not None and self._connection.is_connected()
+
+
+class ConnectionPool:
+    """
+    Thread-safe MySQL connection pool.
+
+    Keeps up to `pool_size` idle connections, allows `max_overflow` extra
+    connections under burst load and waits up to `timeout` seconds for a
+    free connection before giving up. Idle connections older than
+    `max_idle_time` are recycled, and `pre_ping` validates a connection
+    before handing it out.
+    """
+
+    def __init__(self, connect_args, pool_size=5, max_overflow=10, timeout=10,
+                 max_idle_time=300, pre_ping=True):
+        self.connect_args = connect_args
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_idle_time = max_idle_time
+        self.pre_ping = pre_ping
+        self.pid = os.getpid()
+
+        self._idle = []  # list of (connection, returned_at)
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_recycled': 0,
+            'ping_failures': 0,
+            'waits': 0,
+            'exhausted': 0,
+            'peak_in_use': 0,
+        }
+
+    def _create(self):
+        connection = mysql.connector.connect(**self.connect_args)
+        with self._cond:
+            self._stats['connections_created'] += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def _validate(self, connection, returned_at):
+        """Return True if an idle connection is still usable"""
+        if self.max_idle_time and time.monotonic() - returned_at > self.max_idle_time:
+            with self._cond:
+                self._stats['connections_recycled'] += 1
+            return False
+
+        if self.pre_ping:
+            try:
+                connection.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._stats['ping_failures'] += 1
+                return False
+
+        return True
+
+    def acquire(self):
+        """Check out a connection, creating one if under the pool limit"""
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            idle_entry = None
+
+            with self._cond:
+                while True:
+                    if self._idle:
+                        idle_entry = self._idle.pop()
+                        break
+                    if self._open < self.pool_size + self.max_overflow:
+                        self._open += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['exhausted'] += 1
+                        raise PoolExhaustedError(
+                            f"Connection pool exhausted ({self._open} connections in use)"
+                        )
+                    self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+            if idle_entry is not None:
+                connection, returned_at = idle_entry
+                if not self._validate(connection, returned_at):
+                    self._discard(connection)
+                    continue
+            else:
+                try:
+                    connection = self._create()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+                in_use = self._open - len(self._idle)
+                self._stats['peak_in_use'] = max(self._stats['peak_in_use'], in_use)
+
+            return PooledConnection(self, connection)
+
+    def release(self, connection):
+        """Return a connection, rolling back any unfinished transaction"""
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except Exception:
+            self._discard(connection)
+            return
+
+        with self._cond:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+                return
+
+        # Overflow connection - close it once the burst is over
+        self._discard(connection)
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            return {
+                **self._stats,
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+            }
+
 
 class Database:
-    """Database connection singleton"""
-    _instance = None
-    _connection = None
-    
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(Database, cls).__new__(cls)
-        return cls._instance
-    
+    """Database connection pool holder (one pool per worker process)"""
+    _pool = None
+    _lock = threading.Lock()
+
     @staticmethod
-    def get_connection():
-        """Get or create database connection"""
+    def connect_args():
+        """Connection arguments for MySQL"""
+        return {
+            'host': os.environ.get('DB_HOST', 'db-polmed.mysql.database.azure.com'),
+            'port': int(os.environ.get('DB_PORT', 3306)),
+            'user': os.environ.get('DB_USER', 'dbadmin'),
+            'password': os.environ.get('DB_PASSWORD', 'Polm3d!DB@2025'),
+            'database': os.environ.get('DB_NAME', 'mobile_clinic_erp'),
+            'autocommit': False,
+            'use_unicode': True,
+            'charset': 'utf8mb4',
+            'ssl_disabled': False,
+            'ssl_verify_cert': False,
+            'ssl_verify_identity': False,
+        }
+
+    @classmethod
+    def get_pool(cls):
+        """
+        Get the pool for the current process.
+        The pool is created lazily and rebuilt after a fork, so each
+        gunicorn worker owns its own sockets.
+        """
+        pool = cls._pool
+        if pool is None or pool.pid != os.getpid():
+            with cls._lock:
+                pool = cls._pool
+                if pool is None or pool.pid != os.getpid():
+                    pool = ConnectionPool(
+                        cls.connect_args(),
+                        pool_size=Config.DB_POOL_SIZE,
+                        max_overflow=Config.DB_POOL_MAX_OVERFLOW,
+                        timeout=Config.DB_POOL_TIMEOUT,
+                        max_idle_time=Config.DB_POOL_MAX_IDLE_TIME,
+                        pre_ping=Config.DB_POOL_PRE_PING,
+                    )
+                    cls._pool = pool
+        return pool
+
+    @classmethod
+    def get_connection(cls):
+        """Check out a connection from the pool"""
         try:
-            connection = mysql.connector.connect(
-                host=os.environ.get('DB_HOST', 'db-polmed.mysql.database.azure.com'),
-                port=int(os.environ.get('DB_PORT', 3306)),
-                user=os.environ.get('DB_USER', 'dbadmin'),
-                password=os.environ.get('DB_PASSWORD', 'Polm3d!DB@2025'),
-                database=os.environ.get('DB_NAME', 'mobile_clinic_erp'),
-                autocommit=False,
-                use_unicode=True,
-                charset='utf8mb4',
-                ssl_disabled=False,
-                ssl_verify_cert=False,
-                ssl_verify_identity=False
-            )
-            return connection
+            return cls.get_pool().acquire()
         except Error as e:
             print(f"Database connection error: {e}")
             return None
@@ -45,10 +298,43 @@ def get_db_connection():
     return Database.get_connection()
 
 def close_db_connection(connection):
-    """Close database connection"""
-    if connection and connection.is_connected():
+    """Return database connection to the pool"""
+    if connection:
         connection.close()
 
+def get_request_db():
+    """
+    Get the connection bound to the current request.
+    The connection is checked out on first use and released by
+    release_request_db() when the app context tears down, so handlers
+    never need to close it themselves - including on exception paths.
+    """
+    if 'db_conn' not in g:
+        g.db_conn = get_db_connection()
+    return g.db_conn
+
+def release_request_db(exception=None):
+    """Teardown hook: roll back uncommitted work and return the request connection"""
+    db_conn = g.pop('db_conn', None)
+    if db_conn is None:
+        return
+
+    try:
+        if db_conn.is_connected() and db_conn.in_transaction:
+            db_conn.rollback()
+    except Exception as e:
+        print(f"Database rollback error: {e}")
+    finally:
+        close_db_connection(db_conn)
+
+def init_app(app):
+    """Register request-scoped connection handling on the Flask app"""
+    app.teardown_appcontext(release_request_db)
+
+def get_pool_stats():
+    """Get connection pool metrics for the current worker"""
+    return Database.get_pool().stats()
+
 @contextmanager
 def database_session():
     """Context manager for database sessions"""
@@ -62,6 +62,13 @@ CREATE TABLE users (
     INDEX idx_is_active (is_active)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Shared version counters for per-worker caches (bumped when the source data changes)
+CREATE TABLE cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Audit log for compliance
 CREATE TABLE audit_log (
     id INT PRIMARY KEY AUTO_INCREMENT,
@@ -116,6 +123,10 @@ CREATE TABLE patients (
     current_medications JSON,
     blood_type VARCHAR(5),
     
+    -- Phonetic keys for name search (see patient_search.py)
+    first_name_phonetic VARCHAR(4) GENERATED ALWAYS AS (LEFT(SOUNDEX(first_name), 4)) STORED,
+    last_name_phonetic VARCHAR(4) GENERATED ALWAYS AS (LEFT(SOUNDEX(last_name), 4)) STORED,
+    
     -- Record management
     created_by INT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -127,7 +138,13 @@ CREATE TABLE patients (
     INDEX idx_medical_aid_number (medical_aid_number),
     INDEX idx_phone_number (phone_number),
     INDEX idx_is_polmed_member (is_polmed_member),
-    INDEX idx_created_at (created_at)
+    INDEX idx_created_at (created_at),
+    INDEX idx_last_name (last_name),
+    INDEX idx_first_name (first_name),
+    INDEX idx_last_name_phonetic (last_name_phonetic),
+    INDEX idx_first_name_phonetic (first_name_phonetic),
+    FULLTEXT INDEX ft_patient_name (first_name, last_name),
+    INDEX idx_updated_at (updated_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Patient contact information
@@ -174,6 +191,7 @@ CREATE TABLE patient_visits (
     FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE,
     FOREIGN KEY (created_by) REFERENCES users(id),
     INDEX idx_patient_id (patient_id),
+    INDEX idx_patient_visit_date (patient_id, visit_date),
     INDEX idx_visit_date (visit_date),
     INDEX idx_visit_status (visit_status),
     INDEX idx_route_id (route_id)
@@ -386,6 +404,13 @@ CREATE TABLE locations (
     
     -- Capacity
     capacity INT,
+    -- Confirmed/pending appointments holding a slot (maintained by
+    -- appointment_slots.py; rebuild with: python appointment_slots.py)
+    booked_appointments INT NOT NULL DEFAULT 0,
+    
+    -- Set on the bookable visit generated from a route_locations row
+    -- (slot_generator.py); NULL for places and hand-added visits
+    route_location_id INT NULL,
     
     -- Facilities
     has_power BOOLEAN DEFAULT TRUE,
@@ -400,7 +425,9 @@ CREATE TABLE locations (
     
     INDEX idx_province (province),
     INDEX idx_location_type (location_type),
-    INDEX idx_is_active (is_active)
+    INDEX idx_is_active (is_active),
+    INDEX idx_updated_at (updated_at, id),
+    UNIQUE KEY unique_route_location_visit (route_location_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Routes (scheduled clinic visits to locations)
@@ -433,7 +460,8 @@ CREATE TABLE routes (
     FOREIGN KEY (created_by) REFERENCES users(id),
     INDEX idx_province (province),
     INDEX idx_status (status),
-    INDEX idx_start_date (start_date)
+    INDEX idx_start_date (start_date),
+    INDEX idx_updated_at (updated_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Route locations (many-to-many between routes and locations with timing)
@@ -465,7 +493,8 @@ CREATE TABLE route_locations (
 -- 7. APPOINTMENT MANAGEMENT
 -- ============================================================================
 
--- Appointment slots (generated from route locations)
+-- Appointments (booked against a location visit's slot capacity, which is
+-- generated from route locations; see slot_generator.py)
 CREATE TABLE appointments (
     id INT PRIMARY KEY AUTO_INCREMENT,
     route_location_id INT NOT NULL,
@@ -494,9 +523,11 @@ CREATE TABLE appointments (
     
     FOREIGN KEY (route_location_id) REFERENCES route_locations(id) ON DELETE CASCADE,
     FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE SET NULL,
+    INDEX idx_route_location_slot (route_location_id, appointment_date, appointment_time),
     INDEX idx_appointment_date (appointment_date),
     INDEX idx_status (status),
-    INDEX idx_patient_id (patient_id)
+    INDEX idx_patient_id (patient_id),
+    INDEX idx_updated_at (updated_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- ============================================================================
@@ -552,7 +583,8 @@ CREATE TABLE assets (
     FOREIGN KEY (category_id) REFERENCES asset_categories(id),
     FOREIGN KEY (assigned_to) REFERENCES users(id),
     INDEX idx_asset_tag (asset_tag),
-    INDEX idx_status (status)
+    INDEX idx_status (status),
+    INDEX idx_created_at (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Asset maintenance log
@@ -611,7 +643,8 @@ CREATE TABLE consumables (
     
     FOREIGN KEY (category_id) REFERENCES consumable_categories(id),
     UNIQUE KEY unique_item (item_code),
-    INDEX idx_item_name (item_name)
+    INDEX idx_item_name (item_name),
+    INDEX idx_updated_at (updated_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Suppliers
@@ -667,6 +700,39 @@ CREATE TABLE inventory_stock (
     INDEX idx_status (status)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Per-consumable on-hand totals over Active batches (maintained by stock.py;
+-- rebuild with: python stock.py)
+CREATE TABLE consumable_stock_levels (
+    consumable_id INT PRIMARY KEY,
+    quantity_on_hand INT NOT NULL DEFAULT 0,
+    last_unit_cost DECIMAL(10,2),
+    refreshed_at TIMESTAMP NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    
+    FOREIGN KEY (consumable_id) REFERENCES consumables(id),
+    INDEX idx_quantity_on_hand (quantity_on_hand)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Active/resolved inventory alerts (maintained by inventory_alerts.py).
+-- entity_id is an inventory_stock id (expiry), consumable id (low_stock)
+-- or asset id (warranty)
+CREATE TABLE inventory_alerts (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    alert_type ENUM('expiry', 'low_stock', 'warranty') NOT NULL,
+    entity_id INT NOT NULL,
+    consumable_id INT,
+    quantity INT,
+    threshold INT,
+    due_date DATE,
+    is_active BOOLEAN DEFAULT TRUE,
+    raised_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    resolved_at TIMESTAMP NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    
+    UNIQUE KEY unique_alert (alert_type, entity_id),
+    INDEX idx_active_due (alert_type, is_active, due_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Inventory usage tracking
 CREATE TABLE inventory_usage (
     id INT PRIMARY KEY AUTO_INCREMENT,
@@ -684,12 +750,32 @@ CREATE TABLE inventory_usage (
     FOREIGN KEY (stock_id) REFERENCES inventory_stock(id),
     FOREIGN KEY (visit_id) REFERENCES patient_visits(id) ON DELETE SET NULL,
     FOREIGN KEY (used_by) REFERENCES users(id),
-    INDEX idx_usage_date (usage_date),
+    -- Covers the reorder forecast's windowed scan (reorder_forecast.py)
+    INDEX idx_usage_date (usage_date, consumable_id, usage_reason, visit_id, quantity_used),
     INDEX idx_consumable_id (consumable_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- ============================================================================
--- 9. REPORTING & ANALYTICS
+-- 9. OFFLINE SYNC
+-- ============================================================================
+
+-- Operations applied from offline devices (idempotency keys for /api/sync/pending)
+CREATE TABLE sync_operations (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    device_id VARCHAR(100) NOT NULL,
+    operation_id VARCHAR(100) NOT NULL,
+    table_name VARCHAR(50) NOT NULL,
+    operation_type VARCHAR(20) NOT NULL,
+    result_id INT,
+    applied_by INT,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (applied_by) REFERENCES users(id),
+    UNIQUE KEY unique_device_operation (device_id, operation_id),
+    INDEX idx_applied_at (applied_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- ============================================================================
+-- 10. REPORTING & ANALYTICS
 -- ============================================================================
 
 CREATE TABLE daily_metrics (
@@ -701,20 +787,35 @@ CREATE TABLE daily_metrics (
     scheduled_visits INT DEFAULT 0,
     walk_in_visits INT DEFAULT 0,
     completed_visits INT DEFAULT 0,
+    cancelled_visits INT DEFAULT 0,
+    pending_visits INT DEFAULT 0,
     
     -- Patient metrics
     new_patients INT DEFAULT 0,
     returning_patients INT DEFAULT 0,
+    total_patients INT DEFAULT 0,
     
     -- Clinical metrics
     referrals_created INT DEFAULT 0,
     prescriptions_issued INT DEFAULT 0,
+    pending_referrals INT DEFAULT 0,
+    
+    -- Operations metrics
+    active_users INT DEFAULT 0,
+    active_routes INT DEFAULT 0,
+    upcoming_appointments INT DEFAULT 0,
+    pending_appointments INT DEFAULT 0,
     
     -- Inventory metrics
     stock_adjustments INT DEFAULT 0,
     stock_alerts INT DEFAULT 0,
+    expiry_alerts INT DEFAULT 0,
+    
+    -- Last full recompute (NULL until the first one)
+    refreshed_at TIMESTAMP NULL,
     
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_metric_date (metric_date)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -743,6 +844,9 @@ INSERT IGNORE INTO user_roles (id, role_name, description, permissions) VALUES
 (7, 'finance', 'Financial operations', '["reports.financial"]'),
 (8, 'viewer', 'Read-only access', '["patient.read","visit.read","reports.read"]');
 
+INSERT IGNORE INTO cache_versions (name, version) VALUES
+('permissions', 1);
+
 INSERT IGNORE INTO workflow_stages (id, stage_name, stage_order, description, required_user_roles, requires_signature, duration_minutes) VALUES
 (1, 'Registration', 1, 'Patient registration and check-in', '["clerk","administrator"]', FALSE, 5),
 (2, 'Nursing Assessment', 2, 'Vital signs and nursing assessment', '["nurse","administrator"]', TRUE, 15),
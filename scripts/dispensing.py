@@ -0,0 +1,215 @@
+"""
+POLMED Backend - FEFO Dispensing
+Dispenses consumables across inventory_stock batches, first expiry first out
+
+Each worker keeps a per-consumable index of dispensable batch ids in FEFO
+order (expiry date, then received date; undated batches last). A dispense:
+1. takes the candidate batch ids from the index (loaded on first use and
+   refreshed after DISPENSE_INDEX_TTL seconds, on receipts in this worker,
+   or when the cached batches cannot cover a request);
+2. locks just those rows by primary key (SELECT ... FOR UPDATE) for their
+   current quantities - no range locks on consumable_id, so receipts are
+   not blocked;
+3. allocates in FEFO order and applies all draws in one conditional UPDATE
+   (stock.adjust_stock_quantities), then writes the inventory_usage rows
+   with a single executemany.
+The index only holds ordering; quantities are always read under lock.
+"""
+
+import threading
+import time
+from datetime import date
+
+from config import Config
+from stock import adjust_stock_quantities
+
+USAGE_REASONS = ('patient_use', 'waste', 'expiry', 'loss', 'other')
+
+BATCH_INDEX_SQL = """
+    SELECT id, consumable_id, expiry_date
+    FROM inventory_stock
+    WHERE consumable_id IN ({ids}) AND status = 'Active' AND quantity_current > 0
+    ORDER BY consumable_id, expiry_date IS NULL, expiry_date, received_date, id
+"""
+
+USAGE_INSERT_SQL = """
+    INSERT INTO inventory_usage (
+        consumable_id, stock_id, quantity_used, visit_id, usage_location,
+        usage_reason, notes, used_by, usage_date
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+class DispenseError(Exception):
+    """A dispense that cannot be filled; `shortages` lists {consumable_id, requested, available}"""
+
+    def __init__(self, message, shortages=None):
+        super().__init__(message)
+        self.shortages = shortages or []
+
+
+class BatchIndex:
+    """consumable_id -> FEFO-ordered [(stock_id, expiry_date)] for the current worker"""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._batches = {}   # consumable_id -> (loaded_at, [(stock_id, expiry_date)])
+        self.loads = 0
+
+    def get(self, cursor, consumable_ids, refresh=False):
+        """Batches per consumable, loading missing or stale entries in one query"""
+        now = time.monotonic()
+        with self._lock:
+            cached = {
+                cid: self._batches[cid][1] for cid in consumable_ids
+                if not refresh and cid in self._batches and now - self._batches[cid][0] < self.ttl
+            }
+
+        missing = [cid for cid in consumable_ids if cid not in cached]
+        if missing:
+            loaded = {cid: [] for cid in missing}
+            cursor.execute(BATCH_INDEX_SQL.format(ids=', '.join(['%s'] * len(missing))), missing)
+            for row in cursor.fetchall():
+                loaded[row['consumable_id']].append((row['id'], row['expiry_date']))
+
+            with self._lock:
+                for cid, batches in loaded.items():
+                    self._batches[cid] = (now, batches)
+                self.loads += 1
+            cached.update(loaded)
+
+        return cached
+
+    def invalidate(self, consumable_id=None):
+        with self._lock:
+            if consumable_id is None:
+                self._batches.clear()
+            else:
+                self._batches.pop(consumable_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'consumables': len(self._batches), 'loads': self.loads, 'ttl': self.ttl}
+
+
+_index = BatchIndex(ttl=Config.DISPENSE_INDEX_TTL)
+
+
+def _lock_quantities(cursor, stock_ids):
+    """Current quantities of the candidate batches, row-locked in primary key order"""
+    placeholders = ', '.join(['%s'] * len(stock_ids))
+    cursor.execute(
+        f"""
+        SELECT id, quantity_current FROM inventory_stock
+        WHERE id IN ({placeholders}) AND status = 'Active'
+        ORDER BY id
+        FOR UPDATE
+        """,
+        sorted(stock_ids)
+    )
+    return {row['id']: row['quantity_current'] for row in cursor.fetchall()}
+
+
+def _allocate(requests, batches, quantities, today):
+    """
+    FEFO allocation. Returns (draws, shortages) where draws is
+    [(consumable_id, stock_id, quantity, expiry_date)].
+    """
+    draws = []
+    shortages = []
+    remaining_by_batch = dict(quantities)
+
+    for consumable_id, requested in requests.items():
+        remaining = requested
+        for stock_id, expiry_date in batches.get(consumable_id, []):
+            if remaining == 0:
+                break
+            if expiry_date is not None and expiry_date < today:
+                continue
+            available = remaining_by_batch.get(stock_id, 0)
+            if available <= 0:
+                continue
+            take = min(available, remaining)
+            remaining_by_batch[stock_id] = available - take
+            remaining -= take
+            draws.append((consumable_id, stock_id, take, expiry_date))
+
+        if remaining:
+            shortages.append({
+                'consumable_id': consumable_id,
+                'requested': requested,
+                'available': requested - remaining
+            })
+
+    return draws, shortages
+
+
+def dispense(db_conn, items, user_id, visit_id=None, usage_reason='patient_use',
+             usage_location=None, notes=None):
+    """
+    Dispense [(consumable_id, quantity)] FEFO across batches. Does not commit.
+    Raises DispenseError if any item cannot be filled (nothing is written;
+    the caller should roll back to release the row locks).
+    Returns a list of {consumable_id, stock_id, quantity, expiry_date}.
+    """
+    requests = {}
+    for consumable_id, quantity in items:
+        requests[consumable_id] = requests.get(consumable_id, 0) + quantity
+
+    today = date.today()
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        batches = _index.get(cursor, list(requests))
+        for attempt in range(2):
+            stock_ids = {
+                stock_id for cid in requests for stock_id, expiry_date in batches[cid]
+                if expiry_date is None or expiry_date >= today
+            }
+            quantities = _lock_quantities(cursor, stock_ids) if stock_ids else {}
+            draws, shortages = _allocate(requests, batches, quantities, today)
+            if not shortages or attempt:
+                break
+            # The cached batch list may predate a receipt in another worker
+            batches.update(_index.get(cursor, [s['consumable_id'] for s in shortages], refresh=True))
+
+        if shortages:
+            shortage = shortages[0]
+            raise DispenseError(
+                f"Insufficient stock for consumable {shortage['consumable_id']}: "
+                f"requested {shortage['requested']}, available {shortage['available']}",
+                shortages
+            )
+
+        deltas = {}
+        for _, stock_id, quantity, _ in draws:
+            deltas[stock_id] = deltas.get(stock_id, 0) - quantity
+        adjust_stock_quantities(cursor, deltas, count_usage=True)
+
+        cursor.executemany(USAGE_INSERT_SQL, [
+            (consumable_id, stock_id, quantity, visit_id, usage_location,
+             usage_reason, notes, user_id, today)
+            for consumable_id, stock_id, quantity, _ in draws
+        ])
+    finally:
+        cursor.close()
+
+    # Batches that ran out are dropped from the index on next use
+    exhausted = {stock_id for stock_id, delta in deltas.items() if quantities[stock_id] + delta == 0}
+    for consumable_id in {draw[0] for draw in draws if draw[1] in exhausted}:
+        _index.invalidate(consumable_id)
+
+    return [
+        {'consumable_id': consumable_id, 'stock_id': stock_id, 'quantity': quantity, 'expiry_date': expiry_date}
+        for consumable_id, stock_id, quantity, expiry_date in draws
+    ]
+
+
+def invalidate_batches(consumable_id=None):
+    """Forget cached batches (e.g. after receiving stock)"""
+    _index.invalidate(consumable_id)
+
+
+def get_dispensing_stats():
+    """Get batch index metrics for the current worker"""
+    return _index.stats()
@@ -6,11 +6,21 @@ System health monitoring and PALMED medical aid synchronization
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timezone
 from auth import require_auth, require_role
-from database import get_db_connection
+from database import get_request_db, get_db_connection, close_db_connection, get_pool_stats
+from audit import log_action, get_audit_stats
+from dashboard_metrics import get_dashboard_metrics
+from response_cache import cached_response, invalidate_on_write
+from config import Config
+from sync_ingest import apply_records, APPLIED, DUPLICATE, REJECTED, RETRY
+from sync_changes import fetch_changes
+from responses import json_response, stream_response
+from patient_import import import_patients, detect_format, ImportReadError, IMPORT_FORMATS
+from visit_export import export_visits, EXPORT_FORMATS, VISIT_EXPORT_KEYSET
 import os
 
 health_bp = Blueprint('health', __name__, url_prefix='/api/health')
 sync_bp = Blueprint('sync', __name__, url_prefix='/api/sync')
+invalidate_on_write(sync_bp, 'clinical', 'patients', 'appointments', 'inventory')
 
 # ============================================================================
 # HEALTH CHECKS
@@ -23,12 +33,11 @@ def health_check():
     Returns system status and version
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         cursor.execute("SELECT 1")
         cursor.fetchone()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -54,7 +63,7 @@ def detailed_health_check():
     Requires admin role
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         health_data = {
@@ -168,9 +177,8 @@ def detailed_health_check():
         # 7. Low stock alerts
         try:
             cursor.execute("""
-                SELECT COUNT(*) as count FROM inventory_stock s
-                JOIN consumables c ON s.consumable_id = c.id
-                WHERE s.is_active = TRUE AND s.quantity_current <= c.reorder_level
+                SELECT COUNT(*) as count FROM inventory_alerts
+                WHERE alert_type = 'low_stock' AND is_active = TRUE
             """)
             result = cursor.fetchone()
             low_stock_count = result['count']
@@ -189,14 +197,16 @@ def detailed_health_check():
         try:
             cursor.execute("""
                 SELECT COUNT(*) as count FROM audit_log
-                WHERE timestamp >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
+                WHERE created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
             """)
             result = cursor.fetchone()
             audit_count = result['count']
+            writer_stats = get_audit_stats()
             
             health_data['checks']['audit'] = {
-                'status': 'healthy',
-                'events_24h': audit_count
+                'status': 'warning' if writer_stats['dropped'] > 0 else 'healthy',
+                'events_24h': audit_count,
+                'writer': writer_stats
             }
         except Exception as e:
             health_data['checks']['audit'] = {
@@ -204,8 +214,14 @@ def detailed_health_check():
                 'message': str(e)
             }
         
+        # 9. Connection pool
+        pool_stats = get_pool_stats()
+        health_data['checks']['connection_pool'] = {
+            'status': 'warning' if pool_stats['exhausted'] > 0 else 'healthy',
+            **pool_stats
+        }
+        
         cursor.close()
-        db_conn.close()
         
         # Determine overall status
         statuses = [check.get('status') for check in health_data['checks'].values()]
@@ -237,7 +253,7 @@ def database_health():
     Check database health metrics
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         metrics = {}
@@ -272,7 +288,6 @@ def database_health():
             metrics['tables'][row['TABLE_NAME']] = row['TABLE_ROWS']
         
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -297,7 +312,7 @@ def sync_palmed_members():
     This endpoint would integrate with PALMED API for member verification
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Get patients with PALMED medical aid
@@ -320,7 +335,6 @@ def sync_palmed_members():
         palmed_members = cursor.fetchall()
         
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -344,12 +358,16 @@ def sync_patient_visits():
     """
     Sync patient visits to external system
     Useful for reporting and analytics
+    Body: {date_from, date_to, format (json, ndjson, csv), cursor}
+    ndjson/csv stream the range without buffering it; pass the last
+    checkpoint/resume_cursor as cursor to resume an interrupted export.
     """
     try:
         data = request.get_json() or {}
         
         date_from = data.get('date_from')
         date_to = data.get('date_to')
+        fmt = (data.get('format') or 'json').lower()
         
         if not date_from or not date_to:
             return jsonify({
@@ -357,7 +375,16 @@ def sync_patient_visits():
                 'error': 'date_from and date_to are required'
             }), 400
         
-        db_conn = get_db_connection()
+        if fmt in EXPORT_FORMATS:
+            return stream_visit_export(date_from, date_to, fmt, data.get('cursor') or None)
+        
+        if fmt != 'json':
+            return jsonify({
+                'success': False,
+                'error': f'format must be one of: json, {", ".join(EXPORT_FORMATS)}'
+            }), 400
+        
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Get visits in date range
@@ -385,14 +412,10 @@ def sync_patient_visits():
         visits = cursor.fetchall()
         
         # Log sync
-        cursor.execute("""
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'SYNC', 'visits', 0, %s, %s)
-        """, (request.user_id, datetime.now(timezone.utc), f'Synced {len(visits)} visits'))
+        log_action(db_conn, 'SYNC', 'visits', None, f'Synced {len(visits)} visits')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -413,82 +436,221 @@ def sync_patient_visits():
             'error': str(e)
         }), 500
 
-@sync_bp.route('/dashboard-stats', methods=['GET'])
+def stream_visit_export(date_from, date_to, fmt, after):
+    """Streaming NDJSON/CSV branch of sync_patient_visits"""
+    try:
+        datetime.strptime(str(date_from), '%Y-%m-%d')
+        datetime.strptime(str(date_to), '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'error': 'date_from and date_to must be YYYY-MM-DD'}), 400
+    
+    if after:
+        try:
+            VISIT_EXPORT_KEYSET.decode(after)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+    
+    def generate():
+        # Own connection: the unbuffered result ties it up until fully read
+        db_conn = get_db_connection()
+        if not db_conn:
+            raise RuntimeError('Database connection failed')
+        
+        completed = False
+        try:
+            count = yield from export_visits(db_conn, date_from, date_to, fmt, after)
+            log_action(db_conn, 'SYNC', 'visits', None, f'Exported {count} visits ({fmt})')
+            db_conn.commit()
+            completed = True
+        finally:
+            if completed:
+                close_db_connection(db_conn)
+            else:
+                # Client went away mid-stream - unread rows make the connection unusable
+                db_conn.discard()
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f'visits_{date_from}_{date_to}.{fmt}'
+    return stream_response(generate(), mimetype, filename=filename)
+
+@sync_bp.route('/patients/import', methods=['POST'])
+@require_role('administrator', 'clerk')
+def import_patient_file():
+    """
+    Bulk import patients from a CSV or NDJSON file
+    Body: multipart upload in `file`, or the raw file with a text/csv or
+    application/x-ndjson content type
+    Query params: format (csv, ndjson - otherwise detected), dry_run
+    Returns per-row errors for duplicate and invalid rows.
+    """
+    try:
+        upload = request.files.get('file')
+        if upload:
+            stream = upload.stream
+            detected = detect_format(upload.filename, upload.content_type)
+        else:
+            stream = request.stream
+            detected = detect_format(None, request.content_type)
+        
+        fmt = (request.args.get('format') or detected or '').lower()
+        if fmt not in IMPORT_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': f'format must be one of: {", ".join(IMPORT_FORMATS)}'
+            }), 400
+        
+        dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+        
+        db_conn = get_request_db()
+        try:
+            errors, summary = import_patients(db_conn, stream, fmt, request.user_id, dry_run=dry_run)
+        except ImportReadError as e:
+            # Rows before the unreadable part are already imported - report them
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'data': {
+                    'summary': e.summary,
+                    'errors': e.problems,
+                    'stopped_after_line': e.line,
+                    'dry_run': dry_run,
+                    'sync_timestamp': datetime.now(timezone.utc).isoformat()
+                }
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'summary': summary,
+                'errors': errors,
+                'dry_run': dry_run,
+                'sync_timestamp': datetime.now(timezone.utc).isoformat()
+            }
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@sync_bp.route('/pending', methods=['POST'])
 @require_auth
-def get_dashboard_stats():
+def sync_pending_records():
     """
-    Get comprehensive dashboard statistics
+    Bulk ingest of operations queued offline by field devices
+    Body: {device_id, records: [{operation_id, table_name, operation_type, record_id, data, timestamp}]}
+    Records are applied in chunks of SYNC_BATCH_SIZE (one transaction per
+    chunk) and are idempotent per device_id + operation_id.
     """
     try:
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor(dictionary=True)
+        data = request.get_json() or {}
         
-        stats = {
-            'timestamp': datetime.now(timezone.utc).isoformat()
-        }
+        device_id = (data.get('device_id') or '').strip()
+        records = data.get('records')
         
-        # Today's stats
-        today = datetime.now().date()
+        if not device_id:
+            return jsonify({'success': False, 'error': 'device_id is required'}), 400
         
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM patient_visits
-            WHERE visit_date = %s AND is_active = TRUE
-        """, (today,))
-        stats['today_patients'] = cursor.fetchone()['count']
+        if not isinstance(records, list):
+            return jsonify({'success': False, 'error': 'records must be a list'}), 400
         
-        # Active routes
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM routes
-            WHERE is_active = TRUE AND end_date >= CURDATE()
-        """)
-        stats['active_routes'] = cursor.fetchone()['count']
+        if len(records) > Config.SYNC_MAX_RECORDS:
+            return jsonify({
+                'success': False,
+                'error': f'Too many records in one request (max {Config.SYNC_MAX_RECORDS})'
+            }), 413
         
-        # Pending referrals
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM referrals
-            WHERE referral_status = 'pending' AND is_active = TRUE
-        """)
-        stats['pending_referrals'] = cursor.fetchone()['count']
+        db_conn = get_request_db()
+        results = apply_records(db_conn, device_id[:100], records, request.user_id, request.user_role)
         
-        # Pending appointments
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM appointments
-            WHERE appointment_status = 'pending' AND appointment_date >= CURDATE()
-        """)
-        stats['pending_appointments'] = cursor.fetchone()['count']
+        summary = {status: 0 for status in (APPLIED, DUPLICATE, REJECTED, RETRY)}
+        for result in results:
+            summary[result['status']] += 1
         
-        # Low stock alerts
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM inventory_stock s
-            JOIN consumables c ON s.consumable_id = c.id
-            WHERE s.is_active = TRUE AND s.quantity_current <= c.reorder_level
-        """)
-        stats['low_stock_alerts'] = cursor.fetchone()['count']
+        return jsonify({
+            'success': True,
+            'data': {
+                'device_id': device_id,
+                'results': results,
+                'summary': summary,
+                'sync_timestamp': datetime.now(timezone.utc).isoformat()
+            }
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@sync_bp.route('/changes', methods=['GET'])
+@require_auth
+def sync_changes():
+    """
+    Incremental change feed for offline devices
+    Query params: since (token from a previous pull), route_id or province, limit
+    Returns columnar batches per entity plus deleted ids; call again with
+    next_token while has_more is true. Gzip-compressed when accepted.
+    """
+    try:
+        since = request.args.get('since', '').strip() or None
+        route_id = request.args.get('route_id', type=int)
+        province = request.args.get('province', '').strip() or None
+        limit = int(request.args.get('limit', Config.SYNC_BATCH_SIZE))
         
-        # Expiry alerts (next 30 days)
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM inventory_stock
-            WHERE is_active = TRUE
-                AND expiry_date IS NOT NULL
-                AND expiry_date <= DATE_ADD(NOW(), INTERVAL 30 DAY)
-                AND expiry_date > NOW()
-        """)
-        stats['expiry_alerts'] = cursor.fetchone()['count']
+        if limit < 1 or limit > Config.SYNC_MAX_RECORDS:
+            return jsonify({
+                'success': False,
+                'error': f'limit must be between 1 and {Config.SYNC_MAX_RECORDS}'
+            }), 400
         
-        # Total active patients
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM patients WHERE is_active = TRUE
-        """)
-        stats['total_patients'] = cursor.fetchone()['count']
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
         
-        # Active users
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM users WHERE is_active = TRUE
-        """)
-        stats['active_users'] = cursor.fetchone()['count']
+        try:
+            feed = fetch_changes(cursor, since, route_id=route_id, province=province, limit=limit)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         cursor.close()
-        db_conn.close()
+        
+        return json_response({
+            'success': True,
+            'data': feed
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@sync_bp.route('/dashboard-stats', methods=['GET'])
+@require_auth
+@cached_response(tags=('clinical', 'patients', 'appointments', 'routes', 'inventory'))
+def get_dashboard_stats():
+    """
+    Get comprehensive dashboard statistics
+    """
+    try:
+        db_conn = get_request_db()
+        
+        # Precomputed row from daily_metrics (see dashboard_metrics.py)
+        metrics = get_dashboard_metrics(db_conn)
+        
+        stats = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'today_patients': metrics['total_visits'],
+            'active_routes': metrics['active_routes'],
+            'pending_referrals': metrics['pending_referrals'],
+            'pending_appointments': metrics['pending_appointments'],
+            'low_stock_alerts': metrics['stock_alerts'],
+            'expiry_alerts': metrics['expiry_alerts'],
+            'total_patients': metrics['total_patients'],
+            'active_users': metrics['active_users'],
+            'metrics_refreshed_at': str(metrics['refreshed_at'])
+        }
         
         return jsonify({
             'success': True,
@@ -0,0 +1,211 @@
+"""
+POLMED Backend - Inventory Alerts
+Persisted expiry, low-stock and warranty alerts
+
+Alerts live in inventory_alerts, one row per (alert_type, entity_id), active
+or resolved. They are evaluated by events rather than on every read:
+- stock receipts, adjustments and dispensing (stock.py) re-evaluate low-stock
+  for the touched consumables and expiry for the touched batches;
+- asset creation evaluates that asset's warranty;
+- a daily sweep re-evaluates everything, since date-based alerts come due
+  without any write. The first alert read of the day runs it (claimed via
+  cache_versions so one worker does it), or run `python inventory_alerts.py`
+  from cron.
+Expiry and warranty alerts are kept for dates up to
+INVENTORY_ALERT_HORIZON_DAYS ahead; readers narrow that with days_ahead.
+Every rule evaluation for an event goes to MySQL in one round trip.
+"""
+
+import sys
+import threading
+from datetime import date
+
+from config import Config
+
+ALERT_TYPES = ('expiry', 'low_stock', 'warranty')
+
+SWEEP_VERSION_NAME = 'inventory_alerts_sweep'
+
+# alert_type -> how to find qualifying entities.
+# `select` yields (entity_id, consumable_id, quantity, threshold, due_date);
+# `qualifies` may use {horizon}. Source tables share column names with
+# inventory_alerts (e.g. is_active), so the upsert qualifies its own columns.
+ALERT_RULES = {
+    'low_stock': {
+        'select': "c.id, c.id, COALESCE(l.quantity_on_hand, 0), c.reorder_level, NULL",
+        'source': "consumables c LEFT JOIN consumable_stock_levels l ON l.consumable_id = c.id",
+        'entity': "c.id",
+        'qualifies': "c.is_active = TRUE AND COALESCE(l.quantity_on_hand, 0) <= c.reorder_level",
+    },
+    'expiry': {
+        'select': "s.id, s.consumable_id, s.quantity_current, NULL, s.expiry_date",
+        'source': "inventory_stock s",
+        'entity': "s.id",
+        # Expired batches that still hold stock stay active until written off
+        'qualifies': """s.status = 'Active' AND s.quantity_current > 0
+            AND s.expiry_date IS NOT NULL
+            AND s.expiry_date <= DATE_ADD(CURDATE(), INTERVAL {horizon} DAY)""",
+    },
+    'warranty': {
+        'select': "a.id, NULL, NULL, NULL, a.warranty_expiry",
+        'source': "assets a",
+        'entity': "a.id",
+        'qualifies': """a.warranty_expiry IS NOT NULL
+            AND a.warranty_expiry >= CURDATE()
+            AND a.warranty_expiry <= DATE_ADD(CURDATE(), INTERVAL {horizon} DAY)""",
+    },
+}
+
+RAISE_SQL = """
+    INSERT INTO inventory_alerts (
+        alert_type, entity_id, consumable_id, quantity, threshold, due_date, is_active, raised_at
+    )
+    SELECT '{alert_type}', {select}, TRUE, NOW()
+    FROM {source}
+    WHERE {qualifies}{scope}
+    ON DUPLICATE KEY UPDATE
+        raised_at = IF(inventory_alerts.is_active, inventory_alerts.raised_at, VALUES(raised_at)),
+        consumable_id = VALUES(consumable_id),
+        quantity = VALUES(quantity),
+        threshold = VALUES(threshold),
+        due_date = VALUES(due_date),
+        is_active = TRUE,
+        resolved_at = NULL
+"""
+
+RESOLVE_SQL = """
+    UPDATE inventory_alerts
+    SET is_active = FALSE, resolved_at = NOW()
+    WHERE alert_type = '{alert_type}' AND is_active = TRUE{alert_scope}
+        AND entity_id NOT IN (
+            SELECT {entity} FROM {source} WHERE {qualifies}{scope}
+        )
+"""
+
+
+def _rule_statements(alert_type, scope_sql='', alert_scope_sql=''):
+    rule = ALERT_RULES[alert_type]
+    fields = dict(
+        rule,
+        alert_type=alert_type,
+        qualifies=rule['qualifies'].format(horizon=int(Config.INVENTORY_ALERT_HORIZON_DAYS)),
+        scope=scope_sql,
+        alert_scope=alert_scope_sql,
+    )
+    return [RAISE_SQL.format(**fields), RESOLVE_SQL.format(**fields)]
+
+
+def _execute(cursor, statements, params):
+    """Run the statements in one round trip"""
+    for result in cursor.execute(';\n'.join(statements), params, multi=True):
+        if result.with_rows:
+            result.fetchall()
+
+
+def _in(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def evaluate_stock_alerts(cursor, stock_ids):
+    """Re-evaluate low-stock for the batches' consumables and expiry for the batches"""
+    stock_ids = list(stock_ids)
+    if not stock_ids:
+        return
+
+    ids = _in(stock_ids)
+    consumables = f"SELECT consumable_id FROM inventory_stock WHERE id IN ({ids})"
+    statements = (
+        _rule_statements('low_stock', f" AND c.id IN ({consumables})", f" AND entity_id IN ({consumables})") +
+        _rule_statements('expiry', f" AND s.id IN ({ids})", f" AND entity_id IN ({ids})")
+    )
+    # Placeholder order: low-stock raise, resolve (alert scope, then source
+    # scope), then the same for expiry
+    params = stock_ids * 6
+    _execute(cursor, statements, params)
+
+
+def evaluate_asset_alerts(cursor, asset_ids):
+    """Re-evaluate warranty alerts for the given assets"""
+    asset_ids = list(asset_ids)
+    if not asset_ids:
+        return
+
+    ids = _in(asset_ids)
+    _execute(
+        cursor,
+        _rule_statements('warranty', f" AND a.id IN ({ids})", f" AND entity_id IN ({ids})"),
+        asset_ids * 3
+    )
+
+
+def sweep_alerts(db_conn):
+    """Re-evaluate every alert rule over all entities. Does not commit."""
+    cursor = db_conn.cursor()
+    statements = []
+    for alert_type in ALERT_TYPES:
+        statements += _rule_statements(alert_type)
+    _execute(cursor, statements, [])
+    cursor.close()
+
+
+class _SweepState:
+    """Per-worker memo of the last day a sweep was confirmed"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.swept_day = None
+
+
+_sweep_state = _SweepState()
+
+
+def ensure_daily_sweep(db_conn):
+    """
+    Run today's sweep if no worker has yet. Cheap after the first call of
+    the day in each worker. Commits when it sweeps.
+    """
+    today = date.today()
+    if _sweep_state.swept_day == today:
+        return
+
+    with _sweep_state.lock:
+        if _sweep_state.swept_day == today:
+            return
+
+        day_version = int(today.strftime('%Y%m%d'))
+        cursor = db_conn.cursor()
+        cursor.execute(
+            "INSERT IGNORE INTO cache_versions (name, version) VALUES (%s, 0)",
+            (SWEEP_VERSION_NAME,)
+        )
+        # Claim the day; only the worker whose UPDATE matches does the sweep
+        cursor.execute(
+            "UPDATE cache_versions SET version = %s WHERE name = %s AND version < %s",
+            (day_version, SWEEP_VERSION_NAME, day_version)
+        )
+        claimed = cursor.rowcount == 1
+        cursor.close()
+
+        if claimed:
+            try:
+                sweep_alerts(db_conn)
+            except Exception:
+                db_conn.rollback()
+                raise
+        db_conn.commit()
+        _sweep_state.swept_day = today
+
+
+if __name__ == '__main__':
+    from database import get_db_connection, close_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    try:
+        sweep_alerts(conn)
+        conn.commit()
+        print("Swept inventory_alerts")
+    finally:
+        close_db_connection(conn)
@@ -4,11 +4,28 @@ Asset lifecycle, consumable tracking, stock alerts, and supplier management
 """
 
 from flask import Blueprint, request, jsonify
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from auth import require_auth, require_role
-from database import get_db_connection
+from database import get_request_db
+from audit import log_action
+from dashboard_metrics import record_metrics
+from response_cache import invalidate_on_write
+from pagination import Keyset, PageRequest, fetch_page
+from stock import (
+    adjust_stock_quantity, adjust_stock_quantities, log_stock_adjustments, record_receipt,
+    StockAdjustmentError, ON_HAND_SQL, STOCK_STATUS_SQL
+)
+from dispensing import dispense, invalidate_batches, DispenseError, USAGE_REASONS
+from inventory_alerts import ensure_daily_sweep, evaluate_asset_alerts
+from reorder_forecast import forecast_reorders
+from config import Config
+import mysql.connector
 
 inventory_bp = Blueprint('inventory', __name__, url_prefix='/api/inventory')
+invalidate_on_write(inventory_bp, 'inventory')
+
+ASSET_KEYSET = Keyset('assets', ('created_at', 'id'), descending=True)
+CONSUMABLE_KEYSET = Keyset('consumables', ('c.item_name', 'c.id'))
 
 # ============================================================================
 # ASSET MANAGEMENT
@@ -19,16 +36,18 @@ inventory_bp = Blueprint('inventory', __name__, url_prefix='/api/inventory')
 def get_assets():
     """
     Get paginated list of medical assets
-    Query params: page, per_page, status, location
+    Query params: page, per_page, status, location, after, include_total
     """
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        try:
+            page_req = PageRequest.from_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         status = request.args.get('status', '').strip()
         location = request.args.get('location', '').strip()
-        offset = (page - 1) * per_page
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Build query
@@ -46,27 +65,20 @@ def get_assets():
             count_query += " AND location LIKE %s"
             params.append(f"%{location}%")
         
-        # Get total count
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-        
-        # Get paginated results
-        query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-        cursor.execute(query, params + [per_page, offset])
-        assets = cursor.fetchall()
+        try:
+            assets, pagination = fetch_page(
+                cursor, query, count_query, params, page_req, ASSET_KEYSET,
+                table='assets', filtered=bool(status or location)
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
             'data': assets,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
-            }
+            'pagination': pagination
         }), 200
     
     except Exception as e:
@@ -87,7 +99,7 @@ def create_asset():
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Check for duplicate serial number
@@ -98,7 +110,6 @@ def create_asset():
         
         if cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({
                 'success': False,
                 'error': 'Asset with this serial number already exists'
@@ -131,19 +142,13 @@ def create_asset():
         )
         
         asset_id = cursor.lastrowid
+        evaluate_asset_alerts(cursor, [asset_id])
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'CREATE', 'asset', %s, %s, %s)
-            """,
-            (request.user_id, asset_id, datetime.now(timezone.utc), f'Created asset: {data.get("asset_name")}')
-        )
+        log_action(db_conn, 'CREATE', 'asset', asset_id, f'Created asset: {data.get("asset_name")}')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -161,7 +166,7 @@ def get_asset(asset_id):
     Get asset details
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         cursor.execute("SELECT * FROM assets WHERE id = %s", (asset_id,))
@@ -169,13 +174,11 @@ def get_asset(asset_id):
         
         if not asset:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Asset not found'}), 404
         
         # Usage history removed: asset_usage_history table does not exist
         
         cursor.close()
-        db_conn.close()
         
         return jsonify({'success': True, 'data': asset}), 200
     
@@ -201,7 +204,7 @@ def update_asset_status(asset_id):
                 'error': f'Invalid status. Must be one of: {", ".join(valid_statuses)}'
             }), 400
 
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         cursor.execute(
             """
@@ -213,12 +216,10 @@ def update_asset_status(asset_id):
         )
         if cursor.rowcount == 0:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Asset not found'}), 404
 
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         return jsonify({
             'success': True,
             'message': f'Asset status updated to {new_status}'
@@ -235,53 +236,38 @@ def update_asset_status(asset_id):
 def get_consumables():
     """
     Get paginated list of consumables/medicines
-    Query params: page, per_page, status, category
+    Query params: page, per_page, after, include_total
     """
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
-        offset = (page - 1) * per_page
+        try:
+            page_req = PageRequest.from_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
-        # Get total count
-        cursor.execute("SELECT COUNT(*) as total FROM consumables WHERE is_active = TRUE")
-        total = cursor.fetchone()['total']
-        
-        # Get paginated results
-        cursor.execute(
-            """
-            SELECT * FROM consumables
-            WHERE is_active = TRUE
-            ORDER BY item_name ASC
-            LIMIT %s OFFSET %s
-            """,
-            (per_page, offset)
-        )
+        try:
+            # On-hand totals come from the consumable_stock_levels rollup
+            consumables, pagination = fetch_page(
+                cursor,
+                f"""
+                SELECT c.*, {ON_HAND_SQL} AS quantity_on_hand, {STOCK_STATUS_SQL} AS stock_status
+                FROM consumables c
+                LEFT JOIN consumable_stock_levels l ON l.consumable_id = c.id
+                WHERE c.is_active = TRUE
+                """,
+                "SELECT COUNT(*) as total FROM consumables WHERE is_active = TRUE",
+                [], page_req, CONSUMABLE_KEYSET, table='consumables', filtered=False
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        consumables = cursor.fetchall()
-        # Add stock_status to each consumable
-        for c in consumables:
-            qty = c.get('total_quantity') or c.get('quantity_current') or c.get('total_in_stock') or 0
-            reorder_level = c.get('reorder_level', 10)
-            if qty <= 0:
-                c['stock_status'] = 'out_of_stock'
-            elif qty <= reorder_level:
-                c['stock_status'] = 'low_stock'
-            else:
-                c['stock_status'] = 'in_stock'
         cursor.close()
-        db_conn.close()
         return jsonify({
             'success': True,
             'data': consumables,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
-            }
+            'pagination': pagination
         }), 200
     
     except Exception as e:
@@ -302,7 +288,7 @@ def create_consumable():
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Create consumable
@@ -329,17 +315,10 @@ def create_consumable():
         consumable_id = cursor.lastrowid
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'CREATE', 'consumable', %s, %s, %s)
-            """,
-            (request.user_id, consumable_id, datetime.now(timezone.utc), f'Created consumable: {data.get("name")}')
-        )
+        log_action(db_conn, 'CREATE', 'consumable', consumable_id, f'Created consumable: {data.get("name")}')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -361,7 +340,7 @@ def get_inventory_stock():
         per_page = int(request.args.get('per_page', 20))
         offset = (page - 1) * per_page
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Get total count
@@ -388,7 +367,6 @@ def get_inventory_stock():
         
         stock = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -425,64 +403,180 @@ def adjust_stock(stock_id):
         if adjustment == 0:
             return jsonify({'success': False, 'error': 'adjustment cannot be zero'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
-        # Get current stock
-        cursor.execute(
-            "SELECT quantity_current FROM inventory_stock WHERE id = %s AND status = 'Active'",
-            (stock_id,)
-        )
+        # Single conditional UPDATE - safe against concurrent adjustments
+        try:
+            new_quantity = adjust_stock_quantity(cursor, stock_id, adjustment)
+        except StockAdjustmentError as e:
+            cursor.close()
+            db_conn.rollback()
+            not_found = e.failures and e.failures[0]['quantity_current'] is None
+            return jsonify({'success': False, 'error': str(e)}), 404 if not_found else 400
         
-        stock = cursor.fetchone()
+        # Log adjustment
+        log_stock_adjustments(cursor, [(stock_id, adjustment, reason)], request.user_id)
+        record_metrics(db_conn, stock_adjustments=1)
         
-        if not stock:
-            cursor.close()
-            db_conn.close()
-            return jsonify({'success': False, 'error': 'Stock record not found'}), 404
+        db_conn.commit()
+        cursor.close()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Stock adjusted by {adjustment}',
+            'data': {'new_quantity': new_quantity}
+        }), 200
+    
+    except ValueError:
+        return jsonify({'success': False, 'error': 'adjustment must be an integer'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@inventory_bp.route('/stock/adjust-batch', methods=['POST'])
+@require_role('inventory_manager', 'administrator')
+def adjust_stock_batch():
+    """
+    Apply many stock adjustments in one transaction (all or nothing)
+    Body: {adjustments: [{stock_id, adjustment, reason}], reason (default for items)}
+    """
+    try:
+        data = request.get_json() or {}
+        items = data.get('adjustments')
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'adjustments must be a non-empty list'}), 400
         
-        # Calculate new quantity
-        new_quantity = stock['quantity_current'] + adjustment
+        if len(items) > Config.SYNC_MAX_RECORDS:
+            return jsonify({
+                'success': False,
+                'error': f'Too many adjustments in one request (max {Config.SYNC_MAX_RECORDS})'
+            }), 413
+        
+        entries = []
+        deltas = {}
+        for index, item in enumerate(items):
+            try:
+                stock_id = int(item['stock_id'])
+                adjustment = int(item['adjustment'])
+            except (KeyError, TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'error': f'adjustments[{index}]: stock_id and integer adjustment are required'
+                }), 400
+            
+            reason = item.get('reason') or data.get('reason')
+            if adjustment == 0 or not reason:
+                return jsonify({
+                    'success': False,
+                    'error': f'adjustments[{index}]: non-zero adjustment and reason are required'
+                }), 400
+            
+            entries.append((stock_id, adjustment, reason))
+            deltas[stock_id] = deltas.get(stock_id, 0) + adjustment
         
-        if new_quantity < 0:
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
+        
+        try:
+            adjust_stock_quantities(cursor, deltas)
+        except StockAdjustmentError as e:
             cursor.close()
-            db_conn.close()
+            db_conn.rollback()
+            return jsonify({'success': False, 'error': str(e), 'failures': e.failures}), 409
+        
+        log_stock_adjustments(cursor, entries, request.user_id)
+        record_metrics(db_conn, stock_adjustments=len(entries))
+        
+        db_conn.commit()
+        cursor.close()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Applied {len(entries)} stock adjustments',
+            'data': {
+                'applied': len(entries),
+                'net_adjustments': [
+                    {'stock_id': stock_id, 'adjustment': delta} for stock_id, delta in deltas.items()
+                ]
+            }
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@inventory_bp.route('/dispense', methods=['POST'])
+@require_role('doctor', 'nurse', 'inventory_manager', 'administrator')
+def dispense_consumables():
+    """
+    Dispense consumables first-expiry-first-out across stock batches
+    Body: {consumable_id, quantity} or {items: [{consumable_id, quantity}]},
+    optional visit_id, usage_reason (default patient_use), usage_location, notes
+    All items are filled in one transaction or none are.
+    """
+    try:
+        data = request.get_json() or {}
+        raw_items = data.get('items')
+        if raw_items is None:
+            raw_items = [{'consumable_id': data.get('consumable_id'), 'quantity': data.get('quantity')}]
+        
+        if not isinstance(raw_items, list) or not raw_items:
+            return jsonify({'success': False, 'error': 'items must be a non-empty list'}), 400
+        
+        items = []
+        for index, item in enumerate(raw_items):
+            try:
+                consumable_id = int(item['consumable_id'])
+                quantity = int(item['quantity'])
+            except (KeyError, TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'error': f'items[{index}]: consumable_id and integer quantity are required'
+                }), 400
+            if quantity < 1:
+                return jsonify({'success': False, 'error': f'items[{index}]: quantity must be positive'}), 400
+            items.append((consumable_id, quantity))
+        
+        usage_reason = data.get('usage_reason', 'patient_use')
+        if usage_reason not in USAGE_REASONS:
             return jsonify({
                 'success': False,
-                'error': f'Adjustment would result in negative stock. Current: {stock["quantity_current"]}'
+                'error': f'usage_reason must be one of: {", ".join(USAGE_REASONS)}'
             }), 400
         
-        # Update stock
-        cursor.execute(
-            """
-            UPDATE inventory_stock
-            SET quantity_current = %s, updated_at = %s
-            WHERE id = %s
-            """,
-            (new_quantity, datetime.now(timezone.utc), stock_id)
-        )
+        visit_id = data.get('visit_id')
         
-        # Log adjustment
-        cursor.execute(
-            """
-            INSERT INTO stock_adjustment_log (stock_id, adjustment, reason, adjusted_by_id, adjustment_date)
-            VALUES (%s, %s, %s, %s, %s)
-            """,
-            (stock_id, adjustment, reason, request.user_id, datetime.now(timezone.utc))
-        )
+        db_conn = get_request_db()
+        
+        try:
+            draws = dispense(
+                db_conn, items, request.user_id, visit_id=visit_id, usage_reason=usage_reason,
+                usage_location=data.get('usage_location'), notes=data.get('notes')
+            )
+        except (DispenseError, StockAdjustmentError) as e:
+            db_conn.rollback()
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'shortages': getattr(e, 'shortages', [])
+            }), 409
+        except mysql.connector.IntegrityError:
+            db_conn.rollback()
+            return jsonify({'success': False, 'error': 'Invalid consumable_id or visit_id'}), 400
+        
+        log_action(db_conn, 'DISPENSE', 'inventory_usage', None, {
+            'visit_id': visit_id,
+            'items': [{'consumable_id': c, 'quantity': q} for c, q in items]
+        })
         
         db_conn.commit()
-        cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
-            'message': f'Stock adjusted by {adjustment}',
-            'data': {'new_quantity': new_quantity}
+            'message': f'Dispensed from {len(draws)} batch(es)',
+            'data': {'visit_id': visit_id, 'allocations': draws}
         }), 200
     
-    except ValueError:
-        return jsonify({'success': False, 'error': 'adjustment must be an integer'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -490,48 +584,54 @@ def adjust_stock(stock_id):
 # STOCK ALERTS
 # ============================================================================
 
+def parse_days_ahead(default):
+    """Read ?days_ahead, raising ValueError outside 1..INVENTORY_ALERT_HORIZON_DAYS"""
+    days_ahead = int(request.args.get('days_ahead', default))
+    if days_ahead < 1 or days_ahead > Config.INVENTORY_ALERT_HORIZON_DAYS:
+        raise ValueError(f'days_ahead must be between 1 and {Config.INVENTORY_ALERT_HORIZON_DAYS}')
+    return days_ahead
+
 @inventory_bp.route('/alerts/expiry', methods=['GET'])
 @require_auth
 def get_expiry_alerts():
     """
     Get consumables expiring within specified days
-    Query params: days_ahead (default: 90)
+    Query params: days_ahead (default: 90), include_expired (default: false)
     """
     try:
-        days_ahead = int(request.args.get('days_ahead', 90))
+        try:
+            days_ahead = parse_days_ahead(90)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        if days_ahead < 1:
-            return jsonify({'success': False, 'error': 'days_ahead must be positive'}), 400
+        include_expired = request.args.get('include_expired', 'false').lower() == 'true'
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
+        ensure_daily_sweep(db_conn)
         cursor = db_conn.cursor(dictionary=True)
         
-        # Calculate expiry cutoff date
-        expiry_cutoff = datetime.now(timezone.utc) + timedelta(days=days_ahead)
-        
         cursor.execute(
-            """
+            f"""
             SELECT
                 s.id,
                 s.batch_number,
                 c.item_name,
                 s.expiry_date,
                 s.quantity_current,
-                DATEDIFF(s.expiry_date, NOW()) as days_until_expiry
-            FROM inventory_stock s
-            JOIN consumables c ON s.consumable_id = c.id
-            WHERE s.status = 'Active'
-                AND s.expiry_date IS NOT NULL
-                AND s.expiry_date <= %s
-                AND s.expiry_date > NOW()
-            ORDER BY s.expiry_date ASC
+                DATEDIFF(s.expiry_date, CURDATE()) as days_until_expiry
+            FROM inventory_alerts a
+            JOIN inventory_stock s ON s.id = a.entity_id
+            JOIN consumables c ON c.id = a.consumable_id
+            WHERE a.alert_type = 'expiry' AND a.is_active = TRUE
+                AND a.due_date <= DATE_ADD(CURDATE(), INTERVAL %s DAY)
+                {'' if include_expired else 'AND a.due_date > CURDATE()'}
+            ORDER BY a.due_date ASC
             """,
-            (expiry_cutoff.date(),)
+            (days_ahead,)
         )
         
         alerts = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -549,41 +649,42 @@ def get_expiry_alerts():
 @require_auth
 def get_low_stock_alerts():
     """
-    Get consumables below reorder level
+    Get consumables at or below reorder level (on-hand across all Active batches)
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
+        ensure_daily_sweep(db_conn)
         cursor = db_conn.cursor(dictionary=True)
         
         cursor.execute(
-            """
+            f"""
             SELECT
-                s.id,
+                c.id AS consumable_id,
                 c.item_name,
                 c.unit_of_measure,
-                s.quantity_current,
+                {ON_HAND_SQL} AS quantity_on_hand,
                 c.reorder_level,
                 c.max_stock_level,
-                s.unit_cost,
-                (c.reorder_level - s.quantity_current) * s.unit_cost as reorder_cost
-            FROM inventory_stock s
-            JOIN consumables c ON s.consumable_id = c.id
-            WHERE s.status = 'Active'
-                AND s.quantity_current <= c.reorder_level
-            ORDER BY s.quantity_current ASC
+                l.last_unit_cost AS unit_cost,
+                (c.reorder_level - {ON_HAND_SQL}) * l.last_unit_cost AS reorder_cost,
+                {STOCK_STATUS_SQL} AS stock_status
+            FROM inventory_alerts a
+            JOIN consumables c ON c.id = a.entity_id
+            LEFT JOIN consumable_stock_levels l ON l.consumable_id = c.id
+            WHERE a.alert_type = 'low_stock' AND a.is_active = TRUE
+            ORDER BY quantity_on_hand ASC
             """
         )
         
         alerts = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
             'data': alerts,
             'summary': {
                 'total_alerts': len(alerts),
-                'total_reorder_cost': sum(alert.get('reorder_cost', 0) for alert in alerts)
+                'total_reorder_cost': float(sum(alert['reorder_cost'] or 0 for alert in alerts))
             }
         }), 200
     
@@ -598,36 +699,38 @@ def get_warranty_expiry_alerts():
     Query params: days_ahead (default: 30)
     """
     try:
-        days_ahead = int(request.args.get('days_ahead', 30))
+        try:
+            days_ahead = parse_days_ahead(30)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
+        ensure_daily_sweep(db_conn)
         cursor = db_conn.cursor(dictionary=True)
         
-        warranty_cutoff = datetime.now(timezone.utc) + timedelta(days=days_ahead)
-        
         cursor.execute(
             """
             SELECT
-                id,
-                asset_name,
-                asset_tag,
-                serial_number,
-                manufacturer,
-                warranty_expiry,
-                DATEDIFF(warranty_expiry, NOW()) as days_until_expiry,
-                status
-            FROM assets
-            WHERE warranty_expiry IS NOT NULL
-                AND warranty_expiry <= %s
-                AND warranty_expiry > NOW()
-            ORDER BY warranty_expiry ASC
+                ast.id,
+                ast.asset_name,
+                ast.asset_tag,
+                ast.serial_number,
+                ast.manufacturer,
+                ast.warranty_expiry,
+                DATEDIFF(ast.warranty_expiry, CURDATE()) as days_until_expiry,
+                ast.status
+            FROM inventory_alerts a
+            JOIN assets ast ON ast.id = a.entity_id
+            WHERE a.alert_type = 'warranty' AND a.is_active = TRUE
+                AND a.due_date >= CURDATE()
+                AND a.due_date <= DATE_ADD(CURDATE(), INTERVAL %s DAY)
+            ORDER BY a.due_date ASC
             """,
-            (warranty_cutoff.date(),)
+            (days_ahead,)
         )
         
         alerts = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -641,6 +744,92 @@ def get_warranty_expiry_alerts():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@inventory_bp.route('/alerts/summary', methods=['GET'])
+@require_auth
+def get_alert_summary():
+    """
+    Count active inventory alerts by type
+    Query params: days_ahead (default: 30) - window for expiry and warranty
+    """
+    try:
+        try:
+            days_ahead = parse_days_ahead(30)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        db_conn = get_request_db()
+        ensure_daily_sweep(db_conn)
+        cursor = db_conn.cursor(dictionary=True)
+        
+        cursor.execute(
+            """
+            SELECT
+                SUM(alert_type = 'low_stock') AS low_stock,
+                SUM(alert_type = 'expiry' AND due_date > CURDATE()
+                    AND due_date <= DATE_ADD(CURDATE(), INTERVAL %s DAY)) AS expiry,
+                SUM(alert_type = 'expiry' AND due_date <= CURDATE()) AS expired,
+                SUM(alert_type = 'warranty'
+                    AND due_date <= DATE_ADD(CURDATE(), INTERVAL %s DAY)) AS warranty
+            FROM inventory_alerts
+            WHERE is_active = TRUE
+            """,
+            (days_ahead, days_ahead)
+        )
+        
+        counts = {key: int(value or 0) for key, value in cursor.fetchone().items()}
+        cursor.close()
+        
+        return jsonify({
+            'success': True,
+            'data': counts,
+            'summary': {'days_ahead': days_ahead}
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@inventory_bp.route('/reorder-suggestions', methods=['GET'])
+@require_auth
+def get_reorder_suggestions():
+    """
+    Forecast stock-outs from consumption velocity and suggest purchases per supplier
+    Query params: history_days (default: 90), horizon_days (default: 30)
+    """
+    try:
+        try:
+            history_days = int(request.args.get('history_days', Config.REORDER_HISTORY_DAYS))
+            horizon_days = int(request.args.get('horizon_days', Config.REORDER_HORIZON_DAYS))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'history_days and horizon_days must be integers'}), 400
+        
+        if not (1 <= history_days <= Config.REORDER_MAX_DAYS and 1 <= horizon_days <= Config.REORDER_MAX_DAYS):
+            return jsonify({
+                'success': False,
+                'error': f'history_days and horizon_days must be between 1 and {Config.REORDER_MAX_DAYS}'
+            }), 400
+        
+        db_conn = get_request_db()
+        forecast, suppliers = forecast_reorders(db_conn, history_days, horizon_days)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'suppliers': suppliers,
+                'forecast': forecast
+            },
+            'summary': {
+                'history_days': history_days,
+                'horizon_days': horizon_days,
+                'items_to_reorder': len(forecast),
+                'projected_stockouts': sum(1 for item in forecast if item['days_until_stockout'] is not None),
+                'supplier_orders': len(suppliers),
+                'total_estimated_cost': round(sum(order['estimated_cost'] for order in suppliers), 2)
+            }
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # ============================================================================
 # CATEGORIES AND REFERENCE DATA
 # ============================================================================
@@ -650,7 +839,7 @@ def get_warranty_expiry_alerts():
 def get_asset_categories():
     """Get all asset categories"""
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         cursor.execute("""
@@ -664,7 +853,6 @@ def get_asset_categories():
         
         categories = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -679,7 +867,7 @@ def get_asset_categories():
 def get_consumable_categories():
     """Get all consumable categories"""
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         cursor.execute("""
@@ -692,7 +880,6 @@ def get_consumable_categories():
         
         categories = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -707,7 +894,7 @@ def get_consumable_categories():
 def get_suppliers():
     """Get all suppliers"""
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         cursor.execute("""
@@ -721,7 +908,6 @@ def get_suppliers():
         
         suppliers = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -748,7 +934,7 @@ def create_supplier():
                     'error': f'{field} is required'
                 }), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         cursor.execute("""
@@ -767,7 +953,6 @@ def create_supplier():
         supplier_id = cursor.lastrowid
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -796,7 +981,7 @@ def receive_stock():
                     'error': f'{field} is required'
                 }), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Calculate total cost
@@ -824,9 +1009,10 @@ def receive_stock():
         ))
         
         stock_id = cursor.lastrowid
+        record_receipt(cursor, stock_id, data['consumable_id'], data['quantity_received'], data['unit_cost'])
         db_conn.commit()
         cursor.close()
-        db_conn.close()
+        invalidate_batches(int(data['consumable_id']))
         
         return jsonify({
             'success': True,
@@ -849,7 +1035,7 @@ def asset_maintenance(asset_id):
     POST: Create a new maintenance record for an asset
     PUT: Update an existing maintenance record (requires 'id' in payload)
     """
-    db_conn = get_db_connection()
+    db_conn = get_request_db()
     cursor = db_conn.cursor(dictionary=True)
     if request.method == 'GET':
         try:
@@ -863,11 +1049,9 @@ def asset_maintenance(asset_id):
             )
             records = cursor.fetchall()
             cursor.close()
-            db_conn.close()
             return jsonify({'success': True, 'data': records}), 200
         except Exception as e:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': str(e)}), 500
     elif request.method == 'POST':
         try:
@@ -876,7 +1060,6 @@ def asset_maintenance(asset_id):
             for field in required_fields:
                 if not data.get(field):
                     cursor.close()
-                    db_conn.close()
                     return jsonify({'success': False, 'error': f'{field} is required'}), 400
 
             cursor.execute(
@@ -903,18 +1086,15 @@ def asset_maintenance(asset_id):
             cursor.execute("SELECT * FROM asset_maintenance WHERE id = %s", (new_id,))
             new_record = cursor.fetchone()
             cursor.close()
-            db_conn.close()
             return jsonify({'success': True, 'data': new_record, 'message': 'Maintenance record created'}), 201
         except Exception as e:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': str(e)}), 500
     elif request.method == 'PUT':
         try:
             data = request.get_json()
             if not data or 'id' not in data:
                 cursor.close()
-                db_conn.close()
                 return jsonify({'success': False, 'error': 'id is required for update'}), 400
             update_fields = []
             params = []
@@ -924,7 +1104,6 @@ def asset_maintenance(asset_id):
                     params.append(data[field])
             if not update_fields:
                 cursor.close()
-                db_conn.close()
                 return jsonify({'success': False, 'error': 'No fields to update'}), 400
             params.append(data['id'])
             params.append(asset_id)
@@ -938,9 +1117,7 @@ def asset_maintenance(asset_id):
             cursor.execute("SELECT * FROM asset_maintenance WHERE id = %s", (data['id'],))
             updated_record = cursor.fetchone()
             cursor.close()
-            db_conn.close()
             return jsonify({'success': True, 'data': updated_record, 'message': 'Maintenance record updated'}), 200
         except Exception as e:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
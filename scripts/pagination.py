@@ -0,0 +1,211 @@
+"""
+POLMED Backend - Pagination Helpers
+Offset and keyset (cursor) pagination with cached/estimated totals
+"""
+
+import base64
+import json
+import threading
+import time
+from datetime import date, datetime
+
+from config import Config
+
+
+class Keyset:
+    """
+    Sort definition for a listing.
+    `columns` must end with a unique column (normally `id`) so the order is
+    total, and should match an index so seeks avoid a filesort.
+    """
+
+    def __init__(self, name, columns, descending=False):
+        self.name = name
+        self.columns = columns
+        self.descending = descending
+
+    def order_by(self):
+        direction = 'DESC' if self.descending else 'ASC'
+        return ', '.join(f"{column} {direction}" for column in self.columns)
+
+    def seek_clause(self, values):
+        """
+        Build the WHERE fragment that continues after `values`, e.g.
+        (created_at < %s OR (created_at = %s AND id < %s))
+        """
+        op = '<' if self.descending else '>'
+        branches = []
+        params = []
+        for i, column in enumerate(self.columns):
+            parts = [f"{prev} = %s" for prev in self.columns[:i]]
+            parts.append(f"{column} {op} %s")
+            branches.append('(' + ' AND '.join(parts) + ')' if len(parts) > 1 else parts[0])
+            params.extend(values[:i + 1])
+        return '(' + ' OR '.join(branches) + ')', params
+
+    def encode(self, row):
+        """Build an opaque cursor token from the last row of a page"""
+        values = []
+        for column in self.columns:
+            value = row[column.split('.')[-1]]
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+            elif value is not None and not isinstance(value, (int, str)):
+                value = str(value)
+            values.append(value)
+        payload = json.dumps({'k': self.name, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode(self, token):
+        """Decode a cursor token, raising ValueError if it is malformed or for another listing"""
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        except Exception:
+            raise ValueError('Invalid cursor')
+
+        if payload.get('k') != self.name or len(payload.get('v', [])) != len(self.columns):
+            raise ValueError('Invalid cursor')
+        return payload['v']
+
+
+class PageRequest:
+    """Pagination parameters parsed from the query string"""
+
+    def __init__(self, page=1, per_page=None, after=None, include_total='true'):
+        self.page = page
+        self.per_page = per_page or Config.DEFAULT_PAGE_SIZE
+        self.after = after
+        self.include_total = include_total
+
+    @property
+    def cursor_mode(self):
+        return self.after is not None
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Parse page, per_page, after and include_total.
+        Passing `after` (empty for the first page) opts into cursor mode;
+        include_total is one of true, false or estimate and defaults to
+        false in cursor mode.
+        Raises ValueError on invalid values.
+        """
+        page = int(args.get('page', 1))
+        per_page = int(args.get('per_page', Config.DEFAULT_PAGE_SIZE))
+        after = args.get('after')
+        if after is not None:
+            after = after.strip()
+
+        include_total = args.get('include_total', 'false' if after is not None else 'true').lower()
+
+        if page < 1 or per_page < 1 or per_page > Config.MAX_PAGE_SIZE:
+            raise ValueError('Invalid pagination parameters')
+        if include_total not in ('true', 'false', 'estimate'):
+            raise ValueError('include_total must be one of: true, false, estimate')
+
+        return cls(page, per_page, after, include_total)
+
+
+class CountCache:
+    """Small TTL cache for COUNT(*) results keyed by query and parameters"""
+
+    def __init__(self, ttl=60, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+            self._entries.pop(key, None)
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+
+_count_cache = CountCache(ttl=Config.COUNT_CACHE_TTL)
+
+
+def _count(cursor, count_query, params, page_req, table, filtered):
+    """Resolve the total for a page according to include_total"""
+    if page_req.include_total == 'false':
+        return None
+
+    if page_req.include_total == 'estimate' and table and not filtered:
+        # InnoDB statistics - approximate but free
+        cursor.execute(
+            """
+            SELECT TABLE_ROWS as total FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = %s
+            """,
+            (table,)
+        )
+        row = cursor.fetchone()
+        if row and row['total'] is not None:
+            return int(row['total'])
+
+    key = (count_query, tuple(params))
+    total = _count_cache.get(key)
+    if total is None:
+        cursor.execute(count_query, params)
+        total = cursor.fetchone()['total']
+        _count_cache.set(key, total)
+    return total
+
+
+def fetch_page(cursor, query, count_query, params, page_req, keyset, table=None, filtered=True):
+    """
+    Run a paginated listing.
+
+    `query` and `count_query` must end in a WHERE clause (filters only);
+    ordering, seeking and limits are appended here. Returns
+    (rows, pagination) where pagination matches the existing response shape
+    in offset mode and carries next_cursor/has_more in cursor mode.
+    """
+    params = list(params)
+    total = _count(cursor, count_query, params, page_req, table, filtered)
+
+    if page_req.cursor_mode:
+        page_query = query
+        page_params = list(params)
+        if page_req.after:
+            clause, seek_params = keyset.seek_clause(keyset.decode(page_req.after))
+            page_query += f" AND {clause}"
+            page_params += seek_params
+
+        page_query += f" ORDER BY {keyset.order_by()} LIMIT %s"
+        cursor.execute(page_query, page_params + [page_req.per_page + 1])
+        rows = cursor.fetchall()
+
+        has_more = len(rows) > page_req.per_page
+        rows = rows[:page_req.per_page]
+        pagination = {
+            'per_page': page_req.per_page,
+            'has_more': has_more,
+            'next_cursor': keyset.encode(rows[-1]) if has_more else None,
+        }
+    else:
+        offset = (page_req.page - 1) * page_req.per_page
+        cursor.execute(
+            query + f" ORDER BY {keyset.order_by()} LIMIT %s OFFSET %s",
+            params + [page_req.per_page, offset]
+        )
+        rows = cursor.fetchall()
+        pagination = {
+            'page': page_req.page,
+            'per_page': page_req.per_page,
+        }
+
+    if total is not None:
+        pagination['total'] = total
+        pagination['pages'] = (total + page_req.per_page - 1) // page_req.per_page
+
+    return rows, pagination
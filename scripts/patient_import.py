@@ -0,0 +1,356 @@
+"""
+POLMED Backend - Bulk Patient Import
+Loads patient cohorts (e.g. a police station's member list) from CSV or NDJSON
+
+Rows are read from a stream and processed in chunks of IMPORT_BATCH_SIZE,
+one transaction per chunk:
+1. each row is validated and normalised (invalid rows are reported, not fatal);
+2. one query looks up every medical_aid_number / id_number in the chunk,
+   and repeats within the file are caught in memory;
+3. the remaining rows go in with a single multi-row executemany() INSERT.
+If a concurrent writer wins a unique id_number in between, the chunk is
+replayed row by row under savepoints so only the clashing rows are skipped.
+If the file turns unreadable part way (bad encoding, broken CSV quoting),
+the rows read so far are still imported and ImportReadError reports where
+reading stopped along with the partial results.
+
+CSV files need a header row using the patient field names; list fields
+(chronic_conditions, allergies, current_medications) are ';'-separated.
+
+Usage: python patient_import.py FILE [--format csv|ndjson] [--user-id ID] [--dry-run]
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from audit import log_action
+from config import Config
+from dashboard_metrics import record_metrics
+from patient_routes import PATIENT_REQUIRED_FIELDS, patient_insert_values
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+IMPORTED = 'imported'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+LIST_FIELDS = ('chronic_conditions', 'allergies', 'current_medications')
+GENDERS = {'male': 'Male', 'female': 'Female', 'other': 'Other'}
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+# Positions in the PATIENT_IMPORT_SQL parameters
+AID_NUMBER = 6
+ID_NUMBER = 15
+
+PATIENT_IMPORT_SQL = """
+    INSERT INTO patients (
+        first_name, last_name, date_of_birth, gender, phone_number, email,
+        medical_aid_number, province, physical_address, is_palmed_member,
+        chronic_conditions, allergies, current_medications, created_by_id,
+        created_at, id_number, is_active
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE)
+"""
+
+
+class ImportRowError(Exception):
+    """A row that cannot be imported (reported per row)"""
+
+
+class ImportReadError(Exception):
+    """
+    The file could not be read past `line`; `problems` and `summary` are the
+    results for the rows before it (already committed unless dry run)
+    """
+
+    def __init__(self, message, line, problems, summary):
+        super().__init__(message)
+        self.line = line
+        self.problems = problems
+        self.summary = summary
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (line, data) for each record in a binary or text stream.
+    `data` is an ImportRowError for lines that cannot be parsed.
+    """
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {k.strip(): v for k, v in row.items() if k}
+        return
+
+    for line_num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield line_num, ImportRowError(f'Invalid JSON: {e}')
+            continue
+        if not isinstance(data, dict):
+            yield line_num, ImportRowError('Each line must be a JSON object')
+            continue
+        yield line_num, data
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    if not value:
+        return []
+    return [part.strip() for part in str(value).split(';') if part.strip()]
+
+
+def normalise_row(data, user_id):
+    """Validate an import row and return its PATIENT_IMPORT_SQL parameters"""
+    for field, value in data.items():
+        if isinstance(value, dict) or (isinstance(value, list) and field not in LIST_FIELDS):
+            raise ImportRowError(f'{field} must be a single value')
+    # NDJSON may carry numbers (e.g. phone_number) where text is expected
+    data = {
+        k: (str(v).strip() if v is not None and not isinstance(v, (bool, list)) else v)
+        for k, v in data.items()
+    }
+
+    for field in PATIENT_REQUIRED_FIELDS:
+        if not data.get(field):
+            raise ImportRowError(f'{field} is required')
+
+    try:
+        datetime.strptime(str(data['date_of_birth']), '%Y-%m-%d')
+    except ValueError:
+        raise ImportRowError('date_of_birth must be YYYY-MM-DD')
+
+    gender = GENDERS.get(str(data['gender']).lower())
+    if not gender:
+        raise ImportRowError(f'gender must be one of: {", ".join(GENDERS.values())}')
+    data['gender'] = gender
+
+    for field in LIST_FIELDS:
+        data[field] = _as_list(data.get(field))
+
+    is_palmed_member = data.get('is_palmed_member', False)
+    if isinstance(is_palmed_member, str):
+        is_palmed_member = is_palmed_member.lower() in TRUE_VALUES
+    data['is_palmed_member'] = bool(is_palmed_member)
+
+    id_number = str(data.get('id_number') or '').strip() or None
+    if id_number and len(id_number) > 20:
+        raise ImportRowError('id_number must be at most 20 characters')
+
+    try:
+        return patient_insert_values(data, user_id) + (id_number,)
+    except (TypeError, AttributeError) as e:
+        raise ImportRowError(f'Invalid value: {e}')
+
+
+def _existing_keys(cursor, rows):
+    """Look up the chunk's medical aid and ID numbers in one query"""
+    aid_numbers = list({values[AID_NUMBER] for _, values in rows if values[AID_NUMBER]})
+    id_numbers = list({values[ID_NUMBER] for _, values in rows if values[ID_NUMBER]})
+    if not aid_numbers and not id_numbers:
+        return set(), set()
+
+    conditions = []
+    params = []
+    if aid_numbers:
+        conditions.append(f"(medical_aid_number IN ({', '.join(['%s'] * len(aid_numbers))}) AND is_active = TRUE)")
+        params += aid_numbers
+    if id_numbers:
+        # id_number is UNIQUE across inactive rows too
+        conditions.append(f"id_number IN ({', '.join(['%s'] * len(id_numbers))})")
+        params += id_numbers
+
+    cursor.execute(
+        f"SELECT medical_aid_number, id_number, is_active FROM patients WHERE {' OR '.join(conditions)}",
+        params
+    )
+    existing_aid, existing_id = set(), set()
+    for medical_aid_number, id_number, is_active in cursor.fetchall():
+        if medical_aid_number and is_active:
+            existing_aid.add(medical_aid_number)
+        if id_number:
+            existing_id.add(id_number)
+    return existing_aid, existing_id
+
+
+def _duplicate_reason(values, existing_aid, existing_id, label):
+    if values[AID_NUMBER] and values[AID_NUMBER] in existing_aid:
+        return f'Patient with this medical aid number {label}'
+    if values[ID_NUMBER] and values[ID_NUMBER] in existing_id:
+        return f'Patient with this ID number {label}'
+    return None
+
+
+def _import_chunk(db_conn, rows, seen_aid, seen_id, dry_run):
+    """Dedupe and insert one chunk of (line, values). Returns per-row results."""
+    cursor = db_conn.cursor()
+    results = []
+    to_insert = []
+
+    existing_aid, existing_id = _existing_keys(cursor, rows)
+
+    for line, values in rows:
+        reason = (_duplicate_reason(values, existing_aid, existing_id, 'already exists') or
+                  _duplicate_reason(values, seen_aid, seen_id, 'appears earlier in the file'))
+        if reason:
+            results.append({'line': line, 'status': DUPLICATE, 'error': reason})
+            continue
+
+        if values[AID_NUMBER]:
+            seen_aid.add(values[AID_NUMBER])
+        if values[ID_NUMBER]:
+            seen_id.add(values[ID_NUMBER])
+        to_insert.append((line, values))
+
+    if to_insert and not dry_run:
+        try:
+            # Rewritten by the connector into one multi-row INSERT
+            cursor.executemany(PATIENT_IMPORT_SQL, [values for _, values in to_insert])
+            inserted = to_insert
+        except mysql.connector.IntegrityError:
+            # Lost a race on a unique id_number (or a row breaks a constraint) - replay row by row
+            inserted = []
+            for line, values in to_insert:
+                cursor.execute("SAVEPOINT import_row")
+                try:
+                    cursor.execute(PATIENT_IMPORT_SQL, values)
+                except mysql.connector.IntegrityError as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT import_row")
+                    # Only a duplicate key is a duplicate; FK/NOT NULL failures are invalid rows
+                    status = DUPLICATE if e.errno == errorcode.ER_DUP_ENTRY else INVALID
+                    results.append({'line': line, 'status': status, 'error': str(e)})
+                    continue
+                cursor.execute("RELEASE SAVEPOINT import_row")
+                inserted.append((line, values))
+
+        if inserted:
+            log_action(db_conn, 'IMPORT', 'patient', None, {
+                'imported': len(inserted),
+                'first_line': inserted[0][0],
+                'last_line': inserted[-1][0]
+            })
+            record_metrics(db_conn, new_patients=len(inserted), total_patients=len(inserted))
+    else:
+        inserted = to_insert
+
+    results.extend({'line': line, 'status': IMPORTED} for line, _ in inserted)
+    cursor.close()
+    return results
+
+
+def import_patients(db_conn, stream, fmt, user_id, dry_run=False, batch_size=None):
+    """
+    Import patients from a CSV/NDJSON stream, committing once per chunk.
+    With dry_run nothing is written; rows are only validated and deduped.
+    Returns (results, summary); results hold only the rows that were not
+    imported, keyed by source line number.
+    Raises ImportReadError if the file becomes unreadable part way.
+    """
+    batch_size = batch_size or Config.IMPORT_BATCH_SIZE
+    summary = {IMPORTED: 0, DUPLICATE: 0, INVALID: 0}
+    problems = []
+    seen_aid, seen_id = set(), set()
+    chunk = []
+    last_line = 0
+
+    def flush():
+        for result in _import_chunk(db_conn, chunk, seen_aid, seen_id, dry_run):
+            summary[result['status']] += 1
+            if result['status'] != IMPORTED:
+                problems.append(result)
+        if not dry_run:
+            db_conn.commit()
+        chunk.clear()
+
+    read_error = None
+    try:
+        for line, data in read_rows(stream, fmt):
+            last_line = line
+            try:
+                if isinstance(data, ImportRowError):
+                    raise data
+                chunk.append((line, normalise_row(data, user_id)))
+            except ImportRowError as e:
+                summary[INVALID] += 1
+                problems.append({'line': line, 'status': INVALID, 'error': str(e)})
+                continue
+
+            if len(chunk) >= batch_size:
+                flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        read_error = e
+
+    if chunk:
+        flush()
+
+    problems.sort(key=lambda r: r['line'])
+    if read_error is not None:
+        raise ImportReadError(
+            f'Unreadable file after line {last_line}: {read_error}', last_line, problems, summary
+        )
+    return problems, summary
+
+
+def detect_format(filename, content_type=None):
+    """Guess csv/ndjson from a file name or content type (None if unknown)"""
+    name = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    return None
+
+
+if __name__ == '__main__':
+    from database import get_db_connection, close_db_connection
+
+    parser = argparse.ArgumentParser(description='Bulk import patients from CSV or NDJSON')
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=IMPORT_FORMATS)
+    parser.add_argument('--user-id', type=int, help='recorded as created_by_id')
+    parser.add_argument('--dry-run', action='store_true', help='validate and dedupe only')
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.file)
+    if not fmt:
+        parser.error('cannot tell the file format from its name; pass --format')
+
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    started = time.monotonic()
+    read_error = None
+    try:
+        with open(args.file, 'rb') as f:
+            problems, summary = import_patients(conn, f, fmt, args.user_id, dry_run=args.dry_run)
+    except ImportReadError as e:
+        read_error = e
+        problems, summary = e.problems, e.summary
+    finally:
+        close_db_connection(conn)
+    elapsed = time.monotonic() - started
+
+    for problem in problems:
+        print(f"line {problem['line']}: {problem['status']} - {problem['error']}")
+    total = sum(summary.values())
+    print(f"{summary[IMPORTED]} imported, {summary[DUPLICATE]} duplicate, {summary[INVALID]} invalid "
+          f"({total} rows in {elapsed:.1f}s{', dry run' if args.dry_run else ''})")
+    if read_error is not None:
+        print(str(read_error))
+        sys.exit(1)
+    sys.exit(0 if summary[INVALID] == 0 else 2)
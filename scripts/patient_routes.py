@@ -6,69 +6,200 @@ Patient registration, retrieval, and profile management
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timezone
 from auth import require_auth, require_role
-from database import get_db_connection
+from database import get_request_db
+from audit import log_action
+from dashboard_metrics import record_metrics
+from response_cache import invalidate_on_write
+from pagination import Keyset, PageRequest, fetch_page
+from patient_search import search_patients, classify_query
+from patient_timeline import fetch_timeline
+from visit_details import parse_include
+from responses import json_response
+from config import Config
 import mysql.connector
 import json
 
 patients_bp = Blueprint('patients', __name__, url_prefix='/api/patients')
+invalidate_on_write(patients_bp, 'patients')
+
+PATIENT_KEYSET = Keyset('patients', ('created_at', 'id'), descending=True)
+
+PATIENT_REQUIRED_FIELDS = ['first_name', 'last_name', 'date_of_birth', 'gender', 'phone_number']
+PATIENT_UPDATABLE_FIELDS = [
+    'phone_number', 'email', 'province', 'physical_address',
+    'chronic_conditions', 'allergies', 'current_medications'
+]
+
+PATIENT_INSERT_SQL = """
+    INSERT INTO patients (
+        first_name, last_name, date_of_birth, gender, phone_number, email,
+        medical_aid_number, province, physical_address, is_palmed_member,
+        chronic_conditions, allergies, current_medications, created_by_id,
+        created_at, is_active
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE)
+"""
+
+def parse_patient_arrays(patient):
+    """Split comma-separated list columns into arrays (in place)"""
+    for field in ('chronic_conditions', 'allergies', 'current_medications'):
+        if patient.get(field):
+            patient[field] = patient[field].split(',')
+    return patient
+
+def patient_insert_values(data, user_id):
+    """Normalise a patient payload into PATIENT_INSERT_SQL parameters"""
+    chronic_conditions = data.get('chronic_conditions', [])
+    allergies = data.get('allergies', [])
+    current_medications = data.get('current_medications', [])
+    
+    def text(field):
+        # Payloads may carry numbers where text is expected (e.g. phone_number)
+        value = data.get(field)
+        return str(value).strip() if value is not None else ''
+    
+    return (
+        text('first_name'),
+        text('last_name'),
+        data.get('date_of_birth'),
+        data.get('gender'),
+        text('phone_number'),
+        text('email').lower() or None,
+        text('medical_aid_number'),
+        data.get('province', 'Not Specified'),
+        text('physical_address'),
+        data.get('is_palmed_member', False),
+        ','.join(chronic_conditions) if chronic_conditions else None,
+        ','.join(allergies) if allergies else None,
+        ','.join(current_medications) if current_medications else None,
+        user_id,
+        datetime.now(timezone.utc)
+    )
+
+def build_patient_update(data):
+    """
+    Build the SET clause for a patient update from PATIENT_UPDATABLE_FIELDS.
+    Returns (set_clause, params), or (None, []) if nothing is updatable.
+    """
+    update_parts = []
+    params = []
+    
+    for field in PATIENT_UPDATABLE_FIELDS:
+        if field in data:
+            value = data[field]
+            if isinstance(value, list):
+                value = ','.join(value)
+            update_parts.append(f"{field} = %s")
+            params.append(value)
+    
+    if not update_parts:
+        return None, []
+    
+    update_parts.append("updated_at = %s")
+    params.append(datetime.now(timezone.utc))
+    return ', '.join(update_parts), params
 
 @patients_bp.route('', methods=['GET'])
 @require_auth
 def get_patients():
     """
     Get paginated list of patients with optional search
-    Query params: page, per_page, search, province
+    Query params: page, per_page, search, province, after, include_total
+    Pass `after` (empty for the first page) to use cursor pagination.
     """
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        try:
+            page_req = PageRequest.from_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         search = request.args.get('search', '').strip()
         province = request.args.get('province', '').strip()
         
-        if page < 1 or per_page < 1 or per_page > 100:
-            return jsonify({'success': False, 'error': 'Invalid pagination parameters'}), 400
+        if search and page_req.cursor_mode:
+            return jsonify({'success': False, 'error': 'Cursor pagination is not supported for ranked search'}), 400
         
-        offset = (page - 1) * per_page
-        
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
+        if search:
+            # Ranked, index-backed search (see patient_search)
+            patients, total = search_patients(
+                cursor, search, province or None,
+                limit=page_req.per_page, offset=(page_req.page - 1) * page_req.per_page
+            )
+            cursor.close()
+            
+            return jsonify({
+                'success': True,
+                'data': patients,
+                'pagination': {
+                    'page': page_req.page,
+                    'per_page': page_req.per_page,
+                    'total': total,
+                    'pages': (total + page_req.per_page - 1) // page_req.per_page
+                }
+            }), 200
+        
         # Build query
         query = "SELECT * FROM patients WHERE is_active = TRUE"
         count_query = "SELECT COUNT(*) as total FROM patients WHERE is_active = TRUE"
         params = []
         
-        if search:
-            search_term = f"%{search}%"
-            query += " AND (first_name LIKE %s OR last_name LIKE %s OR medical_aid_number LIKE %s OR phone_number LIKE %s)"
-            count_query += " AND (first_name LIKE %s OR last_name LIKE %s OR medical_aid_number LIKE %s OR phone_number LIKE %s)"
-            params = [search_term, search_term, search_term, search_term]
-        
         if province:
             query += " AND province = %s"
             count_query += " AND province = %s"
             params.append(province)
         
-        # Get total count
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
+        try:
+            patients, pagination = fetch_page(
+                cursor, query, count_query, params, page_req, PATIENT_KEYSET,
+                table='patients', filtered=bool(province)
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        # Get paginated results
-        query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-        cursor.execute(query, params + [per_page, offset])
-        patients = cursor.fetchall()
+        cursor.close()
         
+        return jsonify({
+            'success': True,
+            'data': patients,
+            'pagination': pagination
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@patients_bp.route('/search', methods=['GET'])
+@require_auth
+def search_patients_endpoint():
+    """
+    Ranked patient search for registration desks
+    Query params: q, province, limit (default: 10)
+    Phone, medical aid and ID numbers match exactly or by prefix; names
+    match by prefix, full-text and phonetic similarity.
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        province = request.args.get('province', '').strip()
+        limit = int(request.args.get('limit', 10))
+        
+        if not query:
+            return jsonify({'success': False, 'error': 'q is required'}), 400
+        if limit < 1 or limit > 100:
+            return jsonify({'success': False, 'error': 'limit must be between 1 and 100'}), 400
+        
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
+        
+        patients, total = search_patients(cursor, query, province or None, limit=limit)
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
             'data': patients,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
+            'summary': {
+                'query_type': classify_query(query),
+                'total_matches': total
             }
         }), 200
     
@@ -89,27 +220,14 @@ def create_patient():
             return jsonify({'success': False, 'error': 'Request body required'}), 400
         
         # Validate required fields
-        required_fields = ['first_name', 'last_name', 'date_of_birth', 'gender', 'phone_number']
-        for field in required_fields:
+        for field in PATIENT_REQUIRED_FIELDS:
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        # Extract data
-        first_name = data.get('first_name', '').strip()
-        last_name = data.get('last_name', '').strip()
-        date_of_birth = data.get('date_of_birth')
-        gender = data.get('gender')
-        phone_number = data.get('phone_number', '').strip()
-        email = data.get('email', '').strip().lower() if data.get('email') else None
-        medical_aid_number = data.get('medical_aid_number', '').strip()
-        province = data.get('province', 'Not Specified')
-        physical_address = data.get('physical_address', '').strip()
-        is_palmed_member = data.get('is_palmed_member', False)
-        chronic_conditions = data.get('chronic_conditions', [])
-        allergies = data.get('allergies', [])
-        current_medications = data.get('current_medications', [])
-        
-        db_conn = get_db_connection()
+        values = patient_insert_values(data, request.user_id)
+        first_name, last_name, medical_aid_number = values[0], values[1], values[6]
+        
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Check if patient already exists (by medical aid or phone)
@@ -120,47 +238,22 @@ def create_patient():
         
         if cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({
                 'success': False,
                 'error': 'Patient with this medical aid number already exists'
             }), 409
         
         # Insert patient
-        cursor.execute(
-            """
-            INSERT INTO patients (
-                first_name, last_name, date_of_birth, gender, phone_number, email,
-                medical_aid_number, province, physical_address, is_palmed_member,
-                chronic_conditions, allergies, current_medications, created_by_id,
-                created_at, is_active
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE)
-            """,
-            (
-                first_name, last_name, date_of_birth, gender, phone_number, email,
-                medical_aid_number, province, physical_address, is_palmed_member,
-                ','.join(chronic_conditions) if chronic_conditions else None,
-                ','.join(allergies) if allergies else None,
-                ','.join(current_medications) if current_medications else None,
-                request.user_id,
-                datetime.now(timezone.utc)
-            )
-        )
+        cursor.execute(PATIENT_INSERT_SQL, values)
         
         patient_id = cursor.lastrowid
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, table_name, record_id, created_at, new_values)
-            VALUES (%s, 'CREATE', 'patient', %s, %s, %s)
-            """,
-            (request.user_id, patient_id, datetime.now(timezone.utc), json.dumps({'info': f'Created patient: {first_name} {last_name}'}) )
-        )
+        log_action(db_conn, 'CREATE', 'patient', patient_id, f'Created patient: {first_name} {last_name}')
+        record_metrics(db_conn, new_patients=1, total_patients=1)
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -178,7 +271,7 @@ def get_patient(patient_id):
     Get patient details by ID
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         cursor.execute(
@@ -190,24 +283,69 @@ def get_patient(patient_id):
         
         patient = cursor.fetchone()
         cursor.close()
-        db_conn.close()
         
         if not patient:
             return jsonify({'success': False, 'error': 'Patient not found'}), 404
         
-        # Parse arrays
-        if patient.get('chronic_conditions'):
-            patient['chronic_conditions'] = patient['chronic_conditions'].split(',')
-        if patient.get('allergies'):
-            patient['allergies'] = patient['allergies'].split(',')
-        if patient.get('current_medications'):
-            patient['current_medications'] = patient['current_medications'].split(',')
+        parse_patient_arrays(patient)
         
         return jsonify({'success': True, 'data': patient}), 200
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@patients_bp.route('/<int:patient_id>/timeline', methods=['GET'])
+@require_auth
+def get_patient_timeline(patient_id):
+    """
+    Get a patient's clinical history (visits with vitals/notes/prescriptions, referrals), newest first
+    Query params: per_page, after (next_cursor from the previous page), include (vitals, notes, prescriptions)
+    """
+    try:
+        try:
+            per_page = int(request.args.get('per_page', Config.DEFAULT_PAGE_SIZE))
+            if per_page < 1 or per_page > Config.MAX_PAGE_SIZE:
+                raise ValueError('Invalid pagination parameters')
+            include = parse_include(request.args.get('include', ''))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        after = request.args.get('after', '').strip() or None
+        
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
+        
+        cursor.execute("SELECT * FROM patients WHERE id = %s AND is_active = TRUE", (patient_id,))
+        patient = cursor.fetchone()
+        
+        if not patient:
+            cursor.close()
+            return jsonify({'success': False, 'error': 'Patient not found'}), 404
+        
+        try:
+            events, has_more, next_cursor = fetch_timeline(cursor, patient_id, per_page, after, include)
+        except ValueError as e:
+            cursor.close()
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        cursor.close()
+        
+        return json_response({
+            'success': True,
+            'data': {
+                'patient': parse_patient_arrays(patient),
+                'events': events
+            },
+            'pagination': {
+                'per_page': per_page,
+                'has_more': has_more,
+                'next_cursor': next_cursor
+            }
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @patients_bp.route('/<int:patient_id>', methods=['PUT'])
 @require_role('doctor', 'nurse', 'clerk', 'administrator')
 def update_patient(patient_id):
@@ -220,58 +358,30 @@ def update_patient(patient_id):
         if not data:
             return jsonify({'success': False, 'error': 'Request body required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Verify patient exists
         cursor.execute("SELECT id FROM patients WHERE id = %s AND is_active = TRUE", (patient_id,))
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Patient not found'}), 404
         
         # Build update query dynamically
-        allowed_fields = [
-            'phone_number', 'email', 'province', 'physical_address',
-            'chronic_conditions', 'allergies', 'current_medications'
-        ]
-        
-        update_parts = []
-        params = []
-        
-        for field in allowed_fields:
-            if field in data:
-                value = data[field]
-                if isinstance(value, list):
-                    value = ','.join(value)
-                update_parts.append(f"{field} = %s")
-                params.append(value)
+        set_clause, params = build_patient_update(data)
         
-        if not update_parts:
+        if not set_clause:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'No valid fields to update'}), 400
         
         # Update patient
-        update_parts.append("updated_at = %s")
-        params.append(datetime.now(timezone.utc))
-        params.append(patient_id)
-        
-        query = f"UPDATE patients SET {', '.join(update_parts)} WHERE id = %s"
-        cursor.execute(query, params)
+        cursor.execute(f"UPDATE patients SET {set_clause} WHERE id = %s", params + [patient_id])
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'UPDATE', 'patient', %s, %s, %s)
-            """,
-            (request.user_id, patient_id, datetime.now(timezone.utc), f'Updated patient information')
-        )
+        log_action(db_conn, 'UPDATE', 'patient', patient_id, 'Updated patient information')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -288,28 +398,28 @@ def deactivate_patient(patient_id):
     Deactivate patient account
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         cursor.execute(
             """
-            UPDATE patients SET is_active = FALSE, updated_at = %s WHERE id = %s
+            UPDATE patients SET is_active = FALSE, updated_at = %s
+            WHERE id = %s AND is_active = TRUE
             """,
             (datetime.now(timezone.utc), patient_id)
         )
         
+        # Only an actual transition leaves the active-patient gauge
+        if cursor.rowcount != 1:
+            cursor.close()
+            return jsonify({'success': False, 'error': 'Active patient not found'}), 404
+        
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, entity_type, entity_id, timestamp, details)
-            VALUES (%s, 'DEACTIVATE', 'patient', %s, %s, %s)
-            """,
-            (request.user_id, patient_id, datetime.now(timezone.utc), 'Patient account deactivated')
-        )
+        log_action(db_conn, 'DEACTIVATE', 'patient', patient_id, 'Patient account deactivated')
+        record_metrics(db_conn, total_patients=-1)
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -0,0 +1,194 @@
+"""
+POLMED Backend - Patient Search
+Index-backed, ranked patient lookup for registration desks
+
+Identifier queries (phone, medical aid and ID numbers) are routed to exact
+and prefix matches on their B-tree indexes. Name queries combine prefix
+matches on the name indexes, the ft_patient_name FULLTEXT index and the
+SOUNDEX-based *_phonetic columns. Every branch is an index lookup, and the
+hits are summed into a relevance score.
+
+Each branch reads at most PATIENT_SEARCH_MAX_HITS rows, so short, common
+terms cannot pull a large share of the table into the ranking. Terms shorter
+than PATIENT_SEARCH_MIN_PREFIX are only matched exactly, and names shorter
+than PATIENT_SEARCH_MIN_PHONETIC skip the SOUNDEX and full-text branches
+(which match almost everything at that length).
+"""
+
+import re
+
+from config import Config
+
+# Characters with special meaning in FULLTEXT boolean mode
+_FT_OPERATORS = re.compile(r'[+\-><()~*"@]')
+_PHONE_LIKE = re.compile(r'^\+?[\d\s\-()]+$')
+_IDENTIFIER_LIKE = re.compile(r'^[A-Za-z0-9\-/]*\d[A-Za-z0-9\-/]*$')
+
+# Branch weights - exact identifier hits always outrank name similarity
+EXACT_ID_SCORE = 100
+PREFIX_ID_SCORE = 50
+EXACT_LAST_NAME_SCORE = 40
+EXACT_FIRST_NAME_SCORE = 30
+PREFIX_LAST_NAME_SCORE = 20
+PREFIX_FIRST_NAME_SCORE = 15
+FULLTEXT_WEIGHT = 10
+PHONETIC_LAST_NAME_SCORE = 10
+PHONETIC_FIRST_NAME_SCORE = 8
+
+
+def _like_prefix(value):
+    """Escape LIKE wildcards and append a trailing % for an index-friendly prefix match"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _exact(column, value, score):
+    """Equality branch; rows come back newest first along the index"""
+    return (f"{column} = %s", [value], score, "id DESC")
+
+
+def _prefix(column, value, score):
+    """Prefix branch; alphabetical along the index, so the term itself sorts before its extensions"""
+    return (f"{column} LIKE %s", [_like_prefix(value)], score, f"{column}, id")
+
+
+def phone_variants(query):
+    """Normalise a phone query to the local (0...) and international (+27...) forms"""
+    digits = re.sub(r'\D', '', query)
+    variants = {digits}
+    if digits.startswith('27'):
+        variants.update({'+' + digits, '0' + digits[2:]})
+    elif digits.startswith('0'):
+        variants.update({'+27' + digits[1:], '27' + digits[1:]})
+    return sorted(v for v in variants if v)
+
+
+def classify_query(query):
+    """Return 'phone', 'identifier' or 'name' for a search string"""
+    if _PHONE_LIKE.match(query) and len(re.sub(r'\D', '', query)) >= 3:
+        return 'phone'
+    if _IDENTIFIER_LIKE.match(query):
+        return 'identifier'
+    return 'name'
+
+
+def _identifier_branches(query, kind):
+    """Exact and prefix lookups on the identifier indexes"""
+    branches = []
+    values = phone_variants(query) if kind == 'phone' else [query]
+
+    for value in values:
+        prefix = len(value) >= Config.PATIENT_SEARCH_MIN_PREFIX
+        if kind == 'phone':
+            branches.append(_exact('phone_number', value, EXACT_ID_SCORE))
+            if prefix:
+                branches.append(_prefix('phone_number', value, PREFIX_ID_SCORE))
+        branches.append(_exact('medical_aid_number', value, EXACT_ID_SCORE))
+        if prefix:
+            branches.append(_prefix('medical_aid_number', value, PREFIX_ID_SCORE))
+        branches.append(_exact('id_number', value, EXACT_ID_SCORE))
+        if prefix:
+            branches.append(_prefix('id_number', value, PREFIX_ID_SCORE))
+
+    return branches
+
+
+def _name_branches(query):
+    """
+    Prefix, phonetic and full-text lookups for each name term.
+    Returns (branches, fulltext_terms).
+    """
+    branches = []
+    terms = [t for t in _FT_OPERATORS.sub(' ', query).split() if t]
+
+    for term in terms:
+        branches.append(_exact('last_name', term, EXACT_LAST_NAME_SCORE))
+        branches.append(_exact('first_name', term, EXACT_FIRST_NAME_SCORE))
+        if len(term) >= Config.PATIENT_SEARCH_MIN_PREFIX:
+            branches.append(_prefix('last_name', term, PREFIX_LAST_NAME_SCORE))
+            branches.append(_prefix('first_name', term, PREFIX_FIRST_NAME_SCORE))
+        if len(term) >= Config.PATIENT_SEARCH_MIN_PHONETIC:
+            branches.append(("last_name_phonetic = LEFT(SOUNDEX(%s), 4)", [term], PHONETIC_LAST_NAME_SCORE, "id DESC"))
+            branches.append(("first_name_phonetic = LEFT(SOUNDEX(%s), 4)", [term], PHONETIC_FIRST_NAME_SCORE, "id DESC"))
+
+    return branches, [t for t in terms if len(t) >= Config.PATIENT_SEARCH_MIN_PHONETIC]
+
+
+def build_search_query(query, province=None, max_hits=None):
+    """
+    Build the ranked hit query.
+    Returns (sql, params) selecting (id, score) ordered by score, or
+    (None, []) if the query has no searchable terms.
+    """
+    max_hits = max_hits or Config.PATIENT_SEARCH_MAX_HITS
+    kind = classify_query(query)
+
+    terms = []
+    if kind == 'name':
+        branches, terms = _name_branches(query)
+    else:
+        branches = _identifier_branches(query, kind)
+
+    if not branches:
+        return None, []
+
+    filters = "is_active = TRUE"
+    filter_params = []
+    if province:
+        filters += " AND province = %s"
+        filter_params.append(province)
+
+    parts = []
+    params = []
+    # Parenthesised so each branch gets its own ORDER BY ... LIMIT, which
+    # follows the branch's index so the same rows survive the cap every time
+    for condition, condition_params, score, order in branches:
+        parts.append(
+            f"(SELECT id, {score} AS score FROM patients WHERE {filters} AND {condition} "
+            f"ORDER BY {order} LIMIT %s)"
+        )
+        params += filter_params + condition_params + [max_hits]
+
+    if terms:
+        boolean_query = ' '.join(f"{term}*" for term in terms)
+        parts.append(
+            f"(SELECT id, MATCH(first_name, last_name) AGAINST (%s IN BOOLEAN MODE) * {FULLTEXT_WEIGHT} AS score "
+            f"FROM patients WHERE {filters} AND MATCH(first_name, last_name) AGAINST (%s IN BOOLEAN MODE) "
+            f"ORDER BY score DESC, id DESC LIMIT %s)"
+        )
+        params += [boolean_query] + filter_params + [boolean_query, max_hits]
+
+    sql = (
+        "SELECT id, SUM(score) AS score FROM ("
+        + " UNION ALL ".join(parts)
+        + ") hits GROUP BY id ORDER BY score DESC, id DESC LIMIT %s"
+    )
+    params.append(max_hits)
+    return sql, params
+
+
+def search_patients(cursor, query, province=None, limit=20, offset=0):
+    """
+    Run a ranked patient search.
+    Returns (patients, total_hits); each patient carries a `match_score`.
+    Total hits are capped at PATIENT_SEARCH_MAX_HITS.
+    """
+    sql, params = build_search_query(query, province)
+    if not sql:
+        return [], 0
+
+    cursor.execute(sql, params)
+    hits = cursor.fetchall()
+    page = hits[offset:offset + limit]
+    if not page:
+        return [], len(hits)
+
+    scores = {hit['id']: float(hit['score']) for hit in page}
+    placeholders = ', '.join(['%s'] * len(page))
+    cursor.execute(f"SELECT * FROM patients WHERE id IN ({placeholders})", list(scores))
+
+    patients = cursor.fetchall()
+    for patient in patients:
+        patient['match_score'] = round(scores[patient['id']], 3)
+    patients.sort(key=lambda p: (-p['match_score'], -p['id']))
+
+    return patients, len(hits)
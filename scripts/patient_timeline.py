@@ -0,0 +1,101 @@
+"""
+POLMED Backend - Patient Timeline
+Chronological clinical history for a patient, newest first
+
+A page is built with a fixed number of queries regardless of history size:
+1. a UNION ALL index query over visits and referrals picks the next page of
+   (occurred_at, kind, id) keys after the cursor;
+2. visit_details.load_visit_details loads those visits with their vitals,
+   notes and prescriptions in one round trip;
+3. one IN (...) query loads the referrals on the page.
+"""
+
+from pagination import Keyset
+from visit_details import load_visit_details
+
+TIMELINE_KEYSET = Keyset('timeline', ('occurred_at', 'kind', 'id'), descending=True)
+
+# kind -> inner query producing (kind, id, occurred_at) for one patient;
+# {coarse} narrows the index range when continuing from a cursor
+TIMELINE_SOURCES = {
+    'visit': """
+        SELECT 'visit' AS kind, id, TIMESTAMP(visit_date, COALESCE(visit_time, '00:00:00')) AS occurred_at
+        FROM patient_visits
+        WHERE patient_id = %s AND is_active = TRUE {coarse}""",
+    'referral': """
+        SELECT 'referral' AS kind, id, created_at AS occurred_at
+        FROM referrals
+        WHERE patient_id = %s AND is_active = TRUE {coarse}""",
+}
+
+COARSE_FILTERS = {
+    'visit': "AND visit_date <= DATE(%s)",
+    'referral': "AND created_at <= %s",
+}
+
+
+def _page_keys(cursor, patient_id, limit, seek):
+    branches = []
+    params = []
+
+    for kind, source in TIMELINE_SOURCES.items():
+        inner_params = [patient_id]
+        coarse = ''
+        outer = ''
+        outer_params = []
+        if seek:
+            coarse = COARSE_FILTERS[kind]
+            inner_params.append(seek[0])
+            clause, outer_params = TIMELINE_KEYSET.seek_clause(seek)
+            outer = f"WHERE {clause}"
+
+        branches.append(
+            f"(SELECT kind, id, occurred_at FROM ({source.format(coarse=coarse)}) {kind}_events "
+            f"{outer} ORDER BY occurred_at DESC, id DESC LIMIT %s)"
+        )
+        params += inner_params + outer_params + [limit + 1]
+
+    cursor.execute(
+        "SELECT kind, id, occurred_at FROM (" + " UNION ALL ".join(branches) + ") events "
+        f"ORDER BY {TIMELINE_KEYSET.order_by()} LIMIT %s",
+        params + [limit + 1]
+    )
+    return cursor.fetchall()
+
+
+def fetch_timeline(cursor, patient_id, limit, after=None, include=None):
+    """
+    Fetch one page of a patient's timeline.
+    `after` is the next_cursor of the previous page (ValueError if invalid);
+    `include` selects visit sections as in visit_details.parse_include.
+    Returns (events, has_more, next_cursor).
+    """
+    seek = TIMELINE_KEYSET.decode(after) if after else None
+    keys = _page_keys(cursor, patient_id, limit, seek)
+
+    has_more = len(keys) > limit
+    keys = keys[:limit]
+
+    visit_ids = [key['id'] for key in keys if key['kind'] == 'visit']
+    referral_ids = [key['id'] for key in keys if key['kind'] == 'referral']
+
+    records = {
+        'visit': load_visit_details(cursor, visit_ids, include),
+        'referral': {}
+    }
+    if referral_ids:
+        placeholders = ', '.join(['%s'] * len(referral_ids))
+        cursor.execute(f"SELECT * FROM referrals WHERE id IN ({placeholders})", referral_ids)
+        records['referral'] = {row['id']: row for row in cursor.fetchall()}
+
+    events = [
+        {
+            'type': key['kind'],
+            'occurred_at': key['occurred_at'],
+            'data': records[key['kind']].get(key['id'])
+        }
+        for key in keys
+    ]
+
+    next_cursor = TIMELINE_KEYSET.encode(keys[-1]) if has_more and keys else None
+    return events, has_more, next_cursor
@@ -0,0 +1,246 @@
+"""
+POLMED Backend - Permission Matrix
+In-process role/permission lookups for auth.check_permission
+
+Role permissions are loaded once per worker from user_roles.permissions
+(JSON list such as ["patient.read", "inventory.all"]) and, where the tables
+exist, role_permissions/resources. Workers re-check a shared version every
+PERMISSION_CHECK_INTERVAL seconds and reload when it changes. The version is
+the 'permissions' row of cache_versions, or the mtime of
+PERMISSION_VERSION_FILE when that is set. Anything that edits roles (or a
+user's role_id) should call bump_permissions_version; after editing roles
+by hand, run `python permissions.py bump`. User -> role lookups are memoised
+for the PERMISSION_USER_MEMO_SIZE most recently seen users.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import mysql.connector
+
+from config import Config
+
+VERSION_NAME = 'permissions'
+WILDCARD = 'all'
+
+
+def _parse_permissions(value):
+    """user_roles.permissions arrives as str/bytes (JSON) or an already-decoded list"""
+    if not value:
+        return []
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    return [str(p) for p in value] if isinstance(value, list) else []
+
+
+class PermissionMatrix:
+    """Role -> permission set, plus a user -> role memo, for the current worker"""
+
+    def __init__(self, check_interval=30, version_file=None, max_users=10000):
+        self.check_interval = check_interval
+        self.version_file = version_file
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._memo_lock = threading.Lock()
+        self._roles = {}                  # role_id -> {'role_name': str, 'permissions': frozenset}
+        self._user_roles = OrderedDict()  # user_id -> role_id, least recently used first
+        self._version = None
+        self._loaded = False
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    # ------------------------------------------------------------------
+    # Versioning
+    # ------------------------------------------------------------------
+
+    def _shared_version(self, db_connection):
+        """Current shared version, or None if it cannot be read (forces a reload)"""
+        if self.version_file:
+            try:
+                return os.stat(self.version_file).st_mtime_ns
+            except OSError:
+                return 0
+
+        try:
+            cursor = db_connection.cursor()
+            cursor.execute("SELECT version FROM cache_versions WHERE name = %s", (VERSION_NAME,))
+            row = cursor.fetchone()
+            cursor.close()
+            return row[0] if row else 0
+        except mysql.connector.Error:
+            return None
+
+    def ensure_fresh(self, db_connection):
+        """Reload the matrix if it has never been loaded or the shared version moved"""
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.check_interval:
+            return
+
+        with self._lock:
+            if self._loaded and now - self._checked_at < self.check_interval:
+                return
+
+            version = self._shared_version(db_connection)
+            self._checked_at = now
+            if self._loaded and version is not None and version == self._version:
+                return
+
+            self._load(db_connection)
+            self._version = version
+
+    def invalidate(self):
+        """Drop this worker's matrix; the next check reloads it"""
+        with self._lock:
+            self._loaded = False
+
+    def _load(self, db_connection):
+        cursor = db_connection.cursor()
+        cursor.execute("SELECT id, role_name, permissions, is_active FROM user_roles")
+
+        roles = {}
+        for role_id, role_name, permissions, is_active in cursor.fetchall():
+            roles[role_id] = {
+                'role_name': role_name,
+                'permissions': set(_parse_permissions(permissions)) if is_active else set()
+            }
+
+        # Fine-grained grants, where the deployment has them
+        try:
+            cursor.execute("""
+                SELECT rp.role_id, r.resource_name, rp.action
+                FROM role_permissions rp
+                JOIN resources r ON r.id = rp.resource_id
+            """)
+            for role_id, resource_name, action in cursor.fetchall():
+                if role_id in roles:
+                    roles[role_id]['permissions'].add(f'{resource_name}.{action}')
+        except mysql.connector.Error:
+            pass
+
+        cursor.close()
+
+        self._roles = {
+            role_id: {'role_name': role['role_name'], 'permissions': frozenset(role['permissions'])}
+            for role_id, role in roles.items()
+        }
+        with self._memo_lock:
+            self._user_roles = OrderedDict()
+        self._loaded = True
+        self.reloads += 1
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def role_name(self, role_id):
+        role = self._roles.get(role_id)
+        return role['role_name'] if role else None
+
+    def remember_user_role(self, user_id, role_id):
+        with self._memo_lock:
+            self._user_roles[user_id] = role_id
+            self._user_roles.move_to_end(user_id)
+            while len(self._user_roles) > self.max_users:
+                self._user_roles.popitem(last=False)
+
+    def user_role_id(self, db_connection, user_id):
+        """Role id for a user, memoised (LRU) until the next reload"""
+        with self._memo_lock:
+            if user_id in self._user_roles:
+                self._user_roles.move_to_end(user_id)
+                return self._user_roles[user_id]
+
+        cursor = db_connection.cursor()
+        cursor.execute("SELECT role_id FROM users WHERE id = %s", (user_id,))
+        row = cursor.fetchone()
+        cursor.close()
+
+        role_id = row[0] if row else None
+        self.remember_user_role(user_id, role_id)
+        return role_id
+
+    def role_allows(self, role_id, resource, action):
+        role = self._roles.get(role_id)
+        if not role:
+            return False
+
+        permissions = role['permissions']
+        return (
+            WILDCARD in permissions
+            or f'{resource}.{WILDCARD}' in permissions
+            or f'{resource}.{action}' in permissions
+        )
+
+    def stats(self):
+        return {
+            'roles': len(self._roles),
+            'users': len(self._user_roles),
+            'version': self._version,
+            'reloads': self.reloads,
+            'source': 'file' if self.version_file else 'database'
+        }
+
+
+_matrix = PermissionMatrix(
+    check_interval=Config.PERMISSION_CHECK_INTERVAL,
+    version_file=Config.PERMISSION_VERSION_FILE,
+    max_users=Config.PERMISSION_USER_MEMO_SIZE
+)
+
+
+def get_permission_matrix(db_connection):
+    """The worker's permission matrix, refreshed if the shared version changed"""
+    _matrix.ensure_fresh(db_connection)
+    return _matrix
+
+
+def bump_permissions_version(db_connection=None):
+    """
+    Signal that roles or user role assignments changed.
+    With the database counter the bump joins the caller's transaction, so
+    commit it together with the role edit.
+    """
+    if _matrix.version_file:
+        with open(_matrix.version_file, 'a'):
+            os.utime(_matrix.version_file, None)
+    elif db_connection is not None:
+        cursor = db_connection.cursor()
+        cursor.execute("""
+            INSERT INTO cache_versions (name, version) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """, (VERSION_NAME,))
+        cursor.close()
+
+    _matrix.invalidate()
+
+
+def get_permission_stats():
+    """Get permission matrix metrics for the current worker"""
+    return _matrix.stats()
+
+
+if __name__ == '__main__':
+    from database import get_db_connection, close_db_connection
+
+    if sys.argv[1:] != ['bump']:
+        sys.exit('Usage: python permissions.py bump')
+
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    try:
+        bump_permissions_version(conn)
+        conn.commit()
+        print("Permissions version bumped; workers reload within PERMISSION_CHECK_INTERVAL")
+    finally:
+        close_db_connection(conn)
@@ -11,6 +11,8 @@ import mysql.connector
 from mysql.connector import Error
 from werkzeug.security import check_password_hash
 
+from dashboard_metrics import get_dashboard_metrics
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('JWT_SECRET', 'test-secret-key-for-development')
 
@@ -213,36 +215,19 @@ def get_dashboard_stats():
     try:
         stats = {}
         
-        # Get total patients count
-        result = DatabaseManager.execute_query(
-            "SELECT COUNT(*) as count FROM patients WHERE is_active = TRUE", 
-            fetch=True
-        )
-        stats['totalPatients'] = result[0]['count'] if result else 0
-        
-        # Get today's visits
-        today = datetime.now().date()
-        result = DatabaseManager.execute_query(
-            "SELECT COUNT(*) as count FROM patient_visits WHERE DATE(visit_date) = %s",
-            (today,),
-            fetch=True
-        )
-        stats['todaysAppointments'] = result[0]['count'] if result else 0
-        
-        # Get completed visits today
-        result = DatabaseManager.execute_query(
-            "SELECT COUNT(*) as count FROM patient_visits WHERE DATE(visit_date) = %s AND visit_status = 'completed'",
-            (today,),
-            fetch=True
-        )
-        stats['completedVisits'] = result[0]['count'] if result else 0
-        
-        # Get pending visits (not completed)
-        result = DatabaseManager.execute_query(
-            "SELECT COUNT(*) as count FROM patient_visits WHERE visit_status IN ('check_in', 'in_progress')",
-            fetch=True
-        )
-        stats['pendingTasks'] = result[0]['count'] if result else 0
+        # Headline counts from the precomputed daily_metrics row
+        connection = DatabaseManager.get_connection()
+        metrics = {}
+        if connection:
+            try:
+                metrics = get_dashboard_metrics(connection)
+            finally:
+                connection.close()
+        
+        stats['totalPatients'] = metrics.get('total_patients', 0)
+        stats['todaysAppointments'] = metrics.get('total_visits', 0)
+        stats['completedVisits'] = metrics.get('completed_visits', 0)
+        stats['pendingTasks'] = metrics.get('pending_visits', 0)
         
         # Get recent activity (last 10 visits)
         recent_activity = DatabaseManager.execute_query("""
@@ -0,0 +1,262 @@
+"""
+POLMED Backend - Reorder Forecasting
+Purchase suggestions from consumption velocity in inventory_usage
+
+Consumption is split by where it happens:
+- usage on visits that belong to a route is rated per route location visit
+  (quantity / past non-cancelled route_locations of that route in the window),
+  so it follows the route schedule;
+- everything else (walk-ins, waste, loss) is rated per calendar day.
+Upcoming route_locations then give a day-by-day demand curve per consumable:
+    demand[c, d] = base_rate[c] + sum_r route_rate[c, r] * visits[r, d]
+whose running total is compared with the on-hand rollup
+(consumable_stock_levels) to find the projected stock-out day.
+
+Only the trailing history window is read, pre-aggregated by MySQL to one row
+per (consumable, route, day), so the cost is bounded by the window and the
+number of consumables and routes, not by years of usage history. Expiry
+write-offs are not demand and are left out.
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+
+from config import Config
+
+RECENT_DAYS = 28  # window for the recent daily rate reported alongside the full window
+
+USAGE_SQL = """
+    SELECT u.consumable_id, pv.route_id, u.usage_date, SUM(u.quantity_used) AS quantity
+    FROM inventory_usage u
+    LEFT JOIN patient_visits pv ON pv.id = u.visit_id
+    WHERE u.usage_date >= %s AND u.usage_date < %s
+        AND (u.usage_reason IS NULL OR u.usage_reason <> 'expiry')
+    GROUP BY u.consumable_id, pv.route_id, u.usage_date
+"""
+
+ROUTE_VISITS_SQL = """
+    SELECT route_id, visit_date, COUNT(*) AS visits
+    FROM route_locations
+    WHERE visit_date >= %s AND visit_date < %s AND status <> 'cancelled'
+    GROUP BY route_id, visit_date
+"""
+
+# Supplier is the one that delivered the consumable's most recent batch
+CONSUMABLES_SQL = """
+    SELECT
+        c.id,
+        c.item_code,
+        c.item_name,
+        c.unit_of_measure,
+        c.reorder_level,
+        c.max_stock_level,
+        COALESCE(l.quantity_on_hand, 0) AS quantity_on_hand,
+        l.last_unit_cost,
+        (
+            SELECT s.supplier_id FROM inventory_stock s
+            WHERE s.consumable_id = c.id AND s.supplier_id IS NOT NULL
+            ORDER BY s.received_date DESC, s.id DESC
+            LIMIT 1
+        ) AS supplier_id
+    FROM consumables c
+    LEFT JOIN consumable_stock_levels l ON l.consumable_id = c.id
+    WHERE c.is_active = TRUE
+    ORDER BY c.id
+"""
+
+
+def _index(values):
+    return {value: i for i, value in enumerate(values)}
+
+
+def _load(cursor, history_days, horizon_days, today):
+    window_start = today - timedelta(days=history_days)
+    horizon_end = today + timedelta(days=horizon_days)
+
+    cursor.execute(CONSUMABLES_SQL)
+    consumables = cursor.fetchall()
+
+    cursor.execute(USAGE_SQL, (window_start, today))
+    usage = cursor.fetchall()
+
+    cursor.execute(ROUTE_VISITS_SQL, (window_start, horizon_end))
+    visits = cursor.fetchall()
+
+    return consumables, usage, visits
+
+
+def project_demand(consumables, usage, visits, history_days, horizon_days, today):
+    """
+    Vectorised rates and projection. Returns a dict of arrays aligned with
+    `consumables`: daily_rate, recent_rate, horizon_demand, stockout_day
+    (-1 when stock lasts the horizon), plus route_ids and route_rate (C x R).
+    """
+    window_start = today - timedelta(days=history_days)
+    consumable_index = _index(row['id'] for row in consumables)
+    route_ids = sorted(
+        {row['route_id'] for row in usage if row['route_id'] is not None} |
+        {row['route_id'] for row in visits}
+    )
+    route_index = _index(route_ids)
+    n_consumables, n_routes = len(consumables), len(route_ids)
+
+    # Usage rows for active consumables as parallel arrays
+    usage = [row for row in usage if row['consumable_id'] in consumable_index]
+    ci = np.array([consumable_index[row['consumable_id']] for row in usage], dtype=np.intp)
+    ri = np.array([route_index.get(row['route_id'], -1) for row in usage], dtype=np.intp)
+    di = np.array([(row['usage_date'] - window_start).days for row in usage], dtype=np.intp)
+    qty = np.array([row['quantity'] for row in usage], dtype=float)
+
+    daily = np.zeros((n_consumables, history_days))
+    np.add.at(daily, (ci, di), qty)
+
+    routed = ri >= 0
+    route_usage = np.zeros((n_consumables, n_routes))
+    np.add.at(route_usage, (ci[routed], ri[routed]), qty[routed])
+    base_usage = np.bincount(ci[~routed], weights=qty[~routed], minlength=n_consumables)
+
+    # Route location visits: past (rate denominator) and upcoming (schedule)
+    past_visits = np.zeros(n_routes)
+    schedule = np.zeros((n_routes, horizon_days))
+    for row in visits:
+        offset = (row['visit_date'] - today).days
+        if offset < 0:
+            past_visits[route_index[row['route_id']]] += row['visits']
+        else:
+            schedule[route_index[row['route_id']], offset] += row['visits']
+
+    # Route usage with no recorded visits to rate it by falls back to per-day
+    unrated = past_visits == 0
+    base_usage = base_usage + route_usage[:, unrated].sum(axis=1)
+    route_rate = np.divide(
+        route_usage, past_visits, out=np.zeros_like(route_usage), where=~unrated
+    )
+
+    demand = (base_usage / history_days)[:, None] + route_rate @ schedule
+    cumulative = np.cumsum(demand, axis=1)
+    on_hand = np.array([row['quantity_on_hand'] for row in consumables], dtype=float)
+    runs_out = cumulative >= on_hand[:, None]
+    stockout_day = np.where(runs_out.any(axis=1), runs_out.argmax(axis=1), -1)
+
+    return {
+        'daily_rate': daily.sum(axis=1) / history_days,
+        'recent_rate': daily[:, -min(RECENT_DAYS, history_days):].mean(axis=1),
+        'horizon_demand': cumulative[:, -1],
+        'stockout_day': stockout_day,
+        'on_hand': on_hand,
+        'route_ids': route_ids,
+        'route_rate': route_rate,
+    }
+
+
+def suggest_quantities(consumables, projection):
+    """
+    Quantity to order per consumable: enough to cover horizon demand plus the
+    reorder level, capped at max_stock_level. Zero unless the consumable is
+    at/below its reorder level or projected to run out within the horizon.
+    """
+    reorder_level = np.array([row['reorder_level'] or 0 for row in consumables], dtype=float)
+    max_level = np.array([row['max_stock_level'] or np.inf for row in consumables], dtype=float)
+    on_hand = projection['on_hand']
+
+    target = np.minimum(reorder_level + projection['horizon_demand'], max_level)
+    needed = (on_hand <= reorder_level) | (projection['stockout_day'] >= 0)
+    return np.where(needed, np.ceil(np.maximum(target - on_hand, 0)), 0).astype(int)
+
+
+def forecast_reorders(db_conn, history_days=None, horizon_days=None, today=None):
+    """
+    Forecast stock-outs and group purchase suggestions by supplier.
+    Returns (forecast, suppliers): forecast lists the consumables that need
+    reordering, suppliers aggregates them into one order per supplier.
+    """
+    history_days = history_days or Config.REORDER_HISTORY_DAYS
+    horizon_days = horizon_days or Config.REORDER_HORIZON_DAYS
+    today = today or date.today()
+
+    cursor = db_conn.cursor(dictionary=True)
+    consumables, usage, visits = _load(cursor, history_days, horizon_days, today)
+
+    if not consumables:
+        cursor.close()
+        return [], []
+
+    projection = project_demand(consumables, usage, visits, history_days, horizon_days, today)
+    quantities = suggest_quantities(consumables, projection)
+    route_ids = projection['route_ids']
+
+    forecast = []
+    for i in np.flatnonzero(quantities):
+        row = consumables[i]
+        stockout_day = int(projection['stockout_day'][i])
+        unit_cost = float(row['last_unit_cost']) if row['last_unit_cost'] is not None else None
+        route_rates = projection['route_rate'][i]
+        forecast.append({
+            'consumable_id': row['id'],
+            'item_code': row['item_code'],
+            'item_name': row['item_name'],
+            'unit_of_measure': row['unit_of_measure'],
+            'supplier_id': row['supplier_id'],
+            'quantity_on_hand': int(projection['on_hand'][i]),
+            'reorder_level': row['reorder_level'],
+            'max_stock_level': row['max_stock_level'],
+            'daily_rate': round(float(projection['daily_rate'][i]), 3),
+            'recent_daily_rate': round(float(projection['recent_rate'][i]), 3),
+            'route_rates': [
+                {'route_id': route_ids[r], 'per_location_visit': round(float(route_rates[r]), 3)}
+                for r in np.flatnonzero(route_rates)
+            ],
+            'projected_demand': round(float(projection['horizon_demand'][i]), 1),
+            'days_until_stockout': stockout_day if stockout_day >= 0 else None,
+            'projected_stockout_date': today + timedelta(days=stockout_day) if stockout_day >= 0 else None,
+            'suggested_quantity': int(quantities[i]),
+            'unit_cost': unit_cost,
+            'estimated_cost': round(unit_cost * int(quantities[i]), 2) if unit_cost is not None else None,
+        })
+
+    # Soonest stock-outs first; those lasting the horizon after them
+    forecast.sort(key=lambda item: (
+        item['days_until_stockout'] is None, item['days_until_stockout'] or 0, item['item_name']
+    ))
+
+    supplier_ids = sorted({item['supplier_id'] for item in forecast if item['supplier_id'] is not None})
+    names = {}
+    if supplier_ids:
+        cursor.execute(
+            f"SELECT id, supplier_name FROM suppliers WHERE id IN ({', '.join(['%s'] * len(supplier_ids))})",
+            supplier_ids
+        )
+        names = {row['id']: row['supplier_name'] for row in cursor.fetchall()}
+    cursor.close()
+
+    orders = {}
+    for item in forecast:
+        order = orders.setdefault(item['supplier_id'], {
+            'supplier_id': item['supplier_id'],
+            'supplier_name': names.get(item['supplier_id']),
+            'items': [],
+            'total_quantity': 0,
+            'estimated_cost': 0.0,
+            'earliest_stockout_date': None,
+        })
+        order['items'].append({
+            key: item[key] for key in (
+                'consumable_id', 'item_code', 'item_name', 'suggested_quantity',
+                'unit_cost', 'estimated_cost', 'projected_stockout_date'
+            )
+        })
+        order['total_quantity'] += item['suggested_quantity']
+        order['estimated_cost'] = round(order['estimated_cost'] + (item['estimated_cost'] or 0), 2)
+        stockout = item['projected_stockout_date']
+        if stockout and (order['earliest_stockout_date'] is None or stockout < order['earliest_stockout_date']):
+            order['earliest_stockout_date'] = stockout
+
+    # Most urgent supplier first; batches with no known supplier last
+    suppliers = sorted(orders.values(), key=lambda order: (
+        order['supplier_id'] is None,
+        order['earliest_stockout_date'] is None,
+        order['earliest_stockout_date'] or today,
+        -order['estimated_cost'],
+    ))
+    return forecast, suppliers
@@ -0,0 +1,303 @@
+"""
+POLMED Backend - Response Cache
+TTL cache for polled GET endpoints (dashboards, stats), invalidated by tag
+
+Backends:
+- memory: per-worker LRU (fastest, but other workers only see a write once
+  their entry expires)
+- sqlite: a local SQLite file shared by all gunicorn workers on the host, so
+  one worker's invalidation is seen by all of them
+- none: caching disabled
+
+Only 200 responses are stored, and JSON bodies only when they do not report
+`success: false` (some views answer errors with a 200 fallback body).
+
+Cached views declare tags (e.g. 'clinical', 'appointments'). Blueprints
+registered with invalidate_on_write() drop those tags after every
+successful non-GET request, i.e. after the handler has committed.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """Per-process LRU with per-tag generation counters"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires_at, tags, payload)
+        self._generations = {}          # tag -> int
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, tags, payload = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def generation(self, tags):
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def set(self, key, payload, ttl, tags, generation):
+        with self._lock:
+            # A write landed while the response was being built - don't cache it
+            if tuple(self._generations.get(tag, 0) for tag in tags) != generation:
+                return
+            self._entries[key] = (time.time() + ttl, tuple(tags), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tags):
+        tags = set(tags)
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in [k for k, (_, entry_tags, _) in self._entries.items() if tags.intersection(entry_tags)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._entries), 'max_entries': self.max_entries}
+
+
+class SQLiteCache:
+    """File-backed cache shared by all worker processes on the host"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            status INTEGER NOT NULL,
+            mimetype TEXT,
+            body BLOB NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entry_tags (
+            tag TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (tag, key)
+        );
+        CREATE TABLE IF NOT EXISTS tag_generations (
+            tag TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path, max_entries=512):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _conn(self):
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT status, mimetype, body FROM entries WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return (row[0], row[1], bytes(row[2])) if row else None
+
+    def _generation(self, conn, tags):
+        placeholders = ', '.join(['?'] * len(tags))
+        rows = dict(conn.execute(
+            f"SELECT tag, generation FROM tag_generations WHERE tag IN ({placeholders})", tuple(tags)
+        ).fetchall()) if tags else {}
+        return tuple(rows.get(tag, 0) for tag in tags)
+
+    def generation(self, tags):
+        return self._generation(self._conn(), tags)
+
+    def set(self, key, payload, ttl, tags, generation):
+        conn = self._conn()
+        status, mimetype, body = payload
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._generation(conn, tags) != generation:
+                conn.execute("ROLLBACK")
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, status, mimetype, body, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, status, mimetype, sqlite3.Binary(body), now + ttl)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO entry_tags (tag, key) VALUES (?, ?)",
+                [(tag, key) for tag in tags]
+            )
+            # Keep the file bounded: drop expired rows, then the oldest beyond max_entries
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM entries WHERE key NOT IN (SELECT key FROM entries ORDER BY expires_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            conn.execute("DELETE FROM entry_tags WHERE key NOT IN (SELECT key FROM entries)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, tags):
+        tags = tuple(set(tags))
+        if not tags:
+            return
+        conn = self._conn()
+        placeholders = ', '.join(['?'] * len(tags))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                """
+                INSERT INTO tag_generations (tag, generation) VALUES (?, 1)
+                ON CONFLICT(tag) DO UPDATE SET generation = generation + 1
+                """,
+                [(tag,) for tag in tags]
+            )
+            conn.execute(
+                f"DELETE FROM entries WHERE key IN (SELECT key FROM entry_tags WHERE tag IN ({placeholders}))",
+                tags
+            )
+            conn.execute(f"DELETE FROM entry_tags WHERE tag IN ({placeholders})", tags)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        count = self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {'backend': 'sqlite', 'entries': count, 'max_entries': self.max_entries, 'path': self.path}
+
+
+def _create_backend():
+    backend = Config.RESPONSE_CACHE_BACKEND
+    if backend == 'memory':
+        return MemoryCache(Config.RESPONSE_CACHE_MAX_ENTRIES)
+    if backend == 'sqlite':
+        return SQLiteCache(Config.RESPONSE_CACHE_PATH, Config.RESPONSE_CACHE_MAX_ENTRIES)
+    return None
+
+
+_cache = _create_backend()
+_counters = {'hits': 0, 'misses': 0, 'errors': 0}
+
+
+def _cache_key():
+    role = getattr(request, 'user_role', None) or 'anonymous'
+    query = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    return f'{request.endpoint}|{role}|{query}'
+
+
+def _cacheable(response):
+    """200s only, and never a JSON body that reports success: false"""
+    if response.status_code != 200 or response.direct_passthrough:
+        return False
+    if response.is_json:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict) and body.get('success') is False:
+            return False
+    return True
+
+
+def cached_response(tags, ttl=None):
+    """
+    Cache successful GET responses per endpoint, role and query string
+    (see _cacheable).
+    Place below the auth decorator so the role is known.
+    """
+    tags = tuple(tags)
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if _cache is None or request.method != 'GET':
+                return f(*args, **kwargs)
+
+            key = _cache_key()
+            try:
+                payload = _cache.get(key)
+                generation = _cache.generation(tags)
+            except Exception as e:
+                logger.warning(f"Response cache error: {e}")
+                _counters['errors'] += 1
+                return f(*args, **kwargs)
+
+            if payload is not None:
+                _counters['hits'] += 1
+                status, mimetype, body = payload
+                response = make_response(body, status)
+                response.mimetype = mimetype
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            _counters['misses'] += 1
+            response = make_response(f(*args, **kwargs))
+            if _cacheable(response):
+                try:
+                    _cache.set(key, (response.status_code, response.mimetype, response.get_data()),
+                               ttl or Config.RESPONSE_CACHE_TTL, tags, generation)
+                except Exception as e:
+                    logger.warning(f"Response cache error: {e}")
+                    _counters['errors'] += 1
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return decorated_function
+    return decorator
+
+
+def invalidate(*tags):
+    """Drop cached responses carrying any of the given tags"""
+    if _cache is None:
+        return
+    try:
+        _cache.invalidate(tags)
+    except Exception as e:
+        logger.warning(f"Response cache error: {e}")
+        _counters['errors'] += 1
+
+
+def invalidate_on_write(blueprint, *tags):
+    """Invalidate tags after every successful non-GET request to the blueprint"""
+    @blueprint.after_request
+    def _invalidate_response_cache(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            invalidate(*tags)
+        return response
+
+
+def get_response_cache_stats():
+    """Get response cache metrics for the current worker"""
+    if _cache is None:
+        return {'backend': 'none'}
+    try:
+        stats = _cache.stats()
+    except Exception as e:
+        stats = {'error': str(e)}
+    return {**stats, **_counters}
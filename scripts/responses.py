@@ -0,0 +1,90 @@
+"""
+POLMED Backend - Response Helpers
+Compact JSON encoding and gzip for bulk/sync payloads
+"""
+
+import gzip
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask import Response, request, stream_with_context
+
+
+def to_json_value(value):
+    """Convert MySQL column values to JSON-safe primitives"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        # TIME columns come back as timedelta
+        total = int(value.total_seconds())
+        return f"{total // 3600:02d}:{total % 3600 // 60:02d}:{total % 60:02d}"
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+def columnar(rows):
+    """
+    Pack dict rows as {'columns': [...], 'rows': [[...], ...]} so column
+    names are sent once per batch instead of once per row
+    """
+    if not rows:
+        return {'columns': [], 'rows': []}
+    columns = list(rows[0].keys())
+    return {
+        'columns': columns,
+        'rows': [[to_json_value(row[column]) for column in columns] for row in rows]
+    }
+
+
+def client_accepts_gzip():
+    return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+
+def json_response(payload, status=200, compress=True):
+    """JSON response, gzip-compressed when the client accepts it"""
+    body = json.dumps(payload, separators=(',', ':'), default=to_json_value).encode('utf-8')
+    response = Response(body, status=status, mimetype='application/json')
+
+    if compress and client_accepts_gzip() and len(body) > 1024:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+
+    return response
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        # Sync flush so every chunk reaches the client as it is produced
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_response(chunks, mimetype, filename=None, compress=True):
+    """
+    Streaming response from a generator of text chunks, gzip-compressed on
+    the fly when the client accepts it. The request context stays available
+    to the generator.
+    """
+    chunks = stream_with_context(chunks)
+    headers = {'X-Accel-Buffering': 'no'}  # don't let nginx buffer the stream
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    if compress and client_accepts_gzip():
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+        return Response(_gzip_chunks(chunks), mimetype=mimetype, headers=headers)
+
+    return Response((chunk.encode('utf-8') for chunk in chunks), mimetype=mimetype, headers=headers)
@@ -0,0 +1,387 @@
+"""
+POLMED Backend - Route Planner
+Orders a route's candidate locations into a day-by-day visit schedule
+
+Offline, from locations.gps_latitude/gps_longitude only (no mapping
+service):
+1. a haversine distance matrix for all stops (and the depot, if given) is
+   built with NumPy; travel time is distance * ROUTE_ROAD_FACTOR at
+   ROUTE_AVERAGE_SPEED_KMH;
+2. one tour through every stop is built nearest-neighbour first, then
+   improved with 2-opt (segment reversal) and or-opt (moving runs of 1-3
+   stops), each move evaluated for all positions at once;
+3. the tour is cut into days in order: a day takes stops while the visits
+   and travel (back to the depot, if given) fit the route's
+   start_time..end_time window and the appointments fit
+   max_appointments_per_day; each day is then 2-opt'ed on its own.
+Without a depot, tours are open paths (a zero-cost dummy node stands in
+for the depot). 200 stops plan in well under a few seconds.
+`python route_planner.py <route_id>` prints a plan for the route's province.
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import Config
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class RoutePlanError(Exception):
+    """The route cannot be planned; `status` is the HTTP status to report (404 or 400)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def haversine_matrix(latitudes, longitudes):
+    """Great-circle distances in km between every pair of points"""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lng = np.radians(np.asarray(longitudes, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def tour_length(tour, dist):
+    """Closed tour length (tour[0] is the depot)"""
+    tour = np.asarray(tour)
+    return float(dist[tour, np.roll(tour, -1)].sum())
+
+
+def nearest_neighbour(dist, start=0):
+    """Greedy tour over every node, starting at `start`"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    tour = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        candidates = np.where(visited, np.inf, dist[tour[-1]])
+        nxt = int(candidates.argmin())
+        tour.append(nxt)
+        visited[nxt] = True
+    return tour
+
+
+def two_opt(tour, dist, max_passes=100):
+    """
+    Reverse tour[i+1..j] whenever that shortens the closed tour; tour[0]
+    stays fixed. First improvement per i, all j checked at once.
+    """
+    tour = np.array(tour)
+    n = len(tour)
+    if n < 4:
+        return tour.tolist()
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 2):
+            a, b = tour[i], tour[i + 1]
+            j = np.arange(i + 2, n)
+            c = tour[j]
+            d = tour[(j + 1) % n]
+            delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+            best = int(delta.argmin())
+            if delta[best] < -1e-9:
+                k = j[best]
+                tour[i + 1:k + 1] = tour[i + 1:k + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return tour.tolist()
+
+
+def or_opt(tour, dist, max_segment=3, max_passes=50):
+    """
+    Move runs of 1..max_segment consecutive stops (either orientation) to the
+    cheapest other edge of the closed tour; tour[0] stays fixed.
+    """
+    tour = list(tour)
+    for _ in range(max_passes):
+        improved = False
+        for length in range(1, max_segment + 1):
+            i = 1
+            while i + length <= len(tour):
+                if len(tour) - length < 3:
+                    break
+                segment = tour[i:i + length]
+                prev, nxt = tour[i - 1], tour[(i + length) % len(tour)]
+                removal_gain = dist[prev, segment[0]] + dist[segment[-1], nxt] - dist[prev, nxt]
+
+                rest = np.array(tour[:i] + tour[i + length:])
+                u, v = rest, np.roll(rest, -1)
+                forward = dist[u, segment[0]] + dist[segment[-1], v] - dist[u, v]
+                backward = dist[u, segment[-1]] + dist[segment[0], v] - dist[u, v]
+                # Re-inserting where it came from is not a move
+                same = (u == prev) & (v == nxt)
+                forward[same] = np.inf
+                backward[same] = np.inf
+
+                f, b = int(forward.argmin()), int(backward.argmin())
+                cost, pos, seg = (
+                    (forward[f], f, segment) if forward[f] <= backward[b] else (backward[b], b, segment[::-1])
+                )
+                if cost < removal_gain - 1e-9:
+                    rest = rest.tolist()
+                    tour = rest[:pos + 1] + seg + rest[pos + 1:]
+                    improved = True
+                else:
+                    i += 1
+        if not improved:
+            break
+    return tour
+
+
+def improve(tour, dist):
+    """2-opt and or-opt until neither finds a shorter tour"""
+    best = tour_length(tour, dist)
+    while True:
+        tour = or_opt(two_opt(tour, dist), dist)
+        length = tour_length(tour, dist)
+        if length >= best - 1e-9:
+            return tour
+        best = length
+
+
+def _minutes(value):
+    if isinstance(value, timedelta):
+        return value.total_seconds() / 60
+    hours, minutes, *_ = (int(part) for part in str(value).split(':'))
+    return hours * 60 + minutes
+
+
+def _clock(minutes):
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def split_days(tour, travel, day_minutes, visit_minutes, stop_load, daily_capacity, closed):
+    """
+    Cut the tour (tour[0] = depot) into consecutive day tours.
+    Returns (days, unfit): days are lists of node indices; unfit are stops
+    that cannot be visited within a single day at all.
+    """
+    days, unfit = [], []
+    current, load = [], 0
+
+    def fits(stops, extra_load):
+        minutes = travel[0, stops[0]] + len(stops) * visit_minutes
+        minutes += sum(travel[a, b] for a, b in zip(stops, stops[1:]))
+        if closed:
+            minutes += travel[stops[-1], 0]
+        return minutes <= day_minutes and (daily_capacity is None or extra_load <= daily_capacity)
+
+    for node in tour[1:]:
+        if not fits([node], stop_load):
+            unfit.append(node)
+            continue
+        if current and fits(current + [node], load + stop_load):
+            current.append(node)
+            load += stop_load
+        else:
+            if current:
+                days.append(current)
+            current, load = [node], stop_load
+    if current:
+        days.append(current)
+    return days, unfit
+
+
+def plan_route(stops, start_date, end_date, day_start, day_end, depot=None,
+               visit_minutes=None, appointments_per_visit=None, daily_capacity=None,
+               skip_weekends=True):
+    """
+    Plan visits for stops [{id, gps_latitude, gps_longitude}] between
+    start_date and end_date. Pure; no database access.
+    Returns {'days': [...], 'unscheduled': [...], 'distance_km': float}.
+    """
+    visit_minutes = visit_minutes or Config.ROUTE_VISIT_MINUTES
+    appointments_per_visit = appointments_per_visit or Config.ROUTE_APPOINTMENTS_PER_VISIT
+    day_from, day_to = _minutes(day_start), _minutes(day_end)
+
+    unscheduled = [
+        {'location_id': s['id'], 'reason': 'missing_coordinates'}
+        for s in stops if s['gps_latitude'] is None or s['gps_longitude'] is None
+    ]
+    located = [s for s in stops if s['gps_latitude'] is not None and s['gps_longitude'] is not None]
+    if not located:
+        return {'days': [], 'unscheduled': unscheduled, 'distance_km': 0.0}
+
+    # Node 0 is the depot; a zero-distance dummy when there is none (open paths)
+    lat = [float(s['gps_latitude']) for s in located]
+    lng = [float(s['gps_longitude']) for s in located]
+    if depot:
+        dist = haversine_matrix([depot[0]] + lat, [depot[1]] + lng)
+    else:
+        dist = np.zeros((len(located) + 1, len(located) + 1))
+        dist[1:, 1:] = haversine_matrix(lat, lng)
+    travel = dist * Config.ROUTE_ROAD_FACTOR / Config.ROUTE_AVERAGE_SPEED_KMH * 60
+
+    tour = improve(nearest_neighbour(dist), dist)
+    day_tours, unfit = split_days(
+        tour, travel, day_to - day_from, visit_minutes, appointments_per_visit,
+        daily_capacity, closed=bool(depot)
+    )
+    unscheduled += [{'location_id': located[node - 1]['id'], 'reason': 'exceeds_day'} for node in unfit]
+
+    dates = []
+    day = start_date
+    while day <= end_date:
+        if not (skip_weekends and day.weekday() >= 5):
+            dates.append(day)
+        day += timedelta(days=1)
+
+    days = []
+    total_km = 0.0
+    for visit_date, nodes in zip(dates, day_tours):
+        nodes = improve([0] + nodes, dist)[1:]
+        clock = day_from + travel[0, nodes[0]]
+        previous = 0
+        visits = []
+        km = 0.0
+        for sequence, node in enumerate(nodes, start=1):
+            if previous:
+                clock += travel[previous, node]
+            km += dist[previous, node]
+            visits.append({
+                'location_id': located[node - 1]['id'],
+                'location_name': located[node - 1].get('location_name'),
+                'sequence': sequence,
+                'start_time': _clock(clock),
+                'end_time': _clock(clock + visit_minutes),
+                'max_appointments': appointments_per_visit,
+                'travel_km': round(float(dist[previous, node]), 1),
+            })
+            clock += visit_minutes
+            previous = node
+        if depot:
+            km += dist[previous, 0]
+        total_km += km
+        days.append({'visit_date': visit_date, 'distance_km': round(float(km), 1), 'visits': visits})
+
+    for nodes in day_tours[len(dates):]:
+        unscheduled += [{'location_id': located[node - 1]['id'], 'reason': 'no_day_left'} for node in nodes]
+
+    return {'days': days, 'unscheduled': unscheduled, 'distance_km': round(total_km, 1)}
+
+
+def load_route(cursor, route_id, location_ids=None):
+    """
+    The route and its candidate locations (default: active locations in its
+    province); bookable visits generated from route_locations are not places
+    """
+    cursor.execute(
+        """
+        SELECT id, province, start_date, end_date, start_time, end_time, max_appointments_per_day
+        FROM routes WHERE id = %s AND is_active = TRUE
+        """,
+        (route_id,)
+    )
+    route = cursor.fetchone()
+    if not route:
+        raise RoutePlanError('Route not found', 404)
+
+    if location_ids:
+        placeholders = ', '.join(['%s'] * len(location_ids))
+        cursor.execute(
+            f"""
+            SELECT id, location_name, gps_latitude, gps_longitude FROM locations
+            WHERE id IN ({placeholders}) AND is_active = TRUE AND route_location_id IS NULL
+            """,
+            list(location_ids)
+        )
+    else:
+        cursor.execute(
+            """
+            SELECT id, location_name, gps_latitude, gps_longitude FROM locations
+            WHERE province = %s AND is_active = TRUE AND route_location_id IS NULL
+            """,
+            (route['province'],)
+        )
+    return route, cursor.fetchall()
+
+
+def save_plan(cursor, route_id, plan, start_date, end_date, location_ids):
+    """
+    Write the plan to route_locations. Scheduled visits in the date range
+    that the plan dropped are cancelled (their slots go with the next slot
+    generation); nothing outside the range is touched. Does not commit.
+    """
+    rows = [
+        (route_id, visit['location_id'], day['visit_date'], visit['start_time'], visit['end_time'],
+         visit['max_appointments'])
+        for day in plan['days'] for visit in day['visits']
+    ]
+    if rows:
+        cursor.executemany(
+            """
+            INSERT INTO route_locations (route_id, location_id, visit_date, start_time, end_time, max_appointments, status)
+            VALUES (%s, %s, %s, %s, %s, %s, 'scheduled')
+            ON DUPLICATE KEY UPDATE
+                start_time = VALUES(start_time),
+                end_time = VALUES(end_time),
+                max_appointments = VALUES(max_appointments),
+                status = 'scheduled'
+            """,
+            rows
+        )
+
+    keep = ''
+    params = [route_id, start_date, end_date, *location_ids]
+    if rows:
+        keep = f" AND (location_id, visit_date) NOT IN ({', '.join(['(%s, %s)'] * len(rows))})"
+        params += [value for row in rows for value in (row[1], row[2])]
+    cursor.execute(
+        f"""
+        UPDATE route_locations SET status = 'cancelled'
+        WHERE route_id = %s AND visit_date BETWEEN %s AND %s AND status = 'scheduled'
+            AND location_id IN ({', '.join(['%s'] * len(location_ids))}){keep}
+        """,
+        params
+    )
+
+    cursor.execute(
+        """
+        UPDATE routes SET total_locations = (
+            SELECT COUNT(DISTINCT location_id) FROM route_locations
+            WHERE route_id = %s AND status <> 'cancelled'
+        )
+        WHERE id = %s
+        """,
+        (route_id, route_id)
+    )
+    return len(rows)
+
+
+if __name__ == '__main__':
+    import json
+    from database import get_db_connection, close_db_connection
+    from responses import to_json_value
+
+    if len(sys.argv) != 2:
+        print("Usage: python route_planner.py <route_id>")
+        sys.exit(2)
+
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        route, stops = load_route(cursor, int(sys.argv[1]))
+        cursor.close()
+        started = datetime.now()
+        plan = plan_route(
+            stops, route['start_date'], route['end_date'],
+            route['start_time'] or '08:00', route['end_time'] or '17:00',
+            daily_capacity=route['max_appointments_per_day']
+        )
+        print(json.dumps(plan, indent=2, default=to_json_value))
+        print(f"Planned {len(stops)} locations in {(datetime.now() - started).total_seconds():.2f}s",
+              file=sys.stderr)
+    finally:
+        close_db_connection(conn)
@@ -3,15 +3,28 @@ POLMED Backend - Routes & Appointment Management
 Clinic scheduling, location management, appointment booking, and availability
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 from datetime import datetime, timezone, timedelta
 from auth import require_auth, require_role
-from database import get_db_connection
+from database import get_request_db
+from audit import log_action
+from dashboard_metrics import record_metrics
+from response_cache import cached_response, invalidate_on_write
+from pagination import Keyset, PageRequest, fetch_page
+from appointment_slots import reserve_slot, set_appointment_status, SlotUnavailableError
+from appointment_availability import get_availability_index, mark_availability_stale
+from slot_generator import generate_route_slots, SlotGenerationError
+from route_planner import load_route, plan_route, save_plan, RoutePlanError
+from config import Config
 import uuid
 import json
 
 routes_bp = Blueprint('routes', __name__, url_prefix='/api/routes')
 appointments_bp = Blueprint('appointments', __name__, url_prefix='/api/appointments')
+invalidate_on_write(routes_bp, 'routes', 'appointments')
+invalidate_on_write(appointments_bp, 'appointments')
+
+ROUTE_KEYSET = Keyset('routes', ('start_date', 'id'), descending=True)
 
 # ============================================================================
 # ROUTE MANAGEMENT
@@ -22,16 +35,18 @@ appointments_bp = Blueprint('appointments', __name__, url_prefix='/api/appointme
 def get_routes():
     """
     Get paginated list of clinic routes
-    Query params: page, per_page, province, is_active
+    Query params: page, per_page, province, is_active, after, include_total
     """
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
+        try:
+            page_req = PageRequest.from_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         province = request.args.get('province', '').strip()
         is_active = request.args.get('is_active', 'true').lower() == 'true'
-        offset = (page - 1) * per_page
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Build query
@@ -44,27 +59,19 @@ def get_routes():
             count_query += " AND province = %s"
             params.append(province)
         
-        # Get total count
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-        
-        # Get paginated results
-        query += " ORDER BY start_date DESC LIMIT %s OFFSET %s"
-        cursor.execute(query, params + [per_page, offset])
-        routes = cursor.fetchall()
+        try:
+            routes, pagination = fetch_page(
+                cursor, query, count_query, params, page_req, ROUTE_KEYSET
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
             'data': routes,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
-            }
+            'pagination': pagination
         }), 200
     
     except Exception as e:
@@ -85,7 +92,7 @@ def create_route():
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Create route
@@ -115,17 +122,10 @@ def create_route():
         route_id = cursor.lastrowid
         
         # Log audit
-        cursor.execute(
-            """
-            INSERT INTO audit_log (user_id, action, table_name, record_id, created_at, new_values)
-            VALUES (%s, 'CREATE', 'route', %s, %s, %s)
-            """,
-            (request.user_id, route_id, datetime.now(timezone.utc), json.dumps({'info': f'Created route: {data.get("route_name")}'}) )
-        )
+        log_action(db_conn, 'CREATE', 'route', route_id, f'Created route: {data.get("route_name")}')
         
         db_conn.commit()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -143,14 +143,13 @@ def get_route_locations(route_id):
     Get all locations for a specific route
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Verify route exists
         cursor.execute("SELECT id FROM routes WHERE id = %s AND is_active = TRUE", (route_id,))
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Route not found'}), 404
         
         # Get locations
@@ -165,7 +164,6 @@ def get_route_locations(route_id):
         
         locations = cursor.fetchall()
         cursor.close()
-        db_conn.close()
         
         return jsonify({'success': True, 'data': locations}), 200
     
@@ -187,14 +185,13 @@ def add_location_to_route(route_id):
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
         # Verify route exists
         cursor.execute("SELECT id FROM routes WHERE id = %s AND is_active = TRUE", (route_id,))
         if not cursor.fetchone():
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Route not found'}), 404
         
         # Add location
@@ -221,7 +218,7 @@ def add_location_to_route(route_id):
         location_id = cursor.lastrowid
         db_conn.commit()
         cursor.close()
-        db_conn.close()
+        mark_availability_stale()
         
         return jsonify({
             'success': True,
@@ -232,82 +229,273 @@ def add_location_to_route(route_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# ============================================================================
-# APPOINTMENT MANAGEMENT
-# ============================================================================
-
-@appointments_bp.route('/available', methods=['GET'])
-def get_available_appointments():
+@routes_bp.route('/<int:route_id>/slots', methods=['POST'])
+@require_role('administrator', 'inventory_manager')
+def generate_slots(route_id):
     """
-    Get available appointment slots (public endpoint)
-    Query params: province, date_from, date_to, location_type
+    Generate (or bring up to date) the bookable visits and their slot
+    capacity for a route's schedule
+    Optional: slot_minutes (default: 30)
     """
     try:
-        province = request.args.get('province', '').strip()
-        date_from = request.args.get('date_from', '').strip()
-        date_to = request.args.get('date_to', '').strip()
-        location_type = request.args.get('location_type', '').strip()
+        data = request.get_json(silent=True) or {}
         
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor(dictionary=True)
+        try:
+            slot_minutes = int(data.get('slot_minutes') or Config.APPOINTMENT_SLOT_MINUTES)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'slot_minutes must be an integer'}), 400
         
-        # Build query
-        query = """
-            SELECT
-                l.id as location_id,
-                l.location_name,
-                l.location_type,
-                l.address,
-                l.visit_date,
-                r.route_name,
-                r.province,
-                (l.max_appointments - COUNT(a.id)) as available_slots,
-                l.max_appointments
-            FROM locations l
-            JOIN routes r ON l.route_id = r.id
-            LEFT JOIN appointments a ON l.id = a.location_id AND a.appointment_status IN ('confirmed', 'pending')
-            WHERE l.is_active = TRUE
-                AND r.is_active = TRUE
-                AND l.visit_date >= CURDATE()
-        """
+        db_conn = get_request_db()
         
-        params = []
+        try:
+            summary = generate_route_slots(db_conn, route_id, slot_minutes)
+        except SlotGenerationError as e:
+            db_conn.rollback()
+            return jsonify({'success': False, 'error': str(e)}), e.status
         
-        if province:
-            query += " AND r.province = %s"
-            params.append(province)
+        log_action(db_conn, 'GENERATE_SLOTS', 'route', route_id, summary)
+        db_conn.commit()
+        mark_availability_stale()
         
-        if date_from:
-            query += " AND l.visit_date >= %s"
-            params.append(date_from)
+        return jsonify({
+            'success': True,
+            'message': f"Created {summary['created']}, updated {summary['updated']} and removed {summary['removed']} visit(s)",
+            'data': summary
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@routes_bp.route('/<int:route_id>/schedule', methods=['PUT'])
+@require_role('administrator', 'inventory_manager')
+def update_route_schedule(route_id):
+    """
+    Change a route's dates and regenerate its slots in the same transaction
+    Required: start_date, end_date
+    Optional: max_appointments_per_day, slot_minutes
+    """
+    try:
+        data = request.get_json() or {}
         
-        if date_to:
-            query += " AND l.visit_date <= %s"
-            params.append(date_to)
+        try:
+            start_date = datetime.strptime(str(data.get('start_date')), '%Y-%m-%d').date()
+            end_date = datetime.strptime(str(data.get('end_date')), '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'success': False, 'error': 'start_date and end_date must be YYYY-MM-DD'}), 400
         
-        if location_type:
-            query += " AND l.location_type = %s"
-            params.append(location_type)
+        if end_date < start_date:
+            return jsonify({'success': False, 'error': 'end_date is before start_date'}), 400
         
-        query += " GROUP BY l.id, r.id HAVING available_slots > 0 ORDER BY l.visit_date ASC"
+        try:
+            slot_minutes = int(data.get('slot_minutes') or Config.APPOINTMENT_SLOT_MINUTES)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'slot_minutes must be an integer'}), 400
         
-        cursor.execute(query, params)
-        appointments = cursor.fetchall()
+        db_conn = get_request_db()
+        cursor = db_conn.cursor()
         
+        cursor.execute(
+            """
+            UPDATE routes
+            SET start_date = %s, end_date = %s,
+                max_appointments_per_day = COALESCE(%s, max_appointments_per_day),
+                updated_at = %s
+            WHERE id = %s AND is_active = TRUE
+            """,
+            (start_date, end_date, data.get('max_appointments_per_day'), datetime.now(timezone.utc), route_id)
+        )
         cursor.close()
-        db_conn.close()
+        
+        try:
+            summary = generate_route_slots(db_conn, route_id, slot_minutes)
+        except SlotGenerationError as e:
+            db_conn.rollback()
+            return jsonify({'success': False, 'error': str(e)}), e.status
+        
+        log_action(db_conn, 'UPDATE', 'route', route_id, {
+            'start_date': str(start_date),
+            'end_date': str(end_date),
+            'slots': summary
+        })
+        db_conn.commit()
+        mark_availability_stale()
         
         return jsonify({
             'success': True,
-            'data': appointments,
-            'summary': {
-                'total_available': len(appointments)
-            }
+            'message': 'Route schedule updated',
+            'data': summary
         }), 200
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@routes_bp.route('/<int:route_id>/plan', methods=['POST'])
+@require_role('administrator', 'inventory_manager')
+def plan_route_schedule(route_id):
+    """
+    Order candidate locations into a day-by-day schedule by GPS distance
+    Optional: location_ids (default: active locations in the route's province),
+    start_date, end_date (default: the route's), depot {latitude, longitude},
+    visit_minutes, appointments_per_visit, skip_weekends (default: true),
+    apply (default: false) - write route_locations and regenerate slots
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        try:
+            location_ids = [int(location_id) for location_id in data.get('location_ids') or []]
+            start_date = data.get('start_date') and datetime.strptime(data['start_date'], '%Y-%m-%d').date()
+            end_date = data.get('end_date') and datetime.strptime(data['end_date'], '%Y-%m-%d').date()
+            depot = data.get('depot')
+            if depot:
+                depot = (float(depot['latitude']), float(depot['longitude']))
+            visit_minutes = int(data.get('visit_minutes') or Config.ROUTE_VISIT_MINUTES)
+            appointments_per_visit = int(data.get('appointments_per_visit') or Config.ROUTE_APPOINTMENTS_PER_VISIT)
+        except (TypeError, ValueError, KeyError):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid location_ids, dates (YYYY-MM-DD), depot or visit parameters'
+            }), 400
+        
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
+        
+        try:
+            route, stops = load_route(cursor, route_id, location_ids)
+        except RoutePlanError as e:
+            cursor.close()
+            return jsonify({'success': False, 'error': str(e)}), e.status
+        
+        start_date = start_date or route['start_date']
+        end_date = end_date or route['end_date']
+        if end_date < start_date:
+            cursor.close()
+            return jsonify({'success': False, 'error': 'end_date is before start_date'}), 400
+        
+        plan = plan_route(
+            stops, start_date, end_date,
+            route['start_time'] or '08:00', route['end_time'] or '17:00',
+            depot=depot,
+            visit_minutes=visit_minutes,
+            appointments_per_visit=appointments_per_visit,
+            daily_capacity=route['max_appointments_per_day'],
+            skip_weekends=data.get('skip_weekends', True)
+        )
+        
+        if data.get('apply') and stops:
+            plan['saved_visits'] = save_plan(
+                cursor, route_id, plan, start_date, end_date, [stop['id'] for stop in stops]
+            )
+            cursor.close()
+            plan['slots'] = generate_route_slots(db_conn, route_id)
+            log_action(db_conn, 'PLAN', 'route', route_id, {
+                'start_date': str(start_date),
+                'end_date': str(end_date),
+                'visits': plan['saved_visits'],
+                'unscheduled': len(plan['unscheduled'])
+            })
+            db_conn.commit()
+            mark_availability_stale()
+        else:
+            cursor.close()
+        
+        return jsonify({'success': True, 'data': plan}), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# ============================================================================
+# APPOINTMENT MANAGEMENT
+# ============================================================================
+
+def parse_date_arg(name):
+    """Read an optional YYYY-MM-DD query param, raising ValueError if malformed"""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} must be YYYY-MM-DD')
+
+def parse_near_args():
+    """
+    Read ?near=lat,lng&radius_km=&limit= as ((lat, lng), radius_km, limit),
+    or (None, None, None) without near. Raises ValueError if malformed.
+    """
+    near = request.args.get('near', '').strip()
+    if not near:
+        return None, None, None
+    try:
+        latitude, longitude = (float(part) for part in near.split(','))
+    except ValueError:
+        raise ValueError('near must be lat,lng')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('near is out of range')
+    
+    radius_km = float(request.args.get('radius_km', Config.NEAR_DEFAULT_RADIUS_KM))
+    if not 0 < radius_km <= Config.NEAR_MAX_RADIUS_KM:
+        raise ValueError(f'radius_km must be between 0 and {Config.NEAR_MAX_RADIUS_KM}')
+    
+    limit = int(request.args.get('limit', Config.NEAR_DEFAULT_LIMIT))
+    if not 1 <= limit <= Config.NEAR_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {Config.NEAR_MAX_LIMIT}')
+    
+    return (latitude, longitude), radius_km, limit
+
+@appointments_bp.route('/available', methods=['GET'])
+def get_available_appointments():
+    """
+    Get available appointment slots (public endpoint)
+    Query params: province, date_from, date_to, location_type,
+    near=lat,lng with radius_km (default: 50) and limit (default: 10) - nearest first
+    Served from the in-memory availability index; supports If-None-Match.
+    """
+    try:
+        province = request.args.get('province', '').strip()
+        location_type = request.args.get('location_type', '').strip()
+        
+        try:
+            date_from = parse_date_arg('date_from')
+            date_to = parse_date_arg('date_to')
+            near, radius_km, limit = parse_near_args()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        index = get_availability_index(get_request_db)
+        
+        def render():
+            appointments = index.lookup(
+                province, date_from, date_to, location_type,
+                near=near, radius_km=radius_km, limit=limit
+            )
+            response = jsonify({
+                'success': True,
+                'data': appointments,
+                'summary': {
+                    'total_available': len(appointments)
+                }
+            })
+            return response.get_data(), response.mimetype
+        
+        if near is None:
+            key = (province, date_from, date_to, location_type)
+            body, mimetype = index.rendered(key, render)
+        else:
+            # Raw GPS positions rarely repeat; memoising them would only evict the hot keys
+            body, mimetype = render()
+        
+        response = make_response(body, 200)
+        response.mimetype = mimetype
+        response.add_etag()
+        response.cache_control.public = True
+        response.cache_control.max_age = Config.AVAILABILITY_MAX_AGE
+        response.cache_control.s_maxage = Config.AVAILABILITY_MAX_AGE
+        return response.make_conditional(request)
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @appointments_bp.route('', methods=['POST'])
 def book_appointment():
     """
@@ -323,37 +511,19 @@ def book_appointment():
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'{field} is required'}), 400
         
-        db_conn = get_db_connection()
-        cursor = db_conn.cursor(dictionary=True)
-        
-        # Verify location exists and has available slots
-        cursor.execute(
-            """
-            SELECT
-                l.*,
-                (l.max_appointments - COUNT(a.id)) as available_slots
-            FROM locations l
-            LEFT JOIN appointments a ON l.id = a.location_id AND a.appointment_status IN ('confirmed', 'pending')
-            WHERE l.id = %s AND l.is_active = TRUE
-            GROUP BY l.id
-            """,
-            (data.get('location_id'),)
-        )
-        
-        location = cursor.fetchone()
+        # Generate booking reference
+        booking_reference = f"APT-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
         
-        if not location:
-            cursor.close()
-            db_conn.close()
-            return jsonify({'success': False, 'error': 'Location not found'}), 404
+        db_conn = get_request_db()
+        cursor = db_conn.cursor(dictionary=True)
         
-        if location['available_slots'] <= 0:
+        # Take a slot; the location row stays locked until commit
+        try:
+            location = reserve_slot(cursor, data.get('location_id'))
+        except SlotUnavailableError as e:
+            db_conn.rollback()
             cursor.close()
-            db_conn.close()
-            return jsonify({'success': False, 'error': 'No available slots at this location'}), 409
-        
-        # Generate booking reference
-        booking_reference = f"APT-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
+            return jsonify({'success': False, 'error': str(e)}), e.status
         
         # Create appointment
         cursor.execute(
@@ -376,9 +546,10 @@ def book_appointment():
         )
         
         appointment_id = cursor.lastrowid
+        record_metrics(db_conn, upcoming_appointments=1)
         db_conn.commit()
         cursor.close()
-        db_conn.close()
+        mark_availability_stale()
         
         return jsonify({
             'success': True,
@@ -400,7 +571,7 @@ def get_appointment_by_reference(booking_reference):
     Get appointment details by booking reference (public endpoint)
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         cursor.execute(
@@ -423,7 +594,6 @@ def get_appointment_by_reference(booking_reference):
         
         appointment = cursor.fetchone()
         cursor.close()
-        db_conn.close()
         
         if not appointment:
             return jsonify({'success': False, 'error': 'Appointment not found'}), 404
@@ -442,27 +612,19 @@ def cancel_appointment(appointment_id):
     try:
         data = request.get_json() or {}
         
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor()
         
-        # Update appointment status
-        cursor.execute(
-            """
-            UPDATE appointments
-            SET appointment_status = 'cancelled', cancellation_reason = %s, updated_at = %s
-            WHERE id = %s
-            """,
-            (data.get('cancellation_reason', ''), datetime.now(timezone.utc), appointment_id)
-        )
-        
-        if cursor.rowcount == 0:
+        # Update appointment status and release its slot
+        deltas = set_appointment_status(cursor, appointment_id, 'cancelled', data.get('cancellation_reason', ''))
+        if deltas is None:
             cursor.close()
-            db_conn.close()
             return jsonify({'success': False, 'error': 'Appointment not found'}), 404
         
+        record_metrics(db_conn, **deltas)
         db_conn.commit()
         cursor.close()
-        db_conn.close()
+        mark_availability_stale()
         
         return jsonify({
             'success': True,
@@ -478,12 +640,13 @@ def cancel_appointment(appointment_id):
 
 @appointments_bp.route('/stats/today', methods=['GET'])
 @require_auth
+@cached_response(tags=('appointments',))
 def get_today_appointment_stats():
     """
     Get appointment statistics for today
     """
     try:
-        db_conn = get_db_connection()
+        db_conn = get_request_db()
         cursor = db_conn.cursor(dictionary=True)
         
         # Get today's appointment counts
@@ -506,7 +669,6 @@ def get_today_appointment_stats():
         
         stats = cursor.fetchone()
         cursor.close()
-        db_conn.close()
         
         return jsonify({
             'success': True,
@@ -0,0 +1,231 @@
+"""
+POLMED Backend - Appointment Slot Generation
+Expands a route's route_locations into bookable appointment capacity
+
+Every non-cancelled route_location inside the route's start_date..end_date
+is cut into slots of APPOINTMENT_SLOT_MINUTES from its start_time to its
+end_time, at most max_appointments per visit and
+routes.max_appointments_per_day across all visits that day (earliest start
+first). Each visit with at least one slot becomes a bookable locations row
+(route_id, visit_date, the place's name/address/GPS, and
+route_location_id) whose max_appointments is its slot count. That is the
+capacity model booking, cancelling and the availability index already use
+(see appointment_slots.py), so generated visits are listed and bookable
+straight away.
+
+Generation is a diff against the visit rows that already exist, so rerunning
+it after the route's dates or visits change is incremental: missing visits
+are inserted with batched multi-row INSERTs, visits whose capacity, date or
+order changed are updated, and visits that no longer fit the schedule are
+deactivated. Capacity is never cut below the bookings a visit already holds;
+those are reported as booked_outside_schedule. The route row is locked for
+the duration, so two generations of the same route cannot interleave.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from config import Config
+
+VISIT_INSERT_SQL = """
+    INSERT INTO locations (
+        route_id, route_location_id, location_name, location_type, address, province,
+        gps_latitude, gps_longitude, visit_date, visit_sequence, max_appointments,
+        booked_appointments, is_active, created_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0, TRUE, %s)
+"""
+
+VISIT_UPDATE_SQL = """
+    UPDATE locations
+    SET max_appointments = GREATEST(%s, booked_appointments),
+        visit_date = %s, visit_sequence = %s, is_active = TRUE
+    WHERE id = %s
+"""
+
+
+class SlotGenerationError(Exception):
+    """The route cannot be expanded; `status` is the HTTP status to report (404 or 400)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _as_time(value):
+    # TIME columns come back as timedelta; strings are accepted from callers
+    if isinstance(value, timedelta):
+        return value
+    hours, minutes, *seconds = (int(part) for part in str(value).split(':'))
+    return timedelta(hours=hours, minutes=minutes, seconds=seconds[0] if seconds else 0)
+
+
+def plan_slots(route, route_locations, slot_minutes):
+    """
+    Desired slots as {(route_location_id, appointment_date, appointment_time)}
+    for the route's schedule. Pure; no database access.
+    """
+    step = timedelta(minutes=slot_minutes)
+    daily_cap = route.get('max_appointments_per_day')
+    planned = set()
+    per_day = {}
+
+    for rl in _scheduled(route, route_locations):
+        start, end = _as_time(rl['start_time']), _as_time(rl['end_time'])
+        capacity = (end - start) // step
+        if rl.get('max_appointments') is not None:
+            capacity = min(capacity, rl['max_appointments'])
+        if daily_cap is not None:
+            capacity = min(capacity, daily_cap - per_day.get(rl['visit_date'], 0))
+
+        for n in range(max(capacity, 0)):
+            planned.add((rl['id'], rl['visit_date'], start + n * step))
+        per_day[rl['visit_date']] = per_day.get(rl['visit_date'], 0) + max(capacity, 0)
+
+    return planned
+
+
+def plan_visits(route, route_locations, planned):
+    """
+    Bookable visits for planned slots (see plan_slots) as
+    {route_location_id: (capacity, visit_sequence)}; visits without a slot
+    are left out and sequence counts from 1 per day. Pure; no database access.
+    """
+    capacity = Counter(route_location_id for route_location_id, _, _ in planned)
+    visits = {}
+    per_day = {}
+    for rl in _scheduled(route, route_locations):
+        if capacity[rl['id']]:
+            per_day[rl['visit_date']] = per_day.get(rl['visit_date'], 0) + 1
+            visits[rl['id']] = (capacity[rl['id']], per_day[rl['visit_date']])
+    return visits
+
+
+def _scheduled(route, route_locations):
+    return sorted(
+        (rl for rl in route_locations
+         if rl['status'] != 'cancelled' and route['start_date'] <= rl['visit_date'] <= route['end_date']),
+        key=lambda rl: (rl['visit_date'], _as_time(rl['start_time']), rl['id'])
+    )
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def generate_route_slots(db_conn, route_id, slot_minutes=None, batch_size=None):
+    """
+    Bring a route's bookable visits in line with its schedule. Does not
+    commit; call mark_availability_stale() after the caller commits.
+    Returns {route_locations, planned, visits, created, updated, removed,
+    unchanged, booked_outside_schedule}.
+    """
+    slot_minutes = slot_minutes or Config.APPOINTMENT_SLOT_MINUTES
+    batch_size = batch_size or Config.SLOT_INSERT_BATCH_SIZE
+    if slot_minutes < 1:
+        raise SlotGenerationError('slot_minutes must be positive')
+
+    cursor = db_conn.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            """
+            SELECT id, start_date, end_date, max_appointments_per_day
+            FROM routes WHERE id = %s AND is_active = TRUE
+            FOR UPDATE
+            """,
+            (route_id,)
+        )
+        route = cursor.fetchone()
+        if not route:
+            raise SlotGenerationError('Route not found', 404)
+        if route['end_date'] < route['start_date']:
+            raise SlotGenerationError('Route end_date is before start_date')
+
+        cursor.execute(
+            """
+            SELECT rl.id, rl.visit_date, rl.start_time, rl.end_time, rl.max_appointments, rl.status,
+                l.location_name, l.location_type, l.address, l.province, l.gps_latitude, l.gps_longitude
+            FROM route_locations rl
+            JOIN locations l ON l.id = rl.location_id
+            WHERE rl.route_id = %s
+            """,
+            (route_id,)
+        )
+        route_locations = {rl['id']: rl for rl in cursor.fetchall()}
+        planned = plan_slots(route, route_locations.values(), slot_minutes)
+        visits = plan_visits(route, route_locations.values(), planned)
+
+        cursor.execute(
+            """
+            SELECT id, route_location_id, visit_date, visit_sequence, max_appointments,
+                booked_appointments, is_active
+            FROM locations
+            WHERE route_id = %s AND route_location_id IS NOT NULL
+            FOR UPDATE
+            """,
+            (route_id,)
+        )
+        existing = {row['route_location_id']: row for row in cursor.fetchall()}
+
+        updates = []
+        stale_ids = []
+        unchanged = 0
+        booked_outside = 0
+        for route_location_id, row in existing.items():
+            if route_location_id in visits:
+                capacity, sequence = visits[route_location_id]
+                visit_date = route_locations[route_location_id]['visit_date']
+                booked_outside += max(row['booked_appointments'] - capacity, 0)
+                if (row['is_active'] and row['max_appointments'] == max(capacity, row['booked_appointments'])
+                        and row['visit_date'] == visit_date and row['visit_sequence'] == sequence):
+                    unchanged += 1
+                else:
+                    updates.append((capacity, visit_date, sequence, row['id']))
+            elif row['is_active']:
+                stale_ids.append(row['id'])
+                booked_outside += row['booked_appointments']
+
+        if updates:
+            cursor.executemany(VISIT_UPDATE_SQL, updates)
+
+        # Unbooked visits leave the listings; booked ones stay but take no new bookings
+        for ids in _chunks(stale_ids, batch_size):
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(
+                f"UPDATE locations SET is_active = FALSE WHERE id IN ({placeholders}) AND booked_appointments = 0",
+                ids
+            )
+            cursor.execute(
+                f"""
+                UPDATE locations SET max_appointments = booked_appointments
+                WHERE id IN ({placeholders}) AND booked_appointments > 0
+                """,
+                ids
+            )
+
+        # executemany on a plain INSERT ... VALUES is sent as one multi-row INSERT per batch
+        now = datetime.now(timezone.utc)
+        missing = [
+            (route_locations[route_location_id], capacity, sequence)
+            for route_location_id, (capacity, sequence) in visits.items()
+            if route_location_id not in existing
+        ]
+        for rows in _chunks(missing, batch_size):
+            cursor.executemany(VISIT_INSERT_SQL, [
+                (route_id, rl['id'], rl['location_name'], rl['location_type'], rl['address'], rl['province'],
+                 rl['gps_latitude'], rl['gps_longitude'], rl['visit_date'], sequence, capacity, now)
+                for rl, capacity, sequence in rows
+            ])
+    finally:
+        cursor.close()
+
+    return {
+        'route_locations': len(route_locations),
+        'planned': len(planned),
+        'visits': len(visits),
+        'created': len(missing),
+        'updated': len(updates),
+        'removed': len(stale_ids),
+        'unchanged': unchanged,
+        'booked_outside_schedule': booked_outside,
+    }
@@ -0,0 +1,235 @@
+"""
+POLMED Backend - Stock Mutations
+Atomic quantity changes on inventory_stock batches
+
+Quantities are never read into Python and written back. Every change is a
+single conditional UPDATE (quantity_current = quantity_current + delta,
+guarded by quantity_current + delta >= 0), so concurrent adjustments to the
+same batch serialise on the row lock inside MySQL and none are lost, and a
+change that would go negative matches no row instead of being applied.
+
+consumable_stock_levels keeps each consumable's on-hand total across Active
+batches. Every mutation here applies the matching delta to it, and
+re-evaluates the affected low-stock/expiry alerts, in the same transaction,
+so listings and alerts read one row per consumable instead of aggregating
+batches. `python stock.py` rebuilds it from inventory_stock
+(e.g. after batches are expired or recalled by hand) and re-sweeps alerts.
+"""
+
+import sys
+from datetime import datetime, timezone
+
+from inventory_alerts import evaluate_stock_alerts, sweep_alerts
+
+
+class StockAdjustmentError(Exception):
+    """
+    One or more adjustments could not be applied.
+    `failures` lists {stock_id, error, quantity_current} per offending batch.
+    """
+
+    def __init__(self, message, failures):
+        super().__init__(message)
+        self.failures = failures
+
+
+# LAST_INSERT_ID(expr) hands the new quantity back in the OK packet
+# (cursor.lastrowid), so no follow-up SELECT is needed
+ADJUST_ONE_SQL = """
+    UPDATE inventory_stock
+    SET quantity_current = LAST_INSERT_ID(quantity_current + %s), updated_at = %s
+    WHERE id = %s AND status = 'Active' AND quantity_current + %s >= 0
+"""
+
+# On-hand quantity and status for `consumables c LEFT JOIN consumable_stock_levels l`
+ON_HAND_SQL = "COALESCE(l.quantity_on_hand, 0)"
+STOCK_STATUS_SQL = f"""
+    CASE
+        WHEN {ON_HAND_SQL} <= 0 THEN 'out_of_stock'
+        WHEN {ON_HAND_SQL} <= c.reorder_level THEN 'low_stock'
+        ELSE 'in_stock'
+    END
+"""
+
+ADJUSTMENT_LOG_SQL = """
+    INSERT INTO stock_adjustment_log (stock_id, adjustment, reason, adjusted_by_id, adjustment_date)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def _rows(cursor):
+    return [
+        row if isinstance(row, dict) else dict(zip(cursor.column_names, row))
+        for row in cursor.fetchall()
+    ]
+
+
+def _diagnose(cursor, deltas):
+    """Work out why adjustments matched no row (failure path only)"""
+    placeholders = ', '.join(['%s'] * len(deltas))
+    cursor.execute(
+        f"SELECT id, quantity_current FROM inventory_stock WHERE id IN ({placeholders}) AND status = 'Active'",
+        list(deltas)
+    )
+    current = {row['id']: row['quantity_current'] for row in _rows(cursor)}
+
+    failures = []
+    for stock_id, delta in deltas.items():
+        if stock_id not in current:
+            failures.append({'stock_id': stock_id, 'error': 'Stock record not found', 'quantity_current': None})
+        elif current[stock_id] + delta < 0:
+            failures.append({
+                'stock_id': stock_id,
+                'error': f'Adjustment would result in negative stock. Current: {current[stock_id]}',
+                'quantity_current': current[stock_id]
+            })
+    return failures
+
+
+def _apply_level_deltas(cursor, deltas):
+    """Roll {stock_id: delta} up into consumable_stock_levels in one statement"""
+    case = 'CASE id ' + ' '.join(['WHEN %s THEN %s'] * len(deltas)) + ' END'
+    placeholders = ', '.join(['%s'] * len(deltas))
+    cursor.execute(
+        f"""
+        INSERT INTO consumable_stock_levels (consumable_id, quantity_on_hand)
+        SELECT consumable_id, SUM({case}) FROM inventory_stock
+        WHERE id IN ({placeholders})
+        GROUP BY consumable_id
+        ON DUPLICATE KEY UPDATE quantity_on_hand = quantity_on_hand + VALUES(quantity_on_hand)
+        """,
+        [value for item in deltas.items() for value in item] + list(deltas)
+    )
+
+
+def record_receipt(cursor, stock_id, consumable_id, quantity, unit_cost=None):
+    """Add a newly received Active batch to the consumable's on-hand total"""
+    cursor.execute(
+        """
+        INSERT INTO consumable_stock_levels (consumable_id, quantity_on_hand, last_unit_cost)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            quantity_on_hand = quantity_on_hand + VALUES(quantity_on_hand),
+            last_unit_cost = COALESCE(VALUES(last_unit_cost), last_unit_cost)
+        """,
+        (consumable_id, quantity, unit_cost)
+    )
+    evaluate_stock_alerts(cursor, [stock_id])
+
+
+def adjust_stock_quantity(cursor, stock_id, adjustment):
+    """
+    Apply one adjustment in a single statement and return the new quantity.
+    Raises StockAdjustmentError if the batch is missing or would go negative.
+    """
+    cursor.execute(ADJUST_ONE_SQL, (adjustment, datetime.now(timezone.utc), stock_id, adjustment))
+    if cursor.rowcount == 0:
+        failures = _diagnose(cursor, {stock_id: adjustment})
+        message = failures[0]['error'] if failures else 'Stock record changed concurrently, retry'
+        raise StockAdjustmentError(message, failures)
+    new_quantity = cursor.lastrowid or 0
+
+    _apply_level_deltas(cursor, {stock_id: adjustment})
+    evaluate_stock_alerts(cursor, [stock_id])
+    return new_quantity
+
+
+def adjust_stock_quantities(cursor, deltas, count_usage=False):
+    """
+    Apply {stock_id: delta} across many batches in a single UPDATE.
+    All or nothing: if any batch is missing or would go negative, raises
+    StockAdjustmentError and the caller must roll back. Rows are locked in
+    primary key order, so concurrent batch adjustments cannot deadlock on
+    each other. With count_usage, draws are also added to quantity_used.
+    """
+    deltas = {stock_id: delta for stock_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    case = 'CASE id ' + ' '.join(['WHEN %s THEN %s'] * len(deltas)) + ' END'
+    case_params = [value for item in deltas.items() for value in item]
+    placeholders = ', '.join(['%s'] * len(deltas))
+
+    usage = ''
+    usage_params = []
+    if count_usage:
+        usage = f", quantity_used = COALESCE(quantity_used, 0) - LEAST({case}, 0)"
+        usage_params = case_params
+
+    cursor.execute(
+        f"""
+        UPDATE inventory_stock
+        SET quantity_current = quantity_current + {case}{usage}, updated_at = %s
+        WHERE id IN ({placeholders}) AND status = 'Active' AND quantity_current + {case} >= 0
+        """,
+        case_params + usage_params + [datetime.now(timezone.utc)] + list(deltas) + case_params
+    )
+    if cursor.rowcount != len(deltas):
+        failures = _diagnose(cursor, deltas)
+        if not failures:
+            message = 'Stock records changed concurrently, retry'
+        elif len(failures) == 1:
+            message = failures[0]['error']
+        else:
+            message = f'{len(failures)} adjustments could not be applied'
+        raise StockAdjustmentError(message, failures)
+
+    _apply_level_deltas(cursor, deltas)
+    evaluate_stock_alerts(cursor, deltas)
+
+
+def log_stock_adjustments(cursor, entries, user_id):
+    """Write stock_adjustment_log rows for [(stock_id, adjustment, reason)] in one round trip"""
+    now = datetime.now(timezone.utc)
+    rows = [(stock_id, adjustment, reason, user_id, now) for stock_id, adjustment, reason in entries]
+    if len(rows) == 1:
+        cursor.execute(ADJUSTMENT_LOG_SQL, rows[0])
+    elif rows:
+        cursor.executemany(ADJUSTMENT_LOG_SQL, rows)
+
+
+def refresh_stock_levels(db_conn):
+    """Recompute consumable_stock_levels from the Active batches. Does not commit."""
+    cursor = db_conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO consumable_stock_levels (consumable_id, quantity_on_hand, last_unit_cost, refreshed_at)
+        SELECT
+            c.id,
+            COALESCE((
+                SELECT SUM(s.quantity_current) FROM inventory_stock s
+                WHERE s.consumable_id = c.id AND s.status = 'Active'
+            ), 0),
+            (
+                SELECT s.unit_cost FROM inventory_stock s
+                WHERE s.consumable_id = c.id
+                ORDER BY s.received_date DESC, s.id DESC
+                LIMIT 1
+            ),
+            NOW()
+        FROM consumables c
+        ON DUPLICATE KEY UPDATE
+            quantity_on_hand = VALUES(quantity_on_hand),
+            last_unit_cost = VALUES(last_unit_cost),
+            refreshed_at = VALUES(refreshed_at)
+        """
+    )
+    count = cursor.rowcount
+    cursor.close()
+    return count
+
+
+if __name__ == '__main__':
+    from database import get_db_connection, close_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    try:
+        refresh_stock_levels(conn)
+        sweep_alerts(conn)
+        conn.commit()
+        print("Rebuilt consumable_stock_levels and swept inventory_alerts")
+    finally:
+        close_db_connection(conn)
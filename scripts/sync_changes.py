@@ -0,0 +1,148 @@
+"""
+POLMED Backend - Incremental Sync Feed
+Delta pull of reference and clinical data for offline tablets
+
+Each entity is read in (updated_at, id) order from a per-entity watermark
+carried in an opaque continuation token. Deactivated rows (is_active =
+FALSE) are returned as tombstones. Rows modified in the last
+SYNC_CHANGES_SAFETY_LAG seconds are held back until the next pull, so
+transactions that commit late with an older updated_at are not skipped.
+"""
+
+import base64
+import json
+
+from config import Config
+from pagination import Keyset
+from responses import columnar, to_json_value
+
+
+class SyncEntity:
+    """A table exposed through the changes feed"""
+
+    def __init__(self, name, from_clause, route_scope=None, province_scope=None, soft_delete=True):
+        self.name = name
+        self.from_clause = from_clause
+        self.route_scope = route_scope
+        self.province_scope = province_scope
+        self.soft_delete = soft_delete
+        self.keyset = Keyset(f'sync_{name}', ('t.updated_at', 't.id'))
+
+
+# Order matters: parents before children so a device can apply batches in sequence
+ENTITIES = [
+    SyncEntity('routes', 'routes t',
+               route_scope='t.id = %s', province_scope='t.province = %s'),
+    SyncEntity('locations', 'locations t',
+               route_scope='t.route_id = %s', province_scope='t.province = %s'),
+    SyncEntity('consumables', 'consumables t'),
+    SyncEntity('patients', 'patients t',
+               route_scope='t.province = (SELECT province FROM routes WHERE id = %s)',
+               province_scope='t.province = %s'),
+    SyncEntity('appointments', 'appointments t JOIN locations l ON t.location_id = l.id',
+               route_scope='l.route_id = %s', province_scope='l.province = %s', soft_delete=False),
+]
+
+
+def scope_key(route_id=None, province=None):
+    if route_id:
+        return f'route:{route_id}'
+    if province:
+        return f'province:{province}'
+    return 'all'
+
+
+def encode_token(scope, watermarks):
+    payload = json.dumps({'s': scope, 'w': watermarks}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_token(token, scope):
+    """Decode a continuation token, raising ValueError if malformed or for another scope"""
+    if not token:
+        return {}
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise ValueError('Invalid sync token')
+
+    if payload.get('s') != scope or not isinstance(payload.get('w'), dict):
+        raise ValueError('Sync token does not match the requested scope')
+    return payload['w']
+
+
+def fetch_changes(cursor, since=None, route_id=None, province=None, limit=None):
+    """
+    Read the next batch of changes.
+    Returns {'changes': {...}, 'next_token': str, 'has_more': bool}; keep
+    pulling with next_token until has_more is false, then store the token
+    for the next reconnect.
+    """
+    limit = limit or Config.SYNC_BATCH_SIZE
+    scope = scope_key(route_id, province)
+    watermarks = decode_token(since, scope)
+
+    cursor.execute(
+        "SELECT NOW() - INTERVAL %s SECOND AS cutoff",
+        (Config.SYNC_CHANGES_SAFETY_LAG,)
+    )
+    cutoff = cursor.fetchone()['cutoff']
+
+    changes = {}
+    remaining = limit
+    has_more = False
+
+    for entity in ENTITIES:
+        if remaining <= 0:
+            has_more = True
+            break
+
+        query = f"SELECT t.* FROM {entity.from_clause} WHERE t.updated_at <= %s"
+        params = [cutoff]
+
+        if route_id and entity.route_scope:
+            query += f" AND {entity.route_scope}"
+            params.append(route_id)
+        elif province and entity.province_scope:
+            query += f" AND {entity.province_scope}"
+            params.append(province)
+
+        watermark = watermarks.get(entity.name)
+        if watermark:
+            clause, seek_params = entity.keyset.seek_clause(watermark)
+            query += f" AND {clause}"
+            params += seek_params
+
+        query += f" ORDER BY {entity.keyset.order_by()} LIMIT %s"
+        cursor.execute(query, params + [remaining + 1])
+        rows = cursor.fetchall()
+
+        if len(rows) > remaining:
+            rows = rows[:remaining]
+            has_more = True
+
+        if not rows:
+            continue
+
+        last = rows[-1]
+        watermarks[entity.name] = [str(last['updated_at']), last['id']]
+        remaining -= len(rows)
+
+        if entity.soft_delete:
+            live = [row for row in rows if row.get('is_active', True)]
+            deleted = [row['id'] for row in rows if not row.get('is_active', True)]
+        else:
+            live, deleted = rows, []
+
+        changes[entity.name] = {**columnar(live), 'deleted': deleted}
+
+        if has_more:
+            break
+
+    return {
+        'changes': changes,
+        'next_token': encode_token(scope, watermarks),
+        'has_more': has_more,
+        'cutoff': to_json_value(cutoff)
+    }
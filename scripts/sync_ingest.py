@@ -0,0 +1,330 @@
+"""
+POLMED Backend - Offline Sync Ingest
+Applies queued offline operations from field devices in batched transactions
+
+Records are applied in chunks of SYNC_BATCH_SIZE, one transaction per chunk.
+Each record runs inside its own SAVEPOINT so a bad record is rejected
+without discarding the rest of the chunk. (device_id, operation_id) pairs are
+recorded in sync_operations, so a device that retries after a dropped
+response gets `duplicate` results instead of double-applied writes.
+"""
+
+import logging
+import math
+from datetime import datetime, timezone
+
+import mysql.connector
+
+from audit import log_action
+from config import Config
+from dashboard_metrics import record_metrics
+from stock import adjust_stock_quantity, log_stock_adjustments, StockAdjustmentError
+from appointment_slots import set_appointment_status
+from patient_routes import (
+    PATIENT_INSERT_SQL, PATIENT_REQUIRED_FIELDS, patient_insert_values, build_patient_update
+)
+
+CLINICAL_ROLES = ('doctor', 'nurse', 'clerk', 'administrator')
+STOCK_ROLES = ('inventory_manager', 'administrator', 'nurse')
+
+APPLIED = 'applied'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+RETRY = 'retry'
+
+logger = logging.getLogger(__name__)
+
+
+class SyncRecordError(Exception):
+    """A queued operation that cannot be applied (reported per record)"""
+
+
+def _create_patient(cursor, record, user_id):
+    data = record['data']
+    for field in PATIENT_REQUIRED_FIELDS:
+        if not data.get(field):
+            raise SyncRecordError(f'{field} is required')
+
+    values = patient_insert_values(data, user_id)
+    if values[6]:
+        cursor.execute(
+            "SELECT id FROM patients WHERE medical_aid_number = %s AND is_active = TRUE",
+            (values[6],)
+        )
+        existing = cursor.fetchone()
+        if existing:
+            raise SyncRecordError(f'Patient with this medical aid number already exists (id {existing[0]})')
+
+    cursor.execute(PATIENT_INSERT_SQL, values)
+    return cursor.lastrowid
+
+
+def _update_patient(cursor, record, user_id):
+    patient_id = _server_id(record)
+    set_clause, params = build_patient_update(record['data'])
+    if not set_clause:
+        raise SyncRecordError('No valid fields to update')
+
+    cursor.execute(
+        f"UPDATE patients SET {set_clause} WHERE id = %s AND is_active = TRUE",
+        params + [patient_id]
+    )
+    if cursor.rowcount == 0:
+        raise SyncRecordError('Patient not found')
+    return patient_id
+
+
+def _deactivate_patient(cursor, record, user_id):
+    patient_id = _server_id(record)
+    cursor.execute(
+        "UPDATE patients SET is_active = FALSE, updated_at = %s WHERE id = %s AND is_active = TRUE",
+        (datetime.now(timezone.utc), patient_id)
+    )
+    if cursor.rowcount == 0:
+        raise SyncRecordError('Patient not found')
+    return patient_id
+
+
+def _update_appointment(cursor, record, user_id):
+    appointment_id = _server_id(record)
+    status = record['data'].get('appointment_status') or record['data'].get('status')
+    if status not in ('confirmed', 'pending', 'completed', 'cancelled', 'no_show'):
+        raise SyncRecordError('Invalid appointment status')
+
+    deltas = set_appointment_status(cursor, appointment_id, status, record['data'].get('cancellation_reason', ''))
+    if deltas is None:
+        raise SyncRecordError('Appointment not found')
+    record['metric_deltas'] = deltas
+    return appointment_id
+
+
+def _adjust_stock(cursor, record, user_id):
+    data = record['data']
+    try:
+        stock_id = int(data.get('stock_id') or record['record_id'])
+        adjustment = int(data.get('adjustment'))
+    except (TypeError, ValueError):
+        raise SyncRecordError('stock_id and integer adjustment are required')
+    if adjustment == 0:
+        raise SyncRecordError('adjustment cannot be zero')
+
+    try:
+        adjust_stock_quantity(cursor, stock_id, adjustment)
+    except StockAdjustmentError as e:
+        raise SyncRecordError(str(e))
+
+    log_stock_adjustments(cursor, [(stock_id, adjustment, data.get('reason', 'offline sync'))], user_id)
+    return stock_id
+
+
+# (table_name, operation_type) -> dashboard metric deltas for an applied record
+# (appliers whose deltas depend on the change set record['metric_deltas'])
+METRIC_DELTAS = {
+    ('patient', 'create'): {'new_patients': 1, 'total_patients': 1},
+    ('patient', 'delete'): {'total_patients': -1},
+    ('inventory', 'update'): {'stock_adjustments': 1},
+}
+
+# (table_name, operation_type) -> (applier, allowed roles)
+APPLIERS = {
+    ('patient', 'create'): (_create_patient, CLINICAL_ROLES),
+    ('patient', 'update'): (_update_patient, CLINICAL_ROLES),
+    ('patient', 'delete'): (_deactivate_patient, ('doctor', 'administrator')),
+    ('appointment', 'update'): (_update_appointment, CLINICAL_ROLES),
+    ('inventory', 'update'): (_adjust_stock, STOCK_ROLES),
+}
+
+
+def _server_id(record):
+    try:
+        return int(record['record_id'])
+    except (TypeError, ValueError):
+        raise SyncRecordError('record_id must be a server id for updates')
+
+
+def _table_key(table_name):
+    """Accept both singular and plural table names from the client"""
+    table_name = (table_name or '').lower()
+    return table_name[:-1] if table_name.endswith('s') else table_name
+
+
+def _parse_timestamp(value):
+    """
+    Device timestamp as epoch seconds: a number (seconds, or milliseconds
+    if it is too large to be seconds) or an ISO 8601 string (UTC if no
+    offset). Missing timestamps sort first. Raises ValueError otherwise.
+    """
+    if value is None or value == '':
+        return 0.0
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(value)
+        return value / 1000 if value > 1e11 else value
+    parsed = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def normalise_records(records):
+    """
+    Validate envelope fields and order records by device timestamp.
+    Returns (valid_records, rejected_results).
+    """
+    valid = []
+    rejected = []
+
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            rejected.append({'index': index, 'status': REJECTED, 'error': 'Record must be an object'})
+            continue
+
+        operation_id = record.get('operation_id') or record.get('id')
+        if not operation_id:
+            rejected.append({'index': index, 'status': REJECTED, 'error': 'operation_id is required'})
+            continue
+
+        data = record.get('data')
+        if data is not None and not isinstance(data, dict):
+            rejected.append({
+                'index': index, 'operation_id': str(operation_id)[:100], 'status': REJECTED,
+                'error': 'data must be an object'
+            })
+            continue
+
+        try:
+            timestamp = _parse_timestamp(record.get('timestamp'))
+        except (TypeError, ValueError):
+            rejected.append({
+                'index': index, 'operation_id': str(operation_id)[:100], 'status': REJECTED,
+                'error': 'timestamp must be epoch seconds/milliseconds or an ISO 8601 date-time'
+            })
+            continue
+
+        valid.append({
+            'index': index,
+            'operation_id': str(operation_id)[:100],
+            'table_name': _table_key(record.get('table_name')),
+            'operation_type': (record.get('operation_type') or '').lower(),
+            'record_id': record.get('record_id'),
+            'data': data or {},
+            'timestamp': timestamp,
+        })
+
+    valid.sort(key=lambda r: (r['timestamp'], r['index']))
+    return valid, rejected
+
+
+def _existing_operations(cursor, device_id, chunk):
+    """Look up already-applied operation ids for a chunk in one query"""
+    placeholders = ', '.join(['%s'] * len(chunk))
+    cursor.execute(
+        f"""
+        SELECT operation_id, result_id FROM sync_operations
+        WHERE device_id = %s AND operation_id IN ({placeholders})
+        """,
+        [device_id] + [r['operation_id'] for r in chunk]
+    )
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def _apply_chunk(db_conn, device_id, chunk, user_id, user_role):
+    cursor = db_conn.cursor()
+    results = []
+    applied_rows = []
+    now = datetime.now(timezone.utc)
+
+    existing = _existing_operations(cursor, device_id, chunk)
+    seen = set()
+
+    for record in chunk:
+        result = {'index': record['index'], 'operation_id': record['operation_id']}
+        results.append(result)
+
+        if record['operation_id'] in existing or record['operation_id'] in seen:
+            result.update(status=DUPLICATE, record_id=existing.get(record['operation_id']))
+            continue
+        seen.add(record['operation_id'])
+
+        entry = APPLIERS.get((record['table_name'], record['operation_type']))
+        if not entry:
+            result.update(status=REJECTED, error=f"Unsupported operation {record['operation_type']} on {record['table_name']}")
+            continue
+
+        applier, roles = entry
+        if user_role not in roles:
+            result.update(status=REJECTED, error='User role does not have permission for this operation')
+            continue
+
+        cursor.execute("SAVEPOINT sync_record")
+        try:
+            result_id = applier(cursor, record, user_id)
+        except (SyncRecordError, mysql.connector.Error) as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT sync_record")
+            result.update(status=REJECTED, error=str(e))
+            continue
+        except Exception as e:
+            # Malformed field values the appliers did not anticipate - reject the
+            # record, keep the rest of the chunk
+            logger.exception(f"Sync record {record['operation_id']} from {device_id} failed")
+            cursor.execute("ROLLBACK TO SAVEPOINT sync_record")
+            result.update(status=REJECTED, error=f'Invalid record: {e}')
+            continue
+
+        cursor.execute("RELEASE SAVEPOINT sync_record")
+        result.update(status=APPLIED, record_id=result_id)
+        applied_rows.append((
+            device_id, record['operation_id'], record['table_name'],
+            record['operation_type'], result_id, user_id, now
+        ))
+        log_action(
+            db_conn, f"SYNC_{record['operation_type'].upper()}", record['table_name'], result_id,
+            {'device_id': device_id, 'operation_id': record['operation_id']}, user_id=user_id
+        )
+        deltas = record.get('metric_deltas') or METRIC_DELTAS.get((record['table_name'], record['operation_type']))
+        if deltas:
+            record_metrics(db_conn, **deltas)
+
+    if applied_rows:
+        # Multi-row insert - one round trip per chunk (audit rows go with the commit)
+        cursor.executemany(
+            """
+            INSERT INTO sync_operations (
+                device_id, operation_id, table_name, operation_type, result_id, applied_by, applied_at
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            applied_rows
+        )
+
+    cursor.close()
+    return results
+
+
+def apply_records(db_conn, device_id, records, user_id, user_role, batch_size=None):
+    """
+    Apply queued records in chunks, committing once per chunk.
+    Returns per-record results in the order the records were submitted.
+    """
+    batch_size = batch_size or Config.SYNC_BATCH_SIZE
+    valid, results = normalise_records(records)
+
+    for start in range(0, len(valid), batch_size):
+        chunk = valid[start:start + batch_size]
+        try:
+            results.extend(_apply_chunk(db_conn, device_id, chunk, user_id, user_role))
+            db_conn.commit()
+        except mysql.connector.IntegrityError:
+            # Another request from the same device claimed one of these
+            # operation ids concurrently - let the device retry the chunk
+            db_conn.rollback()
+            results.extend(
+                {'index': r['index'], 'operation_id': r['operation_id'], 'status': RETRY,
+                 'error': 'Concurrent sync in progress for this device'}
+                for r in chunk
+            )
+
+    results.sort(key=lambda r: r['index'])
+    return results
@@ -0,0 +1,47 @@
+"""
+Unit tests for FEFO dispensing allocation (no database or server needed)
+Run from scripts/: python -m pytest test_dispensing.py
+"""
+
+from datetime import date
+
+from dispensing import _allocate
+
+TODAY = date(2026, 6, 1)
+
+
+def test_draws_earliest_expiry_first_across_batches():
+    batches = {1: [(10, date(2026, 7, 1)), (11, date(2026, 8, 1)), (12, None)]}
+    draws, shortages = _allocate({1: 25}, batches, {10: 10, 11: 10, 12: 10}, TODAY)
+    assert draws == [(1, 10, 10, date(2026, 7, 1)), (1, 11, 10, date(2026, 8, 1)), (1, 12, 5, None)]
+    assert shortages == []
+
+
+def test_stops_once_request_is_filled():
+    batches = {1: [(10, date(2026, 7, 1)), (11, date(2026, 8, 1))]}
+    draws, _ = _allocate({1: 4}, batches, {10: 10, 11: 10}, TODAY)
+    assert draws == [(1, 10, 4, date(2026, 7, 1))]
+
+
+def test_skips_expired_and_empty_batches():
+    batches = {1: [(10, date(2026, 5, 31)), (11, date(2026, 6, 1)), (12, date(2026, 9, 1))]}
+    draws, shortages = _allocate({1: 3}, batches, {10: 50, 11: 0, 12: 5}, TODAY)
+    # Expiring today is still dispensable, but batch 11 is empty
+    assert draws == [(1, 12, 3, date(2026, 9, 1))]
+    assert shortages == []
+
+
+def test_reports_shortage_with_partial_draws():
+    batches = {1: [(10, date(2026, 7, 1))], 2: []}
+    draws, shortages = _allocate({1: 8, 2: 1}, batches, {10: 5}, TODAY)
+    assert draws == [(1, 10, 5, date(2026, 7, 1))]
+    assert shortages == [
+        {'consumable_id': 1, 'requested': 8, 'available': 5},
+        {'consumable_id': 2, 'requested': 1, 'available': 0},
+    ]
+
+
+def test_does_not_modify_locked_quantities():
+    quantities = {10: 5}
+    _allocate({1: 5}, {1: [(10, None)]}, quantities, TODAY)
+    assert quantities == {10: 5}
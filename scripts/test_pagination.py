@@ -0,0 +1,71 @@
+"""
+Unit tests for keyset pagination (no database or server needed)
+Run from scripts/: python -m pytest test_pagination.py
+"""
+
+from datetime import datetime
+
+import pytest
+
+from pagination import Keyset, PageRequest
+
+PATIENTS = Keyset('patients', ('created_at', 'id'), descending=True)
+
+
+def test_encode_decode_round_trip():
+    token = PATIENTS.encode({'created_at': datetime(2026, 3, 4, 5, 6, 7), 'id': 42})
+    assert '=' not in token
+    assert PATIENTS.decode(token) == ['2026-03-04 05:06:07', 42]
+
+
+def test_encode_uses_last_part_of_qualified_columns():
+    keyset = Keyset('visits', ('v.visit_date', 'v.id'))
+    token = keyset.encode({'visit_date': datetime(2026, 1, 2), 'id': 7})
+    assert keyset.decode(token) == ['2026-01-02 00:00:00', 7]
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', 'e30', 'eyJrIjoicGF0aWVudHMiLCJ2IjpbMV19'])
+def test_decode_rejects_malformed_tokens(token):
+    # e30 = {}; the last one is a patients token with one value instead of two
+    with pytest.raises(ValueError):
+        PATIENTS.decode(token)
+
+
+def test_decode_rejects_tokens_for_another_listing():
+    token = Keyset('visits', ('created_at', 'id')).encode({'created_at': None, 'id': 1})
+    with pytest.raises(ValueError):
+        PATIENTS.decode(token)
+
+
+def test_seek_clause_descending():
+    clause, params = PATIENTS.seek_clause(['2026-03-04 05:06:07', 42])
+    assert clause == '(created_at < %s OR (created_at = %s AND id < %s))'
+    assert params == ['2026-03-04 05:06:07', '2026-03-04 05:06:07', 42]
+
+
+def test_seek_clause_ascending_three_columns():
+    keyset = Keyset('stock', ('expiry_date', 'received_date', 'id'))
+    clause, params = keyset.seek_clause(['a', 'b', 3])
+    assert clause == (
+        '(expiry_date > %s OR (expiry_date = %s AND received_date > %s)'
+        ' OR (expiry_date = %s AND received_date = %s AND id > %s))'
+    )
+    assert params == ['a', 'a', 'b', 'a', 'b', 3]
+
+
+def test_order_by():
+    assert PATIENTS.order_by() == 'created_at DESC, id DESC'
+
+
+def test_page_request_cursor_mode_defaults_to_no_total():
+    page_req = PageRequest.from_args({'after': ' abc '})
+    assert page_req.cursor_mode
+    assert page_req.after == 'abc'
+    assert page_req.include_total == 'false'
+
+
+def test_page_request_rejects_invalid_values():
+    with pytest.raises(ValueError):
+        PageRequest.from_args({'page': '0'})
+    with pytest.raises(ValueError):
+        PageRequest.from_args({'include_total': 'maybe'})
@@ -0,0 +1,76 @@
+"""
+Unit tests for reorder demand projection (no database or server needed)
+Run from scripts/: python -m pytest test_reorder_forecast.py
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from reorder_forecast import project_demand, suggest_quantities
+
+TODAY = date(2026, 6, 11)
+HISTORY_DAYS = 10
+HORIZON_DAYS = 5
+
+CONSUMABLES = [
+    {'id': 1, 'quantity_on_hand': 10, 'reorder_level': 4, 'max_stock_level': 15},
+    {'id': 2, 'quantity_on_hand': 3, 'reorder_level': 5, 'max_stock_level': 100},
+    {'id': 3, 'quantity_on_hand': 100, 'reorder_level': None, 'max_stock_level': None},
+]
+
+
+def day(offset):
+    return TODAY + timedelta(days=offset)
+
+
+USAGE = [
+    # Walk-in use of consumable 1: 20 over the window = 2 per day
+    {'consumable_id': 1, 'route_id': None, 'usage_date': day(-10), 'quantity': 12},
+    {'consumable_id': 1, 'route_id': None, 'usage_date': day(-1), 'quantity': 8},
+    # Route 5 use of consumable 1: 30 over 3 past visits = 10 per visit
+    {'consumable_id': 1, 'route_id': 5, 'usage_date': day(-5), 'quantity': 30},
+    # Route 6 has no visits to rate by, so its use counts per day
+    {'consumable_id': 3, 'route_id': 6, 'usage_date': day(-3), 'quantity': 10},
+    # Inactive consumable
+    {'consumable_id': 99, 'route_id': None, 'usage_date': day(-2), 'quantity': 500},
+]
+
+VISITS = [
+    {'route_id': 5, 'visit_date': day(-7), 'visits': 2},
+    {'route_id': 5, 'visit_date': day(-5), 'visits': 1},
+    {'route_id': 5, 'visit_date': day(2), 'visits': 1},
+]
+
+
+@pytest.fixture
+def projection():
+    return project_demand(CONSUMABLES, USAGE, VISITS, HISTORY_DAYS, HORIZON_DAYS, TODAY)
+
+
+def test_rates(projection):
+    assert projection['route_ids'] == [5, 6]
+    assert projection['daily_rate'].tolist() == [5.0, 0.0, 1.0]
+    # History is shorter than RECENT_DAYS, so the recent rate covers the same window
+    assert projection['recent_rate'].tolist() == [5.0, 0.0, 1.0]
+    assert projection['route_rate'].tolist() == [[10.0, 0.0], [0.0, 0.0], [0.0, 0.0]]
+
+
+def test_projection_follows_route_schedule(projection):
+    # Consumable 1: 2/day plus 10 on the route visit two days out
+    assert projection['horizon_demand'].tolist() == [20.0, 0.0, 5.0]
+    assert projection['stockout_day'].tolist() == [2, -1, -1]
+
+
+def test_suggest_quantities(projection):
+    # 1: projected to run out, topped up to max_stock_level; 2: below its
+    # reorder level; 3: lasts the horizon
+    assert suggest_quantities(CONSUMABLES, projection).tolist() == [5, 2, 0]
+
+
+def test_no_history():
+    projection = project_demand(CONSUMABLES[:1], [], [], HISTORY_DAYS, HORIZON_DAYS, TODAY)
+    assert projection['route_ids'] == []
+    assert projection['horizon_demand'].tolist() == [0.0]
+    assert projection['stockout_day'].tolist() == [-1]
+    assert suggest_quantities(CONSUMABLES[:1], projection).tolist() == [0]
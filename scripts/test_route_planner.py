@@ -0,0 +1,133 @@
+"""
+Unit tests for the route planner and slot generation plan (no database or server needed)
+Run from scripts/: python -m pytest test_route_planner.py
+"""
+
+import itertools
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from route_planner import (
+    haversine_matrix, improve, nearest_neighbour, or_opt, plan_route, split_days, tour_length, two_opt
+)
+from slot_generator import plan_slots, plan_visits
+
+# Stops along a line of latitude, listed out of order
+LINE = [0.0, 0.4, 0.1, 0.3, 0.2, 0.5]
+
+
+def line_matrix(points):
+    return haversine_matrix([0.0] * len(points), points)
+
+
+def test_haversine_matrix():
+    dist = haversine_matrix([-26.2041, -33.9249], [28.0473, 18.4241])
+    assert dist[0, 0] == 0
+    assert dist[0, 1] == dist[1, 0]
+    # Johannesburg to Cape Town
+    assert dist[0, 1] == pytest.approx(1262, abs=5)
+
+
+def test_nearest_neighbour_visits_every_node_once():
+    tour = nearest_neighbour(line_matrix(LINE))
+    assert tour == [0, 2, 4, 3, 1, 5]
+
+
+def test_two_opt_untangles_crossing():
+    dist = line_matrix(LINE)
+    tangled = [0, 3, 2, 4, 1, 5]
+    tour = two_opt(tangled, dist)
+    assert tour[0] == 0
+    assert sorted(tour) == list(range(len(LINE)))
+    assert tour_length(tour, dist) < tour_length(tangled, dist)
+
+
+def test_or_opt_moves_misplaced_stop():
+    dist = line_matrix(LINE)
+    misplaced = [0, 5, 2, 4, 3, 1]
+    tour = or_opt(misplaced, dist)
+    assert tour[0] == 0
+    assert sorted(tour) == list(range(len(LINE)))
+    assert tour_length(tour, dist) < tour_length(misplaced, dist)
+
+
+def test_improve_finds_optimal_small_tour():
+    rng = np.random.default_rng(7)
+    dist = haversine_matrix(rng.uniform(-27, -25, 7), rng.uniform(27, 29, 7))
+    best = min(tour_length([0, *rest], dist) for rest in itertools.permutations(range(1, 7)))
+    tour = improve(nearest_neighbour(dist), dist)
+    assert tour_length(tour, dist) == pytest.approx(best)
+
+
+def test_split_days_respects_time_and_capacity():
+    travel = np.zeros((5, 5))
+    # Four 60-minute visits, 150 minutes a day: two per day
+    days, unfit = split_days([0, 1, 2, 3, 4], travel, 150, 60, 10, None, closed=False)
+    assert days == [[1, 2], [3, 4]]
+    assert unfit == []
+    # Capacity of 10 appointments a day: one visit per day
+    days, _ = split_days([0, 1, 2, 3, 4], travel, 600, 60, 10, 10, closed=False)
+    assert days == [[1], [2], [3], [4]]
+    # A visit longer than the day cannot be scheduled at all
+    days, unfit = split_days([0, 1], travel, 30, 60, 10, None, closed=False)
+    assert (days, unfit) == ([], [1])
+
+
+def test_plan_route():
+    stops = [
+        {'id': 100 + i, 'location_name': f'Stop {i}', 'gps_latitude': 0.0, 'gps_longitude': lng}
+        for i, lng in enumerate(LINE)
+    ]
+    stops.append({'id': 200, 'location_name': 'No GPS', 'gps_latitude': None, 'gps_longitude': None})
+
+    # Friday to Monday, skipping the weekend: two working days, three stops a day
+    plan = plan_route(
+        stops, date(2026, 1, 2), date(2026, 1, 5), '08:00', '17:00',
+        visit_minutes=120, appointments_per_visit=10, daily_capacity=30
+    )
+    assert [day['visit_date'] for day in plan['days']] == [date(2026, 1, 2), date(2026, 1, 5)]
+    visits = [visit for day in plan['days'] for visit in day['visits']]
+    assert len(visits) == 6
+    assert {v['location_id'] for v in visits} == {100 + i for i in range(len(LINE))}
+    assert plan['days'][0]['visits'][0]['start_time'] == '08:00:00'
+    assert plan['days'][0]['visits'][0]['end_time'] == '10:00:00'
+    assert plan['unscheduled'] == [{'location_id': 200, 'reason': 'missing_coordinates'}]
+
+    # One working day: the second day's stops are left over
+    plan = plan_route(
+        stops, date(2026, 1, 2), date(2026, 1, 4), '08:00', '17:00',
+        visit_minutes=120, appointments_per_visit=10, daily_capacity=30
+    )
+    assert sum(u['reason'] == 'no_day_left' for u in plan['unscheduled']) == 3
+
+
+# ============================================================================
+# SLOT GENERATION PLAN
+# ============================================================================
+
+def test_plan_slots_and_visits():
+    route = {'start_date': date(2026, 2, 2), 'end_date': date(2026, 2, 3), 'max_appointments_per_day': 10}
+    route_locations = [
+        # 4 hours of 30-minute slots = 8
+        {'id': 1, 'visit_date': date(2026, 2, 2), 'start_time': timedelta(hours=8),
+         'end_time': timedelta(hours=12), 'max_appointments': 20, 'status': 'scheduled'},
+        # 4 more would fit, but the day's cap leaves 2
+        {'id': 2, 'visit_date': date(2026, 2, 2), 'start_time': '13:00',
+         'end_time': '15:00', 'max_appointments': 20, 'status': 'scheduled'},
+        # Capped by its own max_appointments
+        {'id': 3, 'visit_date': date(2026, 2, 3), 'start_time': '08:00',
+         'end_time': '12:00', 'max_appointments': 3, 'status': 'scheduled'},
+        {'id': 4, 'visit_date': date(2026, 2, 3), 'start_time': '13:00',
+         'end_time': '15:00', 'max_appointments': 20, 'status': 'cancelled'},
+        # Outside the route's dates
+        {'id': 5, 'visit_date': date(2026, 2, 4), 'start_time': '08:00',
+         'end_time': '12:00', 'max_appointments': 20, 'status': 'scheduled'},
+    ]
+    planned = plan_slots(route, route_locations, 30)
+    assert len(planned) == 13
+    assert (2, date(2026, 2, 2), timedelta(hours=13, minutes=30)) in planned
+    assert (2, date(2026, 2, 2), timedelta(hours=14)) not in planned
+
+    assert plan_visits(route, route_locations, planned) == {1: (8, 1), 2: (2, 2), 3: (3, 1)}
@@ -0,0 +1,96 @@
+"""
+Unit tests for sync record and patient import validation (no database or server needed)
+Run from scripts/: python -m pytest test_validation.py
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from patient_import import ID_NUMBER, ImportRowError, normalise_row
+from sync_ingest import REJECTED, _parse_timestamp, normalise_records
+
+PATIENT = {
+    'first_name': ' Thandi ',
+    'last_name': 'Mokoena',
+    'date_of_birth': '1990-04-12',
+    'gender': 'female',
+    'phone_number': 821234567,
+}
+
+
+# ============================================================================
+# SYNC RECORDS
+# ============================================================================
+
+def test_parse_timestamp_formats():
+    epoch = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc).timestamp()
+    assert _parse_timestamp(epoch) == epoch
+    assert _parse_timestamp(epoch * 1000) == epoch
+    assert _parse_timestamp('2026-01-02T03:04:05Z') == epoch
+    assert _parse_timestamp('2026-01-02T05:04:05+02:00') == epoch
+    assert _parse_timestamp('2026-01-02 03:04:05') == epoch
+    assert _parse_timestamp(None) == 0.0
+
+
+@pytest.mark.parametrize('value', [True, float('nan'), float('inf'), 'yesterday'])
+def test_parse_timestamp_rejects(value):
+    with pytest.raises(ValueError):
+        _parse_timestamp(value)
+
+
+def test_normalise_records_orders_by_timestamp_then_index():
+    valid, rejected = normalise_records([
+        {'operation_id': 'c', 'table_name': 'Patients', 'operation_type': 'UPDATE', 'timestamp': 30},
+        {'operation_id': 'a', 'table_name': 'patient', 'operation_type': 'create', 'timestamp': 10},
+        {'operation_id': 'b', 'table_name': 'patients', 'operation_type': 'create', 'timestamp': 10},
+    ])
+    assert rejected == []
+    assert [r['operation_id'] for r in valid] == ['a', 'b', 'c']
+    assert {r['table_name'] for r in valid} == {'patient'}
+    assert valid[2]['operation_type'] == 'update'
+    assert valid[0]['data'] == {}
+
+
+def test_normalise_records_rejects_per_record():
+    valid, rejected = normalise_records([
+        'not a record',
+        {'table_name': 'patients'},
+        {'operation_id': 'list-data', 'data': [1, 2]},
+        {'operation_id': 'bad-time', 'timestamp': 'soon'},
+        {'id': 'ok', 'data': {'first_name': 'A'}},
+    ])
+    assert [r['operation_id'] for r in valid] == ['ok']
+    assert [(r['index'], r.get('operation_id')) for r in rejected] == [
+        (0, None), (1, None), (2, 'list-data'), (3, 'bad-time')
+    ]
+    assert all(r['status'] == REJECTED for r in rejected)
+    assert rejected[2]['error'] == 'data must be an object'
+
+
+# ============================================================================
+# PATIENT IMPORT ROWS
+# ============================================================================
+
+def test_normalise_row_cleans_values():
+    values = normalise_row(dict(
+        PATIENT, allergies='penicillin; ; latex', is_palmed_member='Yes', id_number=' 9004120000000 '
+    ), user_id=7)
+    assert values[:5] == ('Thandi', 'Mokoena', '1990-04-12', 'Female', '821234567')
+    assert values[9] is True
+    assert values[11] == 'penicillin,latex'
+    assert values[13] == 7
+    assert values[ID_NUMBER] == '9004120000000'
+
+
+@pytest.mark.parametrize('changes, error', [
+    ({'last_name': ''}, 'last_name is required'),
+    ({'date_of_birth': '12/04/1990'}, 'date_of_birth must be YYYY-MM-DD'),
+    ({'gender': 'x'}, 'gender must be one of: Male, Female, Other'),
+    ({'id_number': '1' * 21}, 'id_number must be at most 20 characters'),
+    ({'email': ['a@b.c']}, 'email must be a single value'),
+    ({'province': {'name': 'Gauteng'}}, 'province must be a single value'),
+])
+def test_normalise_row_rejects(changes, error):
+    with pytest.raises(ImportRowError, match=error):
+        normalise_row(dict(PATIENT, **changes), user_id=1)
@@ -0,0 +1,97 @@
+"""
+POLMED Backend - Visit Detail Loader
+Loads visits with their vital signs, clinical notes and prescriptions
+
+All requested sections for any number of visits are fetched in a single
+multi-statement round trip: one SELECT per section, each filtered with
+visit_id IN (...), then grouped per visit in Python.
+"""
+
+from config import Config
+
+VISIT_SQL = "SELECT * FROM patient_visits WHERE id IN ({ids}) AND is_active = TRUE"
+
+# include name -> (response key, query)
+SECTIONS = {
+    'vitals': (
+        'vital_signs',
+        "SELECT * FROM vital_signs WHERE visit_id IN ({ids}) ORDER BY recorded_at DESC"
+    ),
+    'notes': (
+        'clinical_notes',
+        "SELECT * FROM clinical_notes WHERE visit_id IN ({ids}) ORDER BY created_at DESC"
+    ),
+    'prescriptions': (
+        'prescriptions',
+        "SELECT * FROM prescriptions WHERE visit_id IN ({ids}) AND is_active = TRUE ORDER BY created_at DESC"
+    ),
+}
+
+
+def parse_include(value):
+    """
+    Parse ?include=vitals,notes into section names (all sections if empty).
+    Raises ValueError for unknown sections.
+    """
+    if not value:
+        return list(SECTIONS)
+
+    include = []
+    for name in (part.strip().lower() for part in value.split(',')):
+        if not name:
+            continue
+        if name not in SECTIONS:
+            raise ValueError(f'Invalid include "{name}". Must be one of: {", ".join(SECTIONS)}')
+        if name not in include:
+            include.append(name)
+    return include
+
+
+def parse_visit_ids(value, max_ids=None):
+    """Parse ?ids=1,2,3, raising ValueError if malformed or too many"""
+    max_ids = max_ids or Config.MAX_PAGE_SIZE
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+    except (AttributeError, ValueError):
+        raise ValueError('ids must be a comma-separated list of visit ids')
+
+    if not ids:
+        raise ValueError('ids is required')
+    if len(ids) > max_ids:
+        raise ValueError(f'At most {max_ids} visits can be loaded at once')
+    return ids
+
+
+def load_visit_details(cursor, visit_ids, include=None):
+    """
+    Load visits and the requested child sections in one round trip.
+    Returns {visit_id: visit}; inactive or unknown ids are absent.
+    """
+    if not visit_ids:
+        return {}
+    include = list(SECTIONS) if include is None else include
+
+    ids = ', '.join(['%s'] * len(visit_ids))
+    statements = [VISIT_SQL.format(ids=ids)]
+    for name in include:
+        statements.append(SECTIONS[name][1].format(ids=ids))
+
+    params = list(visit_ids) * len(statements)
+    result_sets = [
+        result.fetchall() if result.with_rows else []
+        for result in cursor.execute(';\n'.join(statements), params, multi=True)
+    ]
+
+    visits = {visit['id']: visit for visit in result_sets[0]}
+    for visit in visits.values():
+        for name in include:
+            visit[SECTIONS[name][0]] = []
+
+    for name, rows in zip(include, result_sets[1:]):
+        key = SECTIONS[name][0]
+        for row in rows:
+            visit = visits.get(row['visit_id'])
+            if visit is not None:
+                visit[key].append(row)
+
+    return visits